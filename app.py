@@ -3,17 +3,14 @@
 # Standard library imports
 import os
 import uuid
-import math
 import json
 import tempfile
-from datetime import datetime, timedelta
+from datetime import datetime
 
 # Third-party imports
-import pandas as pd
 import openai
-from pydub import AudioSegment
 from flask import (
-    Flask, render_template, request, url_for, 
+    Flask, render_template, request, url_for, redirect,
     jsonify, send_from_directory, session, current_app
 )
 from flask_cors import CORS
@@ -23,12 +20,15 @@ from werkzeug.utils import secure_filename
 
 # Local imports
 from models import db, Material, PracticeLog
-from core.services.transcribe_utils import transcribe_audio
+from core.services.transcribe_utils import quota_user_id_from_request, transcribe_audio, transcribe_files_parallel
 from core.wer_utils import wer
 from core.diff_viewer import diff_html
+from core.alignment import align
 from core.services.youtube_utils import youtube_bp, check_captions
+from core.services import practice_log_store
+from core.services.preset_catalog import get_catalog
 from config import config_by_name # config.pyから設定辞書をインポート
-from core.responses import api_error_response
+from core.responses import api_error_response, api_success_response
 from core.auth import auth_required # ← これを追加
 from routes.api_routes import api_bp
 from routes.stripe_routes import stripe_bp
@@ -38,7 +38,9 @@ from sqlalchemy.exc import SQLAlchemyError
 import openai
 from werkzeug.exceptions import HTTPException
 from models import db # db をインポート (SQLAlchemyErrorハンドラで使うため)
-from core.audio_utils import AudioProcessingError # import を追加
+from core.audio_utils import AudioProcessingError, iter_audio_chunks # import を追加
+from core.services.job_queue import enqueue_job, job_handler, is_async_request, update_progress, JobError
+from core.services.api_quota import QuotaExceededError
 
 
 
@@ -108,54 +110,23 @@ def generate_wer_matrix(username, logs):
             continue
         key = (level_num, genre)
         wer_matrix[key] = wer
-    df = pd.DataFrame([
-        {"Level": level, "Genre": genre, "WER": wer}
-        for (level, genre), wer in wer_matrix.items()
-    ])
-    pivot = df.pivot(index="Level", columns="Genre", values="WER").sort_index()
-    return pivot.fillna("")
-
-def generate_min_wer_matrix(username, logs):
-    user_logs = [log for log in logs if log.get("user", "").lower() == username.lower()]
-    wer_matrix = {}
+    return pivot_wer_matrix(wer_matrix)
 
-    for log in user_logs:
-        genre = log.get("genre", "")
-        level = log.get("level", "")
-        wer = log.get("wer", None)
-        if not (genre and level and isinstance(wer, (int, float))):
-            continue
-        try:
-            level_num = int(level.lower().replace("level", ""))
-        except:
-            continue
-        key = (level_num, genre)
-        if key not in wer_matrix or wer < wer_matrix[key]:
-            wer_matrix[key] = wer
+def generate_min_wer_matrix(username):
+    return pivot_wer_matrix(practice_log_store.get_min_wer_by_level(username))
 
-    df = pd.DataFrame([
-        {"Level": level, "Genre": genre, "WER": wer}
-        for (level, genre), wer in wer_matrix.items()
-    ])
-    pivot = df.pivot(index="Level", columns="Genre", values="WER").sort_index()
-    return pivot.fillna("")
+def pivot_wer_matrix(wer_matrix):
+    """
+    {(level_number, genre): wer} を Level×Genre の表にする (dashboard.html 用)。
+    (genres, levels, wer_values) を返す。軸はソート済みで、値のないセルは "" になる。
+    """
+    genres = sorted({genre for _, genre in wer_matrix})
+    levels = sorted({level for level, _ in wer_matrix})
+    wer_values = [[wer_matrix.get((level, genre), "") for genre in genres] for level in levels]
+    return genres, levels, wer_values
 
 def get_presets_structure(practice_type="shadowing"):
-    base_path = os.path.join("presets", practice_type)
-    presets = {}
-    if not os.path.exists(base_path):
-        return presets
-
-    for genre in sorted(os.listdir(base_path)):
-        genre_path = os.path.join(base_path, genre)
-        if os.path.isdir(genre_path):
-            levels = sorted([
-                d for d in os.listdir(genre_path)
-                if os.path.isdir(os.path.join(genre_path, d))
-            ])
-            presets[genre] = levels
-
-    return presets
+    return get_catalog().structure(practice_type)
 
 
 # --- エラーハンドラの定義 ---
@@ -234,6 +205,12 @@ def handle_io_error(error):
     current_app.logger.error(f"{log_prefix}: {str(error)}", exc_info=True)
     return api_error_response("ファイルの読み書き中にエラーが発生しました。", 500, log_error=False, exception_info=error, log_prefix=log_prefix)
 
+@app.errorhandler(QuotaExceededError)
+def handle_quota_exceeded_error(error):
+    log_prefix = "QuotaExceededError (Global Handler)"
+    current_app.logger.info(f"{log_prefix}: {str(error)}")
+    return api_error_response("APIコールの上限に達しました。プランをご確認ください。", 402, log_error=False, exception_info=error, log_prefix=log_prefix)
+
 # core.audio_utils.AudioProcessingError のハンドラ
 @app.errorhandler(AudioProcessingError)
 def handle_audio_processing_error(error):
@@ -281,25 +258,9 @@ def index():
 @app.route("/dashboard/<username>")
 @auth_required
 def dashboard(username):
-    try:
-        with open("preset_log.json", "r", encoding="utf-8") as f:
-            logs = json.load(f)
-    except Exception as e:
-        return f"Error loading log: {e}"
+    streak = practice_log_store.get_streak(username, datetime.utcnow().date())
 
-    user_logs = [log for log in logs if log.get("user", "").lower() == username.lower()]
-    date_set = {datetime.fromisoformat(log["timestamp"]).date() for log in user_logs if "timestamp" in log}
-
-    streak = 0
-    today = datetime.utcnow().date()
-    while today in date_set:
-        streak += 1
-        today -= timedelta(days=1)
-
-    wer_table = generate_min_wer_matrix(username, logs)
-    genres = list(wer_table.columns)
-    levels = list(wer_table.index)
-    wer_values = wer_table.values.tolist()
+    genres, levels, wer_values = generate_min_wer_matrix(username)
 
     return render_template("dashboard.html",
                          username=username,
@@ -310,15 +271,7 @@ def dashboard(username):
 
 @app.route("/details/<username>/<genre>/<level>")
 def detail_view(username, genre, level):
-    with open("preset_log.json", "r", encoding="utf-8") as f:
-        logs = json.load(f)
-
-    user_logs = [
-        log for log in logs
-        if log.get("user", "").lower() == username.lower()
-        and log.get("genre") == genre
-        and log.get("level") == level
-    ]
+    user_logs = [log.to_log_dict() for log in practice_log_store.get_user_level_logs(username, genre, level)]
 
     return render_template("detail.html",
                            username=username,
@@ -341,10 +294,11 @@ def read_aloud():
     audio_path = os.path.join(app.config["UPLOAD_FOLDER"], secure_filename(audio_file.filename))
     audio_file.save(audio_path)
 
-    recognized_text = transcribe_audio(audio_path)
+    recognized_text = transcribe_audio(audio_path, quota_user_id=quota_user_id_from_request())
 
-    wer_score = wer(reference_text, recognized_text)
-    diff_result = diff_html(reference_text, recognized_text)
+    alignment = align(reference_text, recognized_text)
+    wer_score = alignment.counts()
+    diff_result = alignment.diff_html()
 
     return render_template("result.html",
                            ref_text=reference_text,
@@ -368,23 +322,25 @@ def show_ranking():
     if not genre or not level:
         return render_template("ranking.html", rankings=None)
 
-    log_path = "preset_log.json"
-    if not os.path.exists(log_path):
-        return render_template("ranking.html", rankings=[],
-                               genre=genre, level=level)
-
-    with open(log_path, "r", encoding="utf-8") as f:
-        logs = json.load(f)
+    # ranking.js が localStorage のユーザー名を ?user= で渡す (なければ cookie)
+    current_user = request.args.get("user") or request.cookies.get("username", "anonymous")
+    page = max(request.args.get("page", 1, type=int), 1)
+    per_page = app.config.get("RANKING_PAGE_SIZE", 50)
 
-    current_user = request.cookies.get("username", "anonymous")
-
-    matched = [entry for entry in logs if entry["genre"] == genre and entry["level"] == level]
-    sorted_entries = sorted(matched, key=lambda x: x["wer"])
+    rankings, has_next = practice_log_store.get_leaderboard(genre, level, limit=per_page,
+                                                            offset=(page - 1) * per_page)
+    if not rankings and page > 1:
+        # 最後のページより後ろを指定された場合は最後のページへ
+        last_page = max(-(-practice_log_store.count_leaderboard(genre, level) // per_page), 1)
+        return redirect(url_for('show_ranking', genre=genre, level=level, user=current_user, page=last_page))
+    my_rank = practice_log_store.get_user_rank(current_user, genre, level)
 
     return render_template("ranking.html",
-                           rankings=sorted_entries,
+                           rankings=rankings,
                            genre=genre, level=level,
-                           current_user=current_user)
+                           current_user=current_user,
+                           my_rank=my_rank,
+                           page=page, has_next=has_next)
 
 
 @app.route('/check_subtitles', methods=["GET"])
@@ -470,6 +426,100 @@ def custom_shadowing_ui():
 def serve_upload(filename):
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
+def transcribe_large_audio(original_filepath, filename_base, on_chunk_done=None, quota_user_id=None):
+    """
+    Whisper のサイズ上限を超える音声をチャンクに分割して文字起こしし、結合したテキストを返す。
+    チャンクは ffmpeg で 1 つずつ切り出し (iter_audio_chunks)、書き出した順に並列で文字起こしする
+    (同時実行数は Config.TRANSCRIBE_MAX_WORKERS)。
+    on_chunk_done(done, total) を渡すと、チャンクごとに進捗を通知する
+    (チャンクの書き出し中も、分割前に決めたチャンク数を total として通知する)。
+    quota_user_id を渡すと、チャンクごとにそのユーザーの API コール枠を消費する。
+    """
+    # 一時的なチャンクファイルのパスを保持するリスト
+    processed_chunk_paths = []
+    planned = {}
+
+    def tracked_chunks():
+        for chunk_filepath in iter_audio_chunks(original_filepath, prefix=f"{filename_base}_chunk_",
+                                                on_plan=lambda num_chunks: planned.update(total=num_chunks)):
+            processed_chunk_paths.append(chunk_filepath) # 削除リストに追加
+            yield chunk_filepath
+
+    def report(done, total):
+        total = total or max(planned.get('total', 0), done + 1)
+        on_chunk_done(done, total)
+
+    try:
+        # いずれかのチャンクが失敗した時点で例外が送出される (未着手のチャンクはキャンセル)
+        transcribed_parts = transcribe_files_parallel(tracked_chunks(), on_file_done=report if on_chunk_done else None,
+                                                      quota_user_id=quota_user_id)
+
+        # 全てのチャンクの文字起こし結果を結合
+        print("全てのチャンクの文字起こしを結合しました。")
+        return " ".join(transcribed_parts).strip()
+
+    finally:
+        # チャンク処理で使用した一時ファイルを削除
+        print("一時チャンクファイルを削除します...")
+        for path in processed_chunk_paths:
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                    print(f"  削除: {path}")
+                except OSError as del_err:
+                    print(f"!! 一時ファイル削除エラー ({path}): {del_err}")
+
+
+def transcribe_uploaded_material(original_filepath, filename_base, on_chunk_done=None, quota_user_id=None):
+    """アップロードされた教材を文字起こしする (サイズが大きい場合はチャンク処理。quota_user_id の枠を消費する)"""
+    file_size = os.path.getsize(original_filepath)
+    print(f"ファイルサイズ: {file_size / (1024*1024):.2f} MB")
+
+    # Whisperのサイズ制限 (transcribe_audio内でチェックされるが、ここでも事前チェック可能)
+    MAX_WHISPER_SIZE = 25 * 1024 * 1024
+
+    if file_size > MAX_WHISPER_SIZE:
+        # サイズが大きい場合はチャンク処理 (既存ロジック)
+        print("ファイルサイズが上限を超えています。分割処理を開始します...")
+        return transcribe_large_audio(original_filepath, filename_base, on_chunk_done, quota_user_id)
+
+    # ファイルサイズが小さい場合は直接文字起こし
+    print("ファイルサイズは上限内です。直接文字起こしします...")
+    final_transcription = transcribe_audio(original_filepath, quota_user_id=quota_user_id)
+    print("直接文字起こし完了。")
+    return final_transcription
+
+
+@job_handler('upload_custom_audio')
+def _run_upload_custom_audio_job(job, payload):
+    """非同期モードの /upload_custom_audio: 文字起こし結果を登録済みの Material に保存する"""
+    material = db.session.get(Material, payload['material_id'])
+    if material is None:
+        raise JobError("教材が見つかりません。")
+
+    update_progress(job, 5, 'transcribing')
+    try:
+        final_transcription = transcribe_uploaded_material(
+            payload['original_filepath'], payload['filename_base'],
+            on_chunk_done=lambda done, total: update_progress(job, 5 + int(90 * done / total), 'transcribing'),
+            quota_user_id=payload.get('quota_user_id')
+        )
+    except Exception:
+        # 同期モードと同様、文字起こしに失敗した教材は残さない
+        db.session.rollback()
+        db.session.delete(db.session.get(Material, payload['material_id']))
+        db.session.commit()
+        raise
+
+    material.transcript = final_transcription
+    db.session.commit()
+    return {
+        "audio_url": payload['audio_url'],
+        "transcription": final_transcription,
+        "material_id": material.id
+    }
+
+
 # --- /upload_custom_audio の修正 ---
 @app.route('/upload_custom_audio', methods=['POST'])
 @auth_required
@@ -498,82 +548,41 @@ def upload_custom_audio():
     original_filename = f"{filename_base}_original{file_ext}"
     original_filepath = os.path.join(app.config['UPLOAD_FOLDER'], original_filename)
 
-    # 一時的なチャンクファイルのパスを保持するリスト
-    processed_chunk_paths = []
-    final_transcription = ""
-
     try:
         audio_file.save(original_filepath)
         print(f"一時ファイル保存先: {original_filepath}")
 
-        file_size = os.path.getsize(original_filepath)
-        print(f"ファイルサイズ: {file_size / (1024*1024):.2f} MB")
-
-        # Whisperのサイズ制限 (transcribe_audio内でチェックされるが、ここでも事前チェック可能)
-        MAX_WHISPER_SIZE = 25 * 1024 * 1024
-
-        if file_size > MAX_WHISPER_SIZE:
-            # サイズが大きい場合はチャンク処理 (既存ロジック)
-            print("ファイルサイズが上限を超えています。分割処理を開始します...")
-            audio = AudioSegment.from_file(original_filepath)
-            duration_ms = len(audio)
-            print(f"音声の長さ: {duration_ms / 1000:.2f} 秒")
-
-            # チャンク設定 (例: 10分ごと、5秒オーバーラップ)
-            TARGET_CHUNK_DURATION_MS = 10 * 60 * 1000
-            CHUNK_OVERLAP_MS = 5000
-
-            transcribed_parts = []
-            num_chunks = math.ceil(duration_ms / (TARGET_CHUNK_DURATION_MS - CHUNK_OVERLAP_MS)) if (TARGET_CHUNK_DURATION_MS - CHUNK_OVERLAP_MS) > 0 else 1
-            print(f"推定チャンク数: {num_chunks}")
-
-            current_pos_ms = 0
-            for chunk_index in range(num_chunks):
-                start_ms = max(0, current_pos_ms - CHUNK_OVERLAP_MS)
-                end_ms = min(current_pos_ms + TARGET_CHUNK_DURATION_MS, duration_ms)
-                print(f"  チャンク {chunk_index + 1}/{num_chunks}: {start_ms/1000:.1f}s - {end_ms/1000:.1f}s")
-
-                # メモリ上でチャンクを作成
-                chunk = audio[start_ms:end_ms]
-
-                # 一時ファイルにチャンクを書き出し
-                with tempfile.NamedTemporaryFile(
-                    prefix=f"{filename_base}_chunk_{chunk_index}_",
-                    suffix=".mp3", # Whisperが扱いやすい形式で出力
-                    dir=app.config['UPLOAD_FOLDER'],
-                    delete=False # transcribe_audioに渡すため削除しない
-                ) as tmp_chunk_file:
-                    chunk_filepath = tmp_chunk_file.name
-                    print(f"    チャンクファイル書き出し中: {chunk_filepath}")
-                    chunk.export(chunk_filepath, format="mp3")
-                    processed_chunk_paths.append(chunk_filepath) # 削除リストに追加
-
-                print(f"    チャンク {chunk_index + 1} 文字起こし中...")
-                # ここで transcribe_audio を呼び出し、エラーハンドリング
-                try:
-                    transcript_part = transcribe_audio(chunk_filepath)
-                    transcribed_parts.append(transcript_part)
-                    print(f"    チャンク {chunk_index + 1} 文字起こし完了.")
-                except Exception as transcribe_err:
-                    # チャンク処理中のエラーハンドリング
-                    print(f"!! チャンク {chunk_index + 1} の文字起こしエラー: {transcribe_err}")
-                    # エラーが発生したら、処理を中断してエラーレスポンスを返す
-                    raise transcribe_err # 上位のtry...exceptで捕捉させる
-
-                # 次のチャンクの開始位置を計算
-                current_pos_ms += TARGET_CHUNK_DURATION_MS
-                # ループの最後で current_pos_ms が duration_ms を超えてもループは終了する
-
-            # 全てのチャンクの文字起こし結果を結合
-            final_transcription = " ".join(transcribed_parts).strip()
-            print("全てのチャンクの文字起こしを結合しました。")
-
-        else:
-            # ファイルサイズが小さい場合は直接文字起こし
-            print("ファイルサイズは上限内です。直接文字起こしします...")
-            # ここで transcribe_audio を呼び出し、エラーハンドリング
-            final_transcription = transcribe_audio(original_filepath)
-            print("直接文字起こし完了。")
+        if is_async_request():
+            # 非同期モード: Material を先に登録し (transcript は未設定)、文字起こしはワーカーに任せる。
+            # 評価時に transcript がまだなければ、evaluate_custom_shadowing がエラーを返す。
+            new_material = Material(
+                user_id=user_id,
+                material_name=audio_file.filename,
+                storage_key=original_filepath,
+                transcript=None,
+                upload_timestamp=datetime.utcnow()
+            )
+            db.session.add(new_material)
+            db.session.commit()
+            session['current_material_id'] = new_material.id
+            session.pop('custom_transcription', None)
+
+            job = enqueue_job('upload_custom_audio', {
+                "material_id": new_material.id,
+                "original_filepath": original_filepath,
+                "filename_base": filename_base,
+                "audio_url": url_for('serve_upload', filename=original_filename),
+                "quota_user_id": quota_user_id_from_request()
+            }, user_id=user_id)
+            return api_success_response({
+                "job_id": job.id,
+                "status": job.status,
+                "status_url": url_for('api.get_job', job_id=job.id),
+                "material_id": new_material.id
+            }, 202)
+
+        final_transcription = transcribe_uploaded_material(original_filepath, filename_base,
+                                                           quota_user_id=quota_user_id_from_request())
 
         # データベースにMaterialを保存 (成功した場合のみ)
         print("データベースにMaterialを保存します...")
@@ -619,18 +628,8 @@ def upload_custom_audio():
         # api_error_response が内部で500番台の時に汎用メッセージに置換 & 詳細ロギング
         return api_error_response(f"アップロード処理中に予期せぬエラーが発生しました: {type(e).__name__}", 500, exception_info=e, log_prefix=log_prefix)
 
-    finally:
-        # チャンク処理で使用した一時ファイルを削除
-        print("一時チャンクファイルを削除します...")
-        for path in processed_chunk_paths:
-            if os.path.exists(path):
-                try:
-                    os.remove(path)
-                    print(f"  削除: {path}")
-                except OSError as del_err:
-                    print(f"!! 一時ファイル削除エラー ({path}): {del_err}")
-        # DBセッションのクリーンアップ (リクエスト終了時に自動で行われることが多いが明示的に行う場合)
-        # db.session.remove()
+    # DBセッションのクリーンアップ (リクエスト終了時に自動で行われることが多いが明示的に行う場合)
+    # db.session.remove()
 
 # app.py (修正案)
 # (TimeoutError, ConnectionError, PermissionError, RuntimeError は組み込み or transcribe_utilsでraiseされる)
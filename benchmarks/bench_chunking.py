@@ -0,0 +1,98 @@
+# benchmarks/bench_chunking.py
+"""
+長い音声のチャンク分割のベンチマーク (ffmpeg / ffprobe が必要)。
+
+変更前の方式 (AudioSegment.from_file で全体を PCM にデコードし、pydub でスライスして mp3 に再エンコード) と、
+core.audio_utils.iter_audio_chunks (ffmpeg で時間を指定して切り出し、可能ならストリームコピー) を比較する。
+メモリ使用量を正しく測るため、各方式は別プロセスで実行し、その最大 RSS を表示する
+(Python 本体と import したモジュールの分 (数十MB) を含む)。
+
+    python -m benchmarks.bench_chunking --minutes 60
+    python -m benchmarks.bench_chunking --input lecture.mp3
+"""
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def make_input(minutes, directory):
+    """テスト用の長い mp3 (正弦波, 64kbps) を作る"""
+    path = os.path.join(directory, f"bench_{minutes}min.mp3")
+    subprocess.run(
+        ['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', f"sine=frequency=440:duration={minutes * 60}",
+         '-ac', '1', '-b:a', '64k', path],
+        check=True
+    )
+    return path
+
+
+def legacy_chunks(path, out_dir, chunk_ms, overlap_ms):
+    """変更前: 全体をデコードしてからスライスして書き出す"""
+    from pydub import AudioSegment
+    audio = AudioSegment.from_file(path)
+    duration_ms = len(audio)
+    index = 0
+    while index * chunk_ms < duration_ms:
+        start_ms = max(0, index * chunk_ms - overlap_ms)
+        chunk_path = os.path.join(out_dir, f"legacy_{index}.mp3")
+        audio[start_ms:(index + 1) * chunk_ms].export(chunk_path, format="mp3")
+        yield chunk_path
+        index += 1
+
+
+def streaming_chunks(path, out_dir):
+    from flask import Flask
+    from config import Config
+    from core.audio_utils import iter_audio_chunks
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config['UPLOAD_FOLDER'] = out_dir
+    with app.app_context():
+        yield from iter_audio_chunks(path, prefix="streaming_")
+
+
+def run_mode(mode, path):
+    from config import Config
+    out_dir = tempfile.mkdtemp(prefix="bench_chunks_")
+    try:
+        start = time.perf_counter()
+        if mode == 'legacy':
+            chunks = legacy_chunks(path, out_dir, Config.TARGET_CHUNK_DURATION_MS, Config.CHUNK_OVERLAP_MS)
+        else:
+            chunks = streaming_chunks(path, out_dir)
+        sizes = [os.path.getsize(chunk) for chunk in chunks]
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{mode:>9}: {len(sizes):3d} chunks, {sum(sizes) / 2**20:7.1f} MB written, "
+          f"{elapsed:7.2f}s, peak RSS {peak_rss:7.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--input', help='分割する音声ファイル (省略時は --minutes の長さで生成)')
+    parser.add_argument('--minutes', type=int, default=60)
+    parser.add_argument('--mode', choices=['legacy', 'streaming'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.input)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.input or make_input(args.minutes, directory)
+        print(f"input: {path} ({os.path.getsize(path) / 2**20:.1f} MB)")
+        for mode in ('legacy', 'streaming'):
+            subprocess.run([sys.executable, '-m', 'benchmarks.bench_chunking', '--mode', mode, '--input', path], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# benchmarks/bench_cold_start.py
+"""
+アプリのコールドスタート (gunicorn ワーカー 1 つ分の `import app`) の時間とメモリのベンチマーク。
+
+毎回新しい Python プロセスで `import app` を実行し、import にかかった時間と、
+そのプロセスの最大 RSS の中央値を表示する。pandas などの重いモジュールが読み込まれたかも表示する。
+
+    python -m benchmarks.bench_cold_start --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+_CHILD = r"""
+import json, resource, sys, time
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "seconds": elapsed,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "heavy": sorted(name for name in ("pandas", "scipy", "matplotlib") if name in sys.modules),
+}))
+"""
+
+
+def run_once():
+    env = dict(os.environ)
+    # import だけを測るので、設定されていなければダミーの値を入れる
+    env.setdefault('YOUTUBE_API_KEY', 'bench')
+    env.setdefault('OPENAI_API_KEY', 'bench')
+    env.setdefault('DATABASE_URL', 'sqlite://')
+    output = subprocess.run([sys.executable, '-c', _CHILD], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    run_once()  # 1 回目はディスクキャッシュを温めるだけ
+    results = [run_once() for _ in range(args.repeat)]
+    seconds = statistics.median(r["seconds"] for r in results)
+    rss = statistics.median(r["rss_mb"] for r in results)
+    heavy = ", ".join(results[0]["heavy"]) or "none"
+    print(f"import app: {seconds * 1000:.0f} ms, peak RSS {rss:.1f} MB, heavy modules loaded: {heavy}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# benchmarks/bench_evaluate_request.py
+"""
+/api/evaluate_shadowing の 1 回のリクエストの大きさ (multipart の本文のバイト数) を比べる。
+
+変更前: shadowing-main.js が教材音声 (presets/shadowing/<genre>/<level>/audio.mp3) を毎回 original_audio として送っていた。
+変更後: 教材は genre / level だけで指定し、送るのは録音だけ。
+録音はブラウザと同じ webm/Opus を ffmpeg で教材と同じ長さだけ作る (--recording で実際の録音も指定できる)。
+
+    python -m benchmarks.bench_evaluate_request --genre genre1 --level level1
+"""
+import argparse
+import io
+import os
+import tempfile
+
+from flask import Flask
+from werkzeug.test import EnvironBuilder
+
+from benchmarks.bench_trim import make_recording
+from config import Config
+from core.audio_utils import probe_duration_ms
+
+
+def request_bytes(fields, files):
+    data = dict(fields)
+    for name, (payload, filename) in files.items():
+        data[name] = (io.BytesIO(payload), filename)
+    builder = EnvironBuilder(path='/api/evaluate_shadowing', method='POST', data=data)
+    try:
+        return len(builder.get_environ()['wsgi.input'].read())
+    finally:
+        builder.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--genre', default='genre1')
+    parser.add_argument('--level', default='level1')
+    parser.add_argument('--presets', default='presets')
+    parser.add_argument('--recording', help='録音ファイル (省略時は教材と同じ長さで生成)')
+    args = parser.parse_args()
+
+    audio_path = os.path.join(args.presets, 'shadowing', args.genre, args.level, 'audio.mp3')
+    with open(audio_path, 'rb') as f:
+        original_audio = f.read()
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    with tempfile.TemporaryDirectory() as directory, app.app_context():
+        if args.recording:
+            with open(args.recording, 'rb') as f:
+                recorded_audio = f.read()
+        else:
+            seconds = max(1, round(probe_duration_ms(audio_path) / 1000))
+            recorded_audio = make_recording(seconds, directory)
+
+    fields = {"username": "anonymous", "genre": args.genre, "level": args.level}
+    before = request_bytes(fields, {"original_audio": (original_audio, "blob"),
+                                    "recorded_audio": (recorded_audio, "blob")})
+    after = request_bytes(fields, {"recorded_audio": (recorded_audio, "blob")})
+
+    print(f"preset {args.genre}/{args.level}: audio.mp3 {len(original_audio) / 1024:.0f} KB, "
+          f"recording {len(recorded_audio) / 1024:.0f} KB")
+    print(f"before: {before / 1024:8.1f} KB per request")
+    print(f"after:  {after / 1024:8.1f} KB per request ({(1 - after / before) * 100:.0f}% smaller)")
+
+
+if __name__ == '__main__':
+    main()
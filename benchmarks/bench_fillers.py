@@ -0,0 +1,65 @@
+# benchmarks/bench_fillers.py
+"""
+長い文字起こしでのフィラー除去のベンチマーク。
+
+変更前の方式 (正規化済みトークンを join → remove_fillers で lower/split → 再 split、
+1 語のフィラーしか除去できない) と、正規化済みトークン列に直接かける
+remove_filler_tokens (複数語のフィラーもトライで 1 パス除去) を比較する。
+
+    python -m benchmarks.bench_fillers --words 10000 100000
+"""
+import argparse
+import random
+import time
+
+from core.text_utils import FILLER_WORDS, normalize_text, remove_filler_tokens
+
+CONTENT = (
+    "shadowing practice helps learners improve pronunciation rhythm and intonation "
+    "by repeating native speech immediately after hearing it every day"
+).split()
+FILLERS = sorted(FILLER_WORDS)
+
+
+def legacy_remove_fillers(tokens):
+    """変更前: 文字列に戻して 1 語ずつ比較し、また分割する"""
+    text = ' '.join(tokens)
+    return ' '.join([t for t in text.lower().split() if t not in FILLER_WORDS]).split()
+
+
+def make_transcript(n_words, filler_rate=0.1, seed=0):
+    rng = random.Random(seed)
+    words = []
+    while len(words) < n_words:
+        if rng.random() < filler_rate:
+            words.append(rng.choice(FILLERS))
+        else:
+            words.append(rng.choice(CONTENT))
+    return ' '.join(words)
+
+
+def best_of(func, arg, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(arg)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--words', type=int, nargs='+', default=[10000, 100000])
+    args = parser.parse_args()
+
+    print(f"{'words':>8} {'legacy [ms]':>12} {'trie [ms]':>10} {'speedup':>8} {'legacy kept':>12} {'trie kept':>10}")
+    for n in args.words:
+        tokens = normalize_text(make_transcript(n, seed=n))
+        old_time, old_tokens = best_of(legacy_remove_fillers, tokens)
+        new_time, new_tokens = best_of(remove_filler_tokens, tokens)
+        print(f"{n:>8} {old_time * 1000:>12.2f} {new_time * 1000:>10.2f} {old_time / new_time:>7.1f}x "
+              f"{len(old_tokens):>12} {len(new_tokens):>10}")
+
+
+if __name__ == '__main__':
+    main()
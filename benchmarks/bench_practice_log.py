@@ -0,0 +1,78 @@
+# benchmarks/bench_practice_log.py
+"""
+練習ログ 1 件の書き込みコストのベンチマーク。
+
+変更前の方式 (JSON 配列のファイルを読み込み → append → 全体を書き直す) と、
+core.services.practice_log_file.append_record (JSONL に 1 行追記) を、既存のログ件数を変えて比較する。
+
+    python -m benchmarks.bench_practice_log --sizes 1000 10000 100000
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from core.services.practice_log_file import PracticeLogWriter
+
+
+def make_entry(i):
+    return {
+        "timestamp": "2025-04-03T14:01:40.538967",
+        "user": f"user{i % 500}",
+        "genre": f"genre{i % 3 + 1}",
+        "level": f"level{i % 10 + 1}",
+        "wer": 42.0,
+        "original_transcribed": "This is sample script text for genre1 level 1.",
+        "user_transcribed": "This is simple script text for a general one, level one.",
+        "script_excerpt": "This is sample script text for genre1 level 1.",
+    }
+
+
+def legacy_append(path, entry):
+    """変更前: 全件を読み込んで 1 件足し、ファイル全体を書き直す"""
+    with open(path, "r", encoding="utf-8") as f:
+        logs = json.load(f)
+    logs.append(entry)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(logs, f, ensure_ascii=False, indent=2)
+
+
+def measure(func, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(i)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'entries':>8} {'legacy':>10} {'append':>10} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            entries = [make_entry(i) for i in range(size)]
+
+            json_path = os.path.join(directory, f"log_{size}.json")
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False, indent=2)
+            legacy = measure(lambda i: legacy_append(json_path, make_entry(i)), args.repeat)
+
+            jsonl_path = os.path.join(directory, f"log_{size}.jsonl")
+            with open(jsonl_path, "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+            writer = PracticeLogWriter(jsonl_path)
+            append = measure(lambda i: writer.append(make_entry(i)), args.repeat)
+            writer.close()
+
+            print(f"{size:>8} {legacy * 1000:>8.2f}ms {append * 1000:>8.3f}ms {legacy / append:>7.0f}x")
+
+
+if __name__ == '__main__':
+    main()
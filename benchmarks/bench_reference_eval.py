@@ -0,0 +1,104 @@
+# benchmarks/bench_reference_eval.py
+"""
+/api/evaluate_shadowing の採点部分 (文字起こしの後) の CPU 時間のベンチマーク。
+
+変更前: 評価のたびに presets/shadowing/<genre>/<level>/script.txt を os.path.exists + 読み込みし、
+        正規化・フィラー除去・単語 ID への変換をやり直していた。
+変更後: プリセットカタログが読み込み時にスクリプトを EncodedReference にしておき、それとアラインメントする。
+
+全シャドウイング教材について、スクリプトの一部の単語を置き換え・削除した発話で評価 1 回あたりの
+CPU 時間 (time.thread_time) の中央値を比べ、WER と diff が一致することも確認する。
+
+    python -m benchmarks.bench_reference_eval --repeat 50
+    python -m benchmarks.bench_reference_eval --lenient
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+
+from core.alignment import align
+from core.services.preset_catalog import PresetCatalog
+from core.text_utils import _normalize, remove_filler_tokens
+from core.wer_utils import align_tokens, wer_from_ops
+
+
+def make_hypothesis(script, rng):
+    """スクリプトの単語の 1 割を置き換え、1 割を落とした発話"""
+    words = []
+    for word in script.split():
+        roll = rng.random()
+        if roll < 0.1:
+            continue
+        words.append("something" if roll < 0.2 else word)
+    return " ".join(words)
+
+
+def legacy_evaluate(script_path, hypothesis, lenient):
+    """変更前: ファイルを確認・読み込みして参照側もその場で正規化する (LRU キャッシュも通らない)"""
+    if not os.path.exists(script_path):
+        raise FileNotFoundError(script_path)
+    with open(script_path, 'r', encoding='utf-8') as f:
+        original = f.read().strip()
+    r = remove_filler_tokens(_normalize(original))
+    h = remove_filler_tokens(_normalize(hypothesis))
+    ops = align_tokens(r, h, lenient)
+    return wer_from_ops(ops, len(r))[0]
+
+
+def cpu_ms(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.thread_time()
+        func()
+        times.append(time.thread_time() - start)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--presets', default='presets')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--lenient', action='store_true')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    catalog = PresetCatalog(args.presets)
+    print(f"catalog load (scan + encode all scripts): {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    rng = random.Random(0)
+    legacy_total = cached_total = 0.0
+    count = 0
+    for genre, levels in sorted(catalog.shadowing.items()):
+        for level, preset in sorted(levels.items()):
+            if not preset["script"]:
+                continue
+            script_path = os.path.join(args.presets, 'shadowing', genre, level, 'script.txt')
+            hypothesis = make_hypothesis(preset["script"], rng)
+
+            expected = align(preset["script"], hypothesis, lenient=args.lenient)
+            actual = align(preset["reference"], hypothesis, lenient=args.lenient)
+            assert actual.counts() == expected.counts(), (genre, level)
+            assert actual.diff_html('user') == expected.diff_html('user'), (genre, level)
+            assert legacy_evaluate(script_path, hypothesis, args.lenient) == actual.wer_percent, (genre, level)
+
+            # diff の生成は変更前後で同じなので、WER を求めるところまでを比べる
+            legacy = cpu_ms(lambda: legacy_evaluate(script_path, hypothesis, args.lenient), args.repeat)
+            cached = cpu_ms(lambda: align(preset["reference"], hypothesis, lenient=args.lenient).counts(),
+                            args.repeat)
+            legacy_total += legacy
+            cached_total += cached
+            count += 1
+
+    if not count:
+        print("no shadowing presets found")
+        return
+    print(f"{count} presets, lenient={args.lenient}")
+    print(f"before: {legacy_total / count:.3f} ms CPU per evaluation")
+    print(f"after:  {cached_total / count:.3f} ms CPU per evaluation "
+          f"({legacy_total / cached_total:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
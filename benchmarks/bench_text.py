@@ -0,0 +1,105 @@
+# benchmarks/bench_text.py
+"""
+core.text_utils の正規化パイプラインのマイクロベンチマーク。
+
+変更前の normalize_text + remove_fillers (文字列の join/split を往復する版) と、
+1 パスの normalize_tokens、LRU キャッシュ付きの normalize_reference_tokens の
+スループット (tokens/sec) を比較する。入力には presets/shadowing の全スクリプトを使う。
+
+    python -m benchmarks.bench_text
+"""
+import argparse
+import glob
+import os
+import re
+import time
+import unicodedata
+
+from core.text_utils import (
+    FILLER_WORDS, NUMBER_MAP, normalize_reference_tokens, normalize_tokens, remove_filler_tokens,
+)
+
+
+def legacy_normalize_text(text):
+    """変更前の core.text_utils.normalize_text (比較用)"""
+    if not isinstance(text, str):
+        return []
+    text = unicodedata.normalize('NFKC', text)
+    text = text.lower()
+    words = text.split()
+    normalized_words = []
+    i = 0
+    while i < len(words):
+        word = words[i]
+        word = NUMBER_MAP.get(word, word)
+        if word == "gen" and i + 1 < len(words) and words[i + 1].isdigit():
+            normalized_words.append("genre")
+            normalized_words.append(words[i + 1])
+            i += 1
+        elif word.startswith("genre") and len(word) > 5 and word[5:].isdigit():
+            normalized_words.append("genre")
+            normalized_words.append(word[5:])
+        elif word == "im":
+            normalized_words.append("i'm")
+        else:
+            cleaned_word = re.sub(r'[^\w\s\']', '', word)
+            cleaned_word = cleaned_word.strip('.,;:!?(){}[]"\'')
+            if cleaned_word:
+                normalized_words.append(cleaned_word)
+        i += 1
+    final_text = ' '.join(normalized_words)
+    final_text = re.sub(r'\s+', ' ', final_text).strip()
+    return final_text.split() if final_text else []
+
+
+def legacy_tokenize(text):
+    """変更前の wer() の前処理: normalize_text → join → remove_fillers → split"""
+    normalized_list = legacy_normalize_text(text)
+    joined = ' '.join(normalized_list)
+    return [t for t in joined.lower().split() if t not in FILLER_WORDS] if normalized_list else []
+
+
+def load_scripts(preset_folder):
+    texts = []
+    for path in sorted(glob.glob(os.path.join(preset_folder, 'shadowing', '*', '*', 'script.txt'))):
+        with open(path, encoding='utf-8') as f:
+            texts.append(f.read())
+    return texts
+
+
+def throughput(func, texts, repeat):
+    """(tokens/sec, 出力トークン数) を返す"""
+    n_tokens = sum(len(t.split()) for t in texts) * repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            func(text)
+    return n_tokens / (time.perf_counter() - start), n_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--presets', default='presets')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    texts = load_scripts(args.presets)
+    if not texts:
+        parser.error(f"スクリプトが見つかりません: {args.presets}")
+    for text in texts:
+        expected = remove_filler_tokens(legacy_normalize_text(text))
+        assert expected == normalize_tokens(text) == list(normalize_reference_tokens(text))
+
+    print(f"{len(texts)} scripts, {sum(len(t.split()) for t in texts)} words")
+    baseline, _ = throughput(legacy_tokenize, texts, args.repeat)
+    for name, func in [
+        ('legacy normalize+fillers', legacy_tokenize),
+        ('normalize_tokens', normalize_tokens),
+        ('normalize_reference_tokens', normalize_reference_tokens),
+    ]:
+        rate, _ = throughput(func, texts, args.repeat)
+        print(f"{name:<28} {rate:>14,.0f} tokens/sec {rate / baseline:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# benchmarks/bench_trim.py
+"""
+録音の先頭カット + 変換 (evaluate_shadowing の cut_head_ms=500) のベンチマーク (ffmpeg が必要)。
+
+変更前の方式 (FileStorage を一時保存 → AudioSegment.from_file で全体を PCM に展開 → スライス → export) と、
+core.audio_utils.encode_for_upload (アップロードのストリームを ffmpeg に流し込み、-ss とエンコードを 1 回で実行) を比較する。
+入力はブラウザの録音と同じ webm/Opus。文字起こし (API 呼び出し) は含まない。
+
+    python -m benchmarks.bench_trim --seconds 30 60 180 300
+"""
+import argparse
+import io
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+
+from flask import Flask
+from werkzeug.datastructures import FileStorage
+
+from config import Config
+from core.audio_utils import encode_for_upload, save_upload_to_temp
+
+CUT_HEAD_MS = 500
+
+
+def make_recording(seconds, directory):
+    """ブラウザの録音に近い webm/Opus (48kHz モノラル) を作る"""
+    path = os.path.join(directory, f"rec_{seconds}s.webm")
+    subprocess.run(
+        ['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', f"anoisesrc=d={seconds}:a=0.1",
+         '-ac', '1', '-ar', '48000', '-c:a', 'libopus', '-b:a', '48k', path],
+        check=True
+    )
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def legacy_process(file_storage, output_path):
+    """変更前: 一時保存して pydub で全体をデコードし、スライスして書き出す"""
+    from pydub import AudioSegment
+    input_path = save_upload_to_temp(file_storage)
+    try:
+        audio = AudioSegment.from_file(input_path)[CUT_HEAD_MS:]
+        audio.set_channels(1).set_frame_rate(16000).export(
+            output_path, format="ogg", codec="libopus", bitrate="24k", parameters=['-compression_level', '5']
+        )
+    finally:
+        os.remove(input_path)
+
+
+def fast_process(file_storage, output_path):
+    encode_for_upload(file_storage.stream, output_path, CUT_HEAD_MS, "ogg")
+
+
+def measure(func, data, directory, repeat):
+    times = []
+    for _ in range(repeat):
+        file_storage = FileStorage(stream=io.BytesIO(data), filename="recording.webm")
+        output_path = os.path.join(directory, "processed.ogg")
+        start = time.perf_counter()
+        func(file_storage, output_path)
+        times.append(time.perf_counter() - start)
+        os.remove(output_path)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=int, nargs='+', default=[30, 60, 180, 300])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    with tempfile.TemporaryDirectory() as directory, app.app_context():
+        app.config['UPLOAD_FOLDER'] = directory
+        print(f"{'length':>7} {'input':>9} {'legacy':>9} {'ffmpeg':>9} {'speedup':>8}")
+        for seconds in args.seconds:
+            data = make_recording(seconds, directory)
+            legacy = measure(legacy_process, data, directory, args.repeat)
+            fast = measure(fast_process, data, directory, args.repeat)
+            print(f"{seconds:>6}s {len(data) / 1024:>7.0f}KB {legacy:>8.3f}s {fast:>8.3f}s {legacy / fast:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
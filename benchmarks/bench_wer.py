@@ -0,0 +1,164 @@
+# benchmarks/bench_wer.py
+"""
+core.wer_utils.wer のベンチマーク。
+
+旧実装 (Python の二重ループで uint16 行列を埋める版) と現在の実装を
+100 / 1k / 10k 語で比較し、結果 (S, D, I, N) が一致することも確認する。
+
+    python -m benchmarks.bench_wer            # 旧実装は 1k 語まで
+    python -m benchmarks.bench_wer --full     # 10k 語でも旧実装を走らせる (数分かかる)
+    python -m benchmarks.bench_wer --memory   # 行列全体 / 線形メモリモードのピークメモリ比較
+    python -m benchmarks.bench_wer --lenient  # lenient=True で比較する
+"""
+import argparse
+import difflib
+import random
+import time
+import tracemalloc
+
+import numpy as np
+
+from core.text_utils import normalize_text, remove_fillers
+import core.wer_utils as wer_utils
+from core.wer_utils import strip_punct, wer
+
+VOCAB = (
+    "the quick brown fox jumps over lazy dog shadowing practice helps learners "
+    "improve pronunciation rhythm and intonation by repeating native speech "
+    "immediately after hearing it every day for ten minutes"
+).split()
+
+
+def legacy_wer(reference, hypothesis, lenient=False):
+    """変更前の core.wer_utils.wer をそのまま残したもの (比較用)"""
+    r_normalized_list = normalize_text(reference)
+    h_normalized_list = normalize_text(hypothesis)
+    r = remove_fillers(' '.join(r_normalized_list)).split() if r_normalized_list else []
+    h = remove_fillers(' '.join(h_normalized_list)).split() if h_normalized_list else []
+
+    rows = len(r) + 1
+    cols = len(h) + 1
+    d = np.zeros((rows, cols), dtype=np.uint16)
+    for i in range(rows):
+        d[i][0] = i
+    for j in range(cols):
+        d[0][j] = j
+
+    for i in range(1, rows):
+        for j in range(1, cols):
+            r_word = strip_punct(r[i-1]).lower()
+            h_word = strip_punct(h[j-1]).lower()
+            if lenient:
+                ratio = difflib.SequenceMatcher(None, r_word, h_word).ratio()
+                cost = 0 if ratio >= 0.85 else 1
+            else:
+                cost = 0 if r_word == h_word else 1
+            d[i][j] = min(d[i-1][j] + 1, d[i][j-1] + 1, d[i-1][j-1] + cost)
+
+    i, j = len(r), len(h)
+    S = D = I = 0
+    while i > 0 and j > 0:
+        if r[i-1] == h[j-1] or (lenient and difflib.SequenceMatcher(None, r[i-1], h[j-1]).ratio() >= 0.85):
+            i -= 1
+            j -= 1
+        elif d[i][j] == d[i-1][j-1] + 1:
+            S += 1
+            i -= 1
+            j -= 1
+        elif d[i][j] == d[i-1][j] + 1:
+            D += 1
+            i -= 1
+        elif d[i][j] == d[i][j-1] + 1:
+            I += 1
+            j -= 1
+    D += i
+    I += j
+    N = len(r)
+    wer_percent = ((S + D + I) / N) * 100 if N > 0 else 0
+    return wer_percent, S, D, I, N
+
+
+def make_pair(n_words, error_rate=0.15, seed=0):
+    """参照テキストと、置換・脱落・挿入を混ぜた仮説テキストを作る"""
+    rng = random.Random(seed)
+    ref = [rng.choice(VOCAB) for _ in range(n_words)]
+    hyp = []
+    for word in ref:
+        roll = rng.random()
+        if roll < error_rate / 6:
+            hyp.append(rng.choice(VOCAB))        # substitution
+        elif roll < error_rate / 3:
+            hyp.append(word + 's')               # near miss (lenient なら一致)
+        elif roll < 2 * error_rate / 3:
+            continue                             # deletion
+        elif roll < error_rate:
+            hyp.extend([word, rng.choice(VOCAB)])  # insertion
+        else:
+            hyp.append(word)
+    return ' '.join(ref), ' '.join(hyp)
+
+
+def timed(func, *args, repeat=3):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def peak_memory(func, *args):
+    """tracemalloc で計測したピークメモリ (MB) と結果を返す"""
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / (1024 * 1024), result
+
+
+def memory_report(sizes):
+    """WER_FULL_MATRIX_MAX_CELLS を無効化した場合と既定値の場合のピークメモリを比べる"""
+    default_limit = wer_utils.WER_FULL_MATRIX_MAX_CELLS
+    print(f"{'words':>8} {'full [MB]':>10} {'linear [MB]':>12} {'linear [s]':>11}  result")
+    for n in sizes:
+        ref, hyp = make_pair(n, seed=n)
+        try:
+            wer_utils.WER_FULL_MATRIX_MAX_CELLS = float('inf')
+            full_mb, full_result = peak_memory(wer, ref, hyp)
+        finally:
+            wer_utils.WER_FULL_MATRIX_MAX_CELLS = default_limit
+        linear_time, _ = timed(wer, ref, hyp, repeat=1)
+        linear_mb, linear_result = peak_memory(wer, ref, hyp)
+        assert full_result == linear_result, (full_result, linear_result)
+        print(f"{n:>8} {full_mb:>10.1f} {linear_mb:>12.1f} {linear_time:>11.3f}  {linear_result[1:]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--full', action='store_true', help='旧実装も全サイズで計測する')
+    parser.add_argument('--memory', action='store_true', help='ピークメモリを計測する')
+    parser.add_argument('--lenient', action='store_true', help='lenient=True で計測する')
+    args = parser.parse_args()
+
+    if args.memory:
+        memory_report(args.sizes)
+        return
+
+    print(f"{'words':>8} {'legacy [s]':>12} {'current [s]':>12} {'speedup':>9}  result")
+    for n in args.sizes:
+        ref, hyp = make_pair(n, seed=n)
+        new_time, new_result = timed(wer, ref, hyp, args.lenient)
+        if args.full or n <= 1000:
+            old_time, old_result = timed(legacy_wer, ref, hyp, args.lenient, repeat=1)
+            assert old_result == new_result, (old_result, new_result)
+            print(f"{n:>8} {old_time:>12.4f} {new_time:>12.4f} {old_time / new_time:>8.1f}x  {new_result[1:]}")
+        else:
+            print(f"{n:>8} {'(skipped)':>12} {new_time:>12.4f} {'-':>9}  {new_result[1:]}")
+
+
+if __name__ == '__main__':
+    main()
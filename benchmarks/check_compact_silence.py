@@ -0,0 +1,56 @@
+# benchmarks/check_compact_silence.py
+"""
+無音の詰め (core.audio_utils.compact_silence) が、短い録音でも例外を出さないことの確認 (ffmpeg は不要)。
+
+発話の前後に残す padding (既定 200ms) の膨張処理は、フレーム数が 2 * padding + 1 フレーム (既定で約 390ms) より
+少ないと配列の長さが合わなくなっていた (誤タップなどの短い録音で 500 エラー)。
+数十 ms から数秒までの合成音声 (無音 + 正弦波 + 無音) を渡し、例外・出力が入力より長い・発話が消えた場合は終了コード 1 で終わる。
+
+    python -m benchmarks.check_compact_silence
+"""
+import sys
+
+import numpy as np
+
+from core.audio_utils import compact_silence
+
+SAMPLE_RATE = 16000
+# 30ms フレーム・padding 200ms で膨張のカーネルは 13 フレーム (390ms)。その前後と長い録音を試す
+DURATIONS_MS = (0, 10, 30, 100, 250, 300, 389, 390, 420, 1000, 5000)
+
+
+def make_clip(duration_ms):
+    """前後 1/4 が無音、中央が 440Hz の正弦波の PCM (int16)"""
+    n = SAMPLE_RATE * duration_ms // 1000
+    samples = np.zeros(n, dtype=np.int16)
+    start, end = n // 4, n - n // 4
+    t = np.arange(end - start) / SAMPLE_RATE
+    samples[start:end] = (np.sin(2 * np.pi * 440 * t) * 8000).astype(np.int16)
+    return samples
+
+
+def main():
+    failures = []
+    for duration_ms in DURATIONS_MS:
+        samples = make_clip(duration_ms)
+        try:
+            compacted, removed_ms = compact_silence(samples, sample_rate=SAMPLE_RATE)
+        except Exception as e:
+            print(f"  {duration_ms:>5}ms  {type(e).__name__}: {e}")
+            failures.append(f"{duration_ms}ms: {type(e).__name__}")
+            continue
+        print(f"  {duration_ms:>5}ms  -> {len(compacted) * 1000 // SAMPLE_RATE:>5}ms ({removed_ms}ms 削除)")
+        if len(compacted) > len(samples) or removed_ms < 0:
+            failures.append(f"{duration_ms}ms: output is longer than the input")
+        elif np.count_nonzero(samples) and not np.count_nonzero(compacted):
+            failures.append(f"{duration_ms}ms: speech was removed")
+
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+    print("ok")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# benchmarks/check_upload_determinism.py
+"""
+文字起こしに送るファイルの変換 (core.audio_utils.prepare_upload) が、同じ入力から常に同じバイト列を作ることの確認 (ffmpeg が必要)。
+
+文字起こしキャッシュ (transcription_cache) は送信するファイルの sha256 をキーにするので、
+再エンコードのたびに出力が変わる (ogg のシリアル番号・エンコーダのメタデータなど) とキャッシュに当たらない。
+形式 (ogg / mp3 / wav)・VAD のあり / なし・パス入力 / ストリーム入力の組み合わせごとに 2 回変換し、
+sha256 が一致しなければ終了コード 1 で終わる。先頭カット (evaluate_shadowing の cut_head_ms=500) で必ず再エンコードさせる。
+
+    python -m benchmarks.check_upload_determinism
+    python -m benchmarks.check_upload_determinism --seconds 60
+"""
+import argparse
+import io
+import itertools
+import os
+import sys
+import tempfile
+
+from flask import Flask
+
+from benchmarks.bench_trim import CUT_HEAD_MS, make_recording
+from config import Config
+from core.audio_utils import prepare_upload
+from core.services.transcribe_utils import compute_file_hash
+
+FORMATS = ("ogg", "mp3", "wav")
+
+
+def upload_hash(input_path, data, target_format, use_stream):
+    """prepare_upload で変換したファイルの sha256"""
+    if use_stream:
+        path, is_temp, _ = prepare_upload(io.BytesIO(data), CUT_HEAD_MS, target_format)
+    else:
+        path, is_temp, _ = prepare_upload(input_path, CUT_HEAD_MS, target_format, input_path=input_path)
+    try:
+        return compute_file_hash(path)
+    finally:
+        if is_temp:
+            os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=int, default=10)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    failures = []
+    with tempfile.TemporaryDirectory() as directory, app.app_context():
+        app.config['UPLOAD_FOLDER'] = directory
+        data = make_recording(args.seconds, directory)
+        input_path = os.path.join(directory, f"rec_{args.seconds}s.webm")
+
+        for target_format, vad_enabled, use_stream in itertools.product(FORMATS, (True, False), (False, True)):
+            app.config['VAD_ENABLED'] = vad_enabled
+            first = upload_hash(input_path, data, target_format, use_stream)
+            second = upload_hash(input_path, data, target_format, use_stream)
+            name = f"{target_format}, vad={'on' if vad_enabled else 'off'}, {'stream' if use_stream else 'path'}"
+            print(f"  {name:<28} {first[:16]} {'same' if first == second else 'DIFFERENT ' + second[:16]}")
+            if first != second:
+                failures.append(name)
+
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}: encoding the same input twice gave different bytes")
+        sys.exit(1)
+    print("ok")
+
+
+if __name__ == '__main__':
+    main()
@@ -16,6 +16,7 @@ class Config:
     # アプリケーションのディレクトリ構造に関する設定
     UPLOAD_FOLDER = 'uploads'
     PRESET_FOLDER = 'presets'
+    PRESET_CATALOG_CHECK_INTERVAL_SECONDS = 2.0 # presets/ の変更 (ディレクトリの mtime) を確認する間隔
     STATIC_AUDIO_FOLDER = os.path.join('static', 'audio') # static/audio へのパス
 
     # ファイルアップロードの制限
@@ -33,24 +34,67 @@ class Config:
     # データベース設定 (ReplitのSecretsでDATABASE_URLを設定)
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///data.db' # Secrets未設定時のフォールバック(開発用)
 
-    # ログファイル (JSONベースのログを使用している場合)
-    LOG_FILE = 'preset_log.json'
+    # プリセット練習ログの控え (追記専用の JSONL。core/services/practice_log_file.py)
+    LOG_FILE = 'preset_log.jsonl'
+    LOG_FSYNC_BATCH_SIZE = int(os.environ.get('LOG_FSYNC_BATCH_SIZE', 20)) # この件数ごとに fsync
+    LOG_FSYNC_INTERVAL_SECONDS = float(os.environ.get('LOG_FSYNC_INTERVAL_SECONDS', 1.0)) # 前回の fsync からこの秒数が経っていれば fsync
+    RANKING_PAGE_SIZE = 50 # /ranking の 1 ページの件数
 
     #トライアル
     TRIAL_PERIOD_DAYS = 7  # 新規ユーザーのトライアル日数
     TRIAL_API_CALL_LIMIT = 50 # トライアル中のAPIコール上限
+    # True なら、ユーザー (X-Replit-User-Id) のあるリクエストの文字起こしで API コール枠を予約・消費する
+    API_QUOTA_ENFORCED = os.environ.get('API_QUOTA_ENFORCED', 'false').lower() in ('1', 'true', 'on')
+    ENTITLEMENT_CACHE_TTL_SECONDS = float(os.environ.get('ENTITLEMENT_CACHE_TTL_SECONDS', 30)) # プラン状態のキャッシュの有効期間
+    ENTITLEMENT_CACHE_MAX_ENTRIES = 10000 # キャッシュするユーザー数の上限 (古いものから捨てる)
+    ENTITLEMENT_CACHE_STATS_LOG_INTERVAL = 1000 # この回数の参照ごとに hit / miss をログに出す
     
     # シャドウイング機能関連の定数
     WARMUP_TRANSCRIPT = "5, 4, 3, 2, 1, 0"
     # WARMUP_AUDIO_PATH は static/audio フォルダ内のファイル名を指定
     WARMUP_AUDIO_FILENAME = 'warm-up.mp3' # config.pyでファイル名だけ定義
                                        # app.py で url_for や os.path.join でフルパスを生成
+    # 録音からウォームアップ音声を探す範囲 (録音の先頭から、ウォームアップの長さ + この時間) と、一致とみなすスコア
+    WARMUP_SEARCH_MS = 10000
+    WARMUP_MATCH_MIN_SCORE = 0.5
+
+    # 文字起こしエンジン: 'openai' (Whisper) または 'fake' (オフライン動作確認用)
+    TRANSCRIBER = os.environ.get('TRANSCRIBER', 'openai')
+    FAKE_TRANSCRIPT = os.environ.get('FAKE_TRANSCRIPT', 'This is a fake transcription.')
+    FAKE_TRANSCRIBE_DELAY = float(os.environ.get('FAKE_TRANSCRIBE_DELAY', '0'))
+
+    # 文字起こし前に変換する形式: 'ogg' (16kHz モノラル Opus), 'mp3', 'wav'
+    TRANSCRIBE_UPLOAD_FORMAT = os.environ.get('TRANSCRIBE_UPLOAD_FORMAT', 'ogg')
+
+    # 無音の削除 (VAD): 先頭・末尾の無音を削除し、途中の長い無音を縮めてから送る (core/audio_utils.py の compact_silence)
+    VAD_ENABLED = os.environ.get('VAD_ENABLED', 'true').lower() in ('1', 'true', 'on')
+    VAD_FRAME_MS = 30           # エネルギーを計算するフレーム長
+    VAD_MIN_DBFS = -50.0        # これより小さいフレームは常に無音
+    VAD_NOISE_MARGIN_DB = 10.0  # ノイズフロアからこれだけ大きければ発話
+    VAD_PADDING_MS = 200        # 発話の前後に残す長さ
+    VAD_MAX_PAUSE_MS = 700      # 途中の無音はこの長さまで縮める
+    VAD_MIN_SAVING_MS = 1000    # 削除できる無音がこれ未満なら、圧縮済みの入力は再エンコードせずに送る
+
+    # 文字起こし結果のキャッシュ (音声の sha256 をキーにする)。0 で無効
+    TRANSCRIPTION_CACHE_MAX_ENTRIES = int(os.environ.get('TRANSCRIPTION_CACHE_MAX_ENTRIES', '5000'))
+
+    # 非同期ジョブ (文字起こし + 評価) 関連
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))  # ワーカープロセス数
+    JOB_POLL_INTERVAL_SECONDS = 1.0  # キューが空のときのポーリング間隔
+    JOB_HEARTBEAT_INTERVAL_SECONDS = 15  # 実行中のジョブの heartbeat_at を更新する間隔
+    JOB_LEASE_TIMEOUT_SECONDS = int(os.environ.get('JOB_LEASE_TIMEOUT_SECONDS', '120'))  # heartbeat がこれだけ途絶えた running のジョブは取り直す
+    JOB_MAX_ATTEMPTS = 2  # 取り直しを含めた実行回数の上限 (超えたら failed)
 
     # チャンク処理関連の定数
     TARGET_CHUNK_SIZE_MB = 20
     TARGET_CHUNK_SIZE_BYTES = TARGET_CHUNK_SIZE_MB * 1024 * 1024
     CHUNK_OVERLAP_MS = 5000  # ミリ秒
     TARGET_CHUNK_DURATION_MS = 10 * 60 * 1000  # 10分 (ミリ秒)
+    # ffmpeg / ffprobe の実行ファイル (チャンク分割などで使用)
+    FFMPEG_BINARY = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+    FFPROBE_BINARY = os.environ.get('FFPROBE_BINARY', 'ffprobe')
+    # チャンクを同時に文字起こしする数 (Whisper への同時リクエスト数の上限)
+    TRANSCRIBE_MAX_WORKERS = int(os.environ.get('TRANSCRIBE_MAX_WORKERS', '4'))
 
     @staticmethod
     def init_app(app):
@@ -0,0 +1,98 @@
+# core/alignment.py
+"""
+評価 1 回分のアラインメント結果。
+
+正規化とアラインメントを 1 度だけ行い、WER の各カウント・opcodes・
+2 種類の HTML diff (original / user) を同じ結果から取り出せるようにする。
+"""
+from dataclasses import dataclass
+
+from core.diff_viewer import render_diff_html
+from core.wer_utils import (
+    OP_DEL, OP_EQUAL, OP_INS, EncodedReference, align_tokens, tokenize, wer_from_ops
+)
+
+# 'user' 表示では基準と比較対象が入れ替わるので、タグも入れ替える
+_SWAPPED_TAGS = {'equal': 'equal', 'replace': 'replace', 'insert': 'delete', 'delete': 'insert'}
+
+
+@dataclass(frozen=True)
+class AlignmentResult:
+    reference_words: list
+    hypothesis_words: list
+    ops: list
+    wer_percent: float
+    substitutions: int
+    deletions: int
+    insertions: int
+
+    @property
+    def n(self):
+        return len(self.reference_words)
+
+    @property
+    def wer(self):
+        """WER (0.0 - 1.0)。calculate_wer と同じ値"""
+        return self.wer_percent / 100.0
+
+    def counts(self):
+        """wer() と同じ (wer_percent, S, D, I, N) タプル"""
+        return self.wer_percent, self.substitutions, self.deletions, self.insertions, self.n
+
+    @property
+    def opcodes(self):
+        """
+        difflib.SequenceMatcher.get_opcodes() と同じ形式
+        (reference -> hypothesis) の opcodes。
+        """
+        opcodes = []
+        i = j = k = 0
+        while k < len(self.ops):
+            i1, j1 = i, j
+            if self.ops[k] == OP_EQUAL:
+                while k < len(self.ops) and self.ops[k] == OP_EQUAL:
+                    i, j, k = i + 1, j + 1, k + 1
+                opcodes.append(('equal', i1, i, j1, j))
+                continue
+            while k < len(self.ops) and self.ops[k] != OP_EQUAL:
+                if self.ops[k] != OP_INS:
+                    i += 1
+                if self.ops[k] != OP_DEL:
+                    j += 1
+                k += 1
+            tag = 'delete' if j == j1 else 'insert' if i == i1 else 'replace'
+            opcodes.append((tag, i1, i, j1, j))
+        return opcodes
+
+    def diff_html(self, mode='original'):
+        """
+        mode='original': 正解テキストを基準にした diff (diff_html と同じ形式)
+        mode='user':     ユーザーの発話を基準にした diff
+        """
+        if mode == 'original':
+            return render_diff_html(self.reference_words, self.hypothesis_words, self.opcodes)
+        swapped = [(_SWAPPED_TAGS[tag], j1, j2, i1, i2) for tag, i1, i2, j1, j2 in self.opcodes]
+        return render_diff_html(self.hypothesis_words, self.reference_words, swapped)
+
+
+def align(reference, hypothesis, lenient=False):
+    """
+    reference と hypothesis を 1 度だけ正規化・アラインメントして AlignmentResult を返す。
+    reference には EncodedReference (プリセットカタログで事前にエンコードしたもの) も渡せる。
+    """
+    if isinstance(reference, EncodedReference):
+        r = reference.tokens
+    else:
+        r = reference = tokenize(reference) # 一度きりの参照テキスト (プリセットは EncodedReference で来る)
+    h = tokenize(hypothesis)
+    ops = align_tokens(reference, h, lenient)
+    wer_percent, S, D, I, _ = wer_from_ops(ops, len(r))
+    return AlignmentResult(
+        reference_words=r,
+        hypothesis_words=h,
+        ops=ops,
+        wer_percent=wer_percent,
+        substitutions=S,
+        deletions=D,
+        insertions=I,
+    )
@@ -1,26 +1,583 @@
+import io
 import os
+import re
+import subprocess
 import tempfile
+import threading
+import time
 import uuid # ファイル名の一意性確保のために使用する場合
+import numpy as np
 from flask import current_app # app.config や app.logger を使うため
-from pydub import AudioSegment, exceptions as pydub_exceptions # pydub の例外もインポート
-from core.services.transcribe_utils import transcribe_audio # transcribe_utils.py の場所に合わせてインポート
+from core.services.transcribe_utils import transcribe_audio, MAX_WHISPER_SIZE_BYTES # transcribe_utils.py の場所に合わせてインポート
 
 # エラーの種類を明確にするためのカスタム例外 (任意)
 class AudioProcessingError(Exception):
     pass
 
+def save_upload_to_temp(audio_file_storage, prefix="input_"):
+    """
+    アップロードされた音声ファイルを UPLOAD_FOLDER に一時保存し、そのパスを返します。
+    削除は呼び出し側の責任です (非同期ジョブではワーカーが処理後に削除します)。
+
+    Raises:
+        ValueError: ファイルが無効な場合。
+    """
+    if not audio_file_storage or not audio_file_storage.filename:
+        raise ValueError("音声ファイルが無効です。")
+
+    # Content-Type で簡単な形式チェック (より厳密にするなら python-magic など)
+    # allowed_mime_types = ['audio/mpeg', 'audio/wav', 'audio/webm', 'audio/mp4', 'audio/x-m4a'] # 例
+    # if audio_file_storage.mimetype not in allowed_mime_types:
+    #     raise ValueError(f"サポートされていないファイル形式です: {audio_file_storage.mimetype}")
+
+    upload_folder = current_app.config.get('UPLOAD_FOLDER', '/tmp') # UPLOAD_FOLDER設定を参照、なければ /tmp
+
+    #    - suffix で元の拡張子を保持しつつ、安全なファイル名を確保
+    #    - delete=False で作成し、呼び出し側で確実に削除
+    suffix = os.path.splitext(audio_file_storage.filename)[1]
+    with tempfile.NamedTemporaryFile(
+        delete=False,
+        suffix=suffix,
+        dir=upload_folder,
+        prefix=prefix
+    ) as tmp_in:
+        audio_file_storage.save(tmp_in.name)
+        current_app.logger.info(f"一時入力ファイル保存: {tmp_in.name}")
+        return tmp_in.name
+
+# ストリームコピー (再エンコードなし) でチャンクを切り出せる入力の拡張子 -> 出力の拡張子
+_STREAM_COPY_SUFFIXES = {
+    '.mp3': '.mp3', '.mpga': '.mp3', '.mpeg': '.mp3',
+    '.m4a': '.m4a', '.webm': '.webm', '.wav': '.wav', '.ogg': '.ogg',
+}
+# ストリームコピーできない場合の再エンコード設定 (音声認識には 16kHz モノラルで十分)
+_CHUNK_REENCODE_ARGS = ['-ac', '1', '-ar', '16000', '-c:a', 'libmp3lame', '-b:a', '64k']
+FFMPEG_TIMEOUT_SECONDS = 300
+
+_STDIN_COPY_BLOCK_SIZE = 64 * 1024
+
+def _run_ffmpeg(args, stdin_stream=None, capture_stdout=False):
+    """
+    ffmpeg を実行する。失敗したら AudioProcessingError (stderr の末尾を含む) を送出する。
+    stdin_stream を渡すと、その内容をブロック単位で ffmpeg の標準入力 (args 内の 'pipe:0') に流し込み、
+    読み込んだバイト数を返す。capture_stdout なら (読み込んだバイト数, 標準出力 ('pipe:1') の bytes) を返す。
+    """
+    command = [current_app.config.get('FFMPEG_BINARY', 'ffmpeg'), '-hide_banner', '-loglevel', 'error', '-y', *args]
+    try:
+        process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE if stdin_stream is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE if capture_stdout else subprocess.DEVNULL,
+            stderr=subprocess.PIPE
+        )
+    except FileNotFoundError:
+        raise AudioProcessingError(f"ffmpeg が見つかりません: {command[0]}")
+
+    bytes_in = [0]
+    feeder = None
+    if stdin_stream is not None:
+        # 標準出力を読みながら書き込まないとパイプが詰まるので、別スレッドで流し込む
+        # (process.stdin を外しておき、communicate() には標準出力・標準エラーだけを読ませる)
+        stdin_pipe, process.stdin = process.stdin, None
+        feeder = threading.Thread(target=_feed_stdin, args=(stdin_pipe, stdin_stream, bytes_in), daemon=True)
+        feeder.start()
+    try:
+        stdout, stderr = process.communicate(timeout=FFMPEG_TIMEOUT_SECONDS)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        raise AudioProcessingError(f"ffmpeg の処理がタイムアウトしました ({FFMPEG_TIMEOUT_SECONDS}秒)")
+    finally:
+        if feeder is not None:
+            feeder.join()
+
+    if process.returncode != 0:
+        message = stderr.decode('utf-8', errors='replace').strip()[-500:]
+        raise AudioProcessingError(f"ffmpeg の実行に失敗しました: {message}")
+    return (bytes_in[0], stdout) if capture_stdout else bytes_in[0]
+
+def _feed_stdin(stdin_pipe, stdin_stream, bytes_in):
+    """stdin_stream の内容を ffmpeg の標準入力に書き込み、閉じる (EOF を送る)。書き込んだバイト数は bytes_in[0] に足す"""
+    try:
+        while True:
+            block = stdin_stream.read(_STDIN_COPY_BLOCK_SIZE)
+            if not block:
+                break
+            stdin_pipe.write(block)
+            bytes_in[0] += len(block)
+    except BrokenPipeError:
+        pass # ffmpeg が途中で終了した (エラーは returncode で判定する)
+    finally:
+        try:
+            stdin_pipe.close()
+        except BrokenPipeError:
+            pass
+
+def _decode_pcm(input_args, stdin_stream=None):
+    """input_args の入力を 16kHz モノラルの PCM (int16 の NumPy 配列) にデコードする: (samples, 読み込んだバイト数)"""
+    bytes_in, pcm = _run_ffmpeg(
+        [*input_args, '-f', 's16le', '-c:a', 'pcm_s16le', 'pipe:1'], stdin_stream=stdin_stream, capture_stdout=True
+    )
+    return np.frombuffer(pcm, dtype=np.int16), bytes_in
+
+def probe_duration_ms(path, ffprobe=None):
+    """
+    ffprobe で音声の長さ (ミリ秒) をヘッダから取得する (音声全体はデコードしない)。
+    ffprobe を省略すると Config.FFPROBE_BINARY を使う (アプリコンテキストが必要)。
+    """
+    command = [
+        ffprobe or current_app.config.get('FFPROBE_BINARY', 'ffprobe'), '-v', 'error',
+        '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', path
+    ]
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=60)
+    except FileNotFoundError:
+        raise AudioProcessingError(f"ffprobe が見つかりません: {command[0]}")
+    except subprocess.TimeoutExpired:
+        raise AudioProcessingError("ffprobe の処理がタイムアウトしました")
+
+    match = re.search(r'\d+(\.\d+)?', result.stdout)
+    if result.returncode != 0 or not match:
+        raise AudioProcessingError(f"音声の長さを取得できませんでした: {result.stderr.strip()[-500:]}")
+    return int(float(match.group()) * 1000)
+
+def iter_audio_chunks(input_path, prefix="chunk_", chunk_duration_ms=None, overlap_ms=None, target_chunk_bytes=None,
+                      on_plan=None):
+    """
+    ffmpeg で音声を時間で区切り、チャンクファイルを 1 つずつ書き出して (遅延して) yield します。
+
+    - 入力全体を PCM にデコードしないので、入力の長さに関係なくメモリ使用量は小さいまま。
+    - 可能な形式 (mp3, m4a, webm, wav, ogg) はストリームコピーで切り出し、失敗したら 16kHz モノラル mp3 に再エンコードする。
+    - チャンクの長さは Config.TARGET_CHUNK_DURATION_MS を上限に、平均ビットレートから
+      1 チャンクが Config.TARGET_CHUNK_SIZE_BYTES に収まるように決める。前後のチャンクは CHUNK_OVERLAP_MS だけ重ねる。
+
+    yield したファイルの削除は呼び出し側の責任です。
+    on_plan(num_chunks) を渡すと、最初のチャンクを書き出す前にチャンク数を通知します (進捗表示用)。
+
+    Raises:
+        AudioProcessingError: ffmpeg / ffprobe の実行に失敗した場合。
+    """
+    config = current_app.config
+    chunk_duration_ms = chunk_duration_ms or config['TARGET_CHUNK_DURATION_MS']
+    overlap_ms = config['CHUNK_OVERLAP_MS'] if overlap_ms is None else overlap_ms
+    target_chunk_bytes = target_chunk_bytes or config['TARGET_CHUNK_SIZE_BYTES']
+    upload_folder = config.get('UPLOAD_FOLDER', '/tmp')
+
+    duration_ms = probe_duration_ms(input_path)
+    file_size = os.path.getsize(input_path)
+    if duration_ms > 0 and file_size > target_chunk_bytes:
+        # 非圧縮 (wav) などビットレートの高い入力では、サイズに合わせてチャンクを短くする
+        size_limited_ms = int(duration_ms * (target_chunk_bytes / file_size)) - overlap_ms
+        chunk_duration_ms = max(min(chunk_duration_ms, size_limited_ms), 1000)
+
+    input_suffix = os.path.splitext(input_path)[1].lower()
+    copy_suffix = _STREAM_COPY_SUFFIXES.get(input_suffix)
+    # 端数がオーバーラップより短い場合は最後のチャンクに含める (極端に短いチャンクを作らない)
+    num_chunks = max(1, -(-(duration_ms - overlap_ms) // chunk_duration_ms))
+    current_app.logger.info(
+        f"チャンク分割: {duration_ms / 1000:.1f}秒 -> {num_chunks}チャンク "
+        f"({chunk_duration_ms / 1000:.0f}秒ごと, {'ストリームコピー' if copy_suffix else '再エンコード'})"
+    )
+    if on_plan:
+        on_plan(num_chunks)
+
+    for chunk_index in range(num_chunks):
+        start_ms = max(0, chunk_index * chunk_duration_ms - overlap_ms)
+        end_ms = duration_ms if chunk_index == num_chunks - 1 else (chunk_index + 1) * chunk_duration_ms
+        # -ss を -i の前に置くと、先頭からデコードせずにシークする
+        input_args = ['-ss', f"{start_ms / 1000:.3f}", '-t', f"{(end_ms - start_ms) / 1000:.3f}", '-i', input_path, '-vn', '-map', '0:a:0']
+
+        chunk_path = None
+        try:
+            if copy_suffix:
+                chunk_path = _new_temp_path(upload_folder, f"{prefix}{chunk_index}_", copy_suffix)
+                try:
+                    _run_ffmpeg([*input_args, '-c:a', 'copy', chunk_path])
+                except AudioProcessingError as copy_error:
+                    current_app.logger.warning(f"ストリームコピーに失敗したため再エンコードします: {copy_error}")
+                    _remove_temp_file(chunk_path)
+                    chunk_path = None
+            if chunk_path is None:
+                chunk_path = _new_temp_path(upload_folder, f"{prefix}{chunk_index}_", '.mp3')
+                _run_ffmpeg([*input_args, *_CHUNK_REENCODE_ARGS, chunk_path])
+        except Exception:
+            _remove_temp_file(chunk_path)
+            raise
+
+        current_app.logger.info(
+            f"  チャンク {chunk_index + 1}/{num_chunks}: {start_ms / 1000:.1f}s - {end_ms / 1000:.1f}s "
+            f"({os.path.getsize(chunk_path) / (1024 * 1024):.1f}MB) {chunk_path}"
+        )
+        yield chunk_path
+
+def _new_temp_path(directory, prefix, suffix):
+    with tempfile.NamedTemporaryFile(delete=False, dir=directory, prefix=prefix, suffix=suffix) as tmp:
+        return tmp.name
+
+def _remove_temp_file(path):
+    if path and os.path.exists(path):
+        try:
+            os.remove(path)
+            current_app.logger.info(f"一時ファイル削除: {path}")
+        except OSError as e_os:
+            current_app.logger.error(f"一時ファイル削除エラー ({path}): {e_os}")
+
+# 同じ入力から常に同じバイト列を書き出すための設定 (文字起こしキャッシュは出力の sha256 をキーにするため)。
+# bitexact がないと ogg のストリームのシリアル番号が毎回ランダムになり、エンコーダのバージョンなどのメタデータも入る
+_DETERMINISTIC_OUTPUT_ARGS = ['-fflags', '+bitexact', '-flags:a', '+bitexact', '-map_metadata', '-1']
+# 文字起こし用に書き出す形式ごとの ffmpeg のエンコード設定 (音声認識には 16kHz モノラルで十分)
+_UPLOAD_CODEC_ARGS = {
+    # 音声認識用なので最高品質 (compression_level 10) は不要。5 でエンコード時間が 1/3 程度になる
+    "ogg": [*_DETERMINISTIC_OUTPUT_ARGS, '-c:a', 'libopus', '-b:a', '24k', '-compression_level', '5'],
+    "mp3": [*_DETERMINISTIC_OUTPUT_ARGS, '-c:a', 'libmp3lame', '-b:a', '48k'],
+    "wav": [*_DETERMINISTIC_OUTPUT_ARGS, '-c:a', 'pcm_s16le'],
+}
+_UPLOAD_SAMPLE_RATE = 16000
+# 圧縮済みで Whisper がそのまま受け付ける拡張子 (前処理が不要なら再エンコードせずに送る)
+_COMPACT_UPLOAD_SUFFIXES = {'.webm', '.ogg', '.oga', '.opus', '.mp3', '.mpga', '.mpeg', '.m4a', '.mp4'}
+# シークなしで先頭から読める (= パイプで ffmpeg に流し込める) 形式。m4a/mp4 は moov が末尾にあることがあるので除く
+_PIPEABLE_SUFFIXES = {'.webm', '.ogg', '.oga', '.opus', '.mp3', '.mpga', '.mpeg', '.wav'}
+
+def _is_compact_upload(path):
+    return (
+        os.path.splitext(path)[1].lower() in _COMPACT_UPLOAD_SUFFIXES
+        and os.path.getsize(path) <= MAX_WHISPER_SIZE_BYTES
+    )
+
+def _resolve_upload_format(target_format):
+    target_format = target_format or current_app.config.get('TRANSCRIBE_UPLOAD_FORMAT', 'ogg')
+    if target_format not in _UPLOAD_CODEC_ARGS:
+        raise ValueError(f"サポートされていない変換形式です: {target_format}")
+    return target_format
+
+def _input_args(input_source, cut_head_ms):
+    """ffmpeg の入力部分の引数 (ストリームなら標準入力から読む)"""
+    is_stream = not isinstance(input_source, (str, os.PathLike))
+    # -ss を -i の前に置くと、ファイル入力ならデコードせずにシークする (パイプ入力では先頭を読み捨てる)
+    args = ['-ss', f"{cut_head_ms / 1000:.3f}"] if cut_head_ms > 0 else []
+    args += ['-i', 'pipe:0' if is_stream else input_source, '-vn', '-ac', '1', '-ar', str(_UPLOAD_SAMPLE_RATE)]
+    return args, (input_source if is_stream else None)
+
+def encode_for_upload(input_source, output_path, cut_head_ms=0, target_format="ogg"):
+    """
+    先頭のカットと 16kHz モノラル target_format への変換を、ffmpeg 1 回の実行で行います。
+    音声全体を Python 側 (pydub) の PCM に展開しません。
+
+    Args:
+        input_source: 入力ファイルのパス、または読み込み可能なストリーム (FileStorage.stream など)。
+            ストリームの場合はそのまま ffmpeg の標準入力に流し込む。
+        output_path (str): 出力先 (拡張子は target_format に合わせる)。
+
+    Returns:
+        int: ストリームから読み込んだバイト数 (パス入力の場合は 0)。
+
+    Raises:
+        AudioProcessingError: ffmpeg の実行に失敗した場合 (デコードできない入力など)。
+    """
+    input_args, stdin_stream = _input_args(input_source, cut_head_ms)
+    bytes_in = _run_ffmpeg([*input_args, *_UPLOAD_CODEC_ARGS[target_format], output_path], stdin_stream=stdin_stream)
+    if cut_head_ms > 0:
+        current_app.logger.info(f"音声の先頭 {cut_head_ms}ms をカットしました。")
+    current_app.logger.info(f"処理済み一時ファイル保存 ({target_format}形式): {output_path}")
+    return bytes_in
+
+def compact_silence(
+    samples,
+    sample_rate=_UPLOAD_SAMPLE_RATE,
+    frame_ms=30,
+    min_dbfs=-50.0,
+    noise_margin_db=10.0,
+    padding_ms=200,
+    max_pause_ms=700
+):
+    """
+    PCM (int16 の NumPy 配列) から無音を詰めて返します: (詰めた後の samples, 削除したミリ秒)。
+
+    frame_ms ごとの RMS (dBFS) を求め、ノイズフロア (下位 10%) + noise_margin_db を超えるフレームを発話とみなす
+    (ただし min_dbfs 以上、かつ発話レベル (上位 10%) - 20dB 以下に収める)。発話の前後 padding_ms は残す。
+    先頭と末尾の無音は削除し、途中の max_pause_ms より長い無音は max_pause_ms に縮める。
+    発話が見つからない場合は何もしない (誤判定で音声を消さないため)。
+    """
+    frame = sample_rate * frame_ms // 1000
+    n_frames = len(samples) // frame
+    if n_frames == 0:
+        return samples, 0
+
+    frames = samples[:n_frames * frame].astype(np.float32).reshape(n_frames, frame)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    db = 20 * np.log10(np.maximum(rms, 1.0) / 32768.0)
+    noise_floor, speech_level = np.percentile(db, [10, 90])
+    threshold = max(min_dbfs, min(noise_floor + noise_margin_db, speech_level - 20.0))
+    speech = db > threshold
+    if not speech.any():
+        return samples, 0
+
+    # 発話フレームの前後 padding_ms を残す (膨張処理)
+    # mode='same' はカーネルより短い入力でカーネルの長さを返すので、'full' から n_frames 分を切り出す
+    pad = padding_ms // frame_ms
+    keep = np.convolve(speech, np.ones(2 * pad + 1, dtype=bool), mode='full')[pad:pad + n_frames] > 0
+
+    # 先頭・末尾の無音を除き、途中の長い無音を max_pause_ms に縮める
+    first, last = np.flatnonzero(keep)[[0, -1]]
+    keep[:first] = False
+    keep[last + 1:] = False
+    max_pause = max_pause_ms // frame_ms
+    edges = np.diff(keep[first:last + 1].astype(np.int8))
+    for start, end in zip(np.flatnonzero(edges == -1) + first + 1, np.flatnonzero(edges == 1) + first + 1):
+        if end - start <= max_pause:
+            keep[start:end] = True
+        else:
+            # 無音の最初と最後を残す (発話の直後・直前の余韻を切らない)
+            keep[start:start + max_pause // 2] = True
+            keep[end - (max_pause - max_pause // 2):end] = True
+
+    sample_mask = np.repeat(keep, frame)
+    if n_frames * frame < len(samples):
+        # フレームに満たない末尾は、最後のフレームと同じ扱いにする
+        sample_mask = np.concatenate([sample_mask, np.full(len(samples) - n_frames * frame, keep[-1])])
+    compacted = samples[sample_mask]
+    removed_ms = (len(samples) - len(compacted)) * 1000 // sample_rate
+    return compacted, int(removed_ms)
+
+def _compact_silence_with_config(samples):
+    config = current_app.config
+    return compact_silence(
+        samples,
+        frame_ms=config.get('VAD_FRAME_MS', 30),
+        min_dbfs=config.get('VAD_MIN_DBFS', -50.0),
+        noise_margin_db=config.get('VAD_NOISE_MARGIN_DB', 10.0),
+        padding_ms=config.get('VAD_PADDING_MS', 200),
+        max_pause_ms=config.get('VAD_MAX_PAUSE_MS', 700),
+    )
+
+def _energy_envelope(samples, frame):
+    """frame サンプルごとの対数エネルギー (dB, -60dB で下限を切る)"""
+    n_frames = len(samples) // frame
+    frames = samples[:n_frames * frame].astype(np.float32).reshape(n_frames, frame) / 32768.0
+    return np.maximum(10 * np.log10(np.mean(frames * frames, axis=1) + 1e-12), -60.0)
+
+def locate_reference(samples, reference, sample_rate=_UPLOAD_SAMPLE_RATE, frame_ms=20):
+    """
+    samples の中で reference (既知の音声) と最もよく一致する位置を探します: (開始ミリ秒, スコア)。
+
+    両者のエネルギー包絡線の正規化相互相関 (ずらし位置ごとのピアソン相関) を FFT で一度に計算する。
+    スコアは -1.0 - 1.0。samples が reference より短い場合は (None, 0.0)。
+    """
+    frame = sample_rate * frame_ms // 1000
+    x = _energy_envelope(samples, frame).astype(np.float64)
+    r = _energy_envelope(reference, frame).astype(np.float64)
+    n, length = len(x), len(r)
+    if length == 0 or n < length:
+        return None, 0.0
+
+    r = r - r.mean()
+    r_norm = np.sqrt(np.sum(r * r))
+    if r_norm == 0:
+        return None, 0.0
+
+    # sum_i x[k+i] * r[i] を全ての k について FFT で求める
+    size = 1 << (n + length - 1).bit_length()
+    corr = np.fft.irfft(np.fft.rfft(x, size) * np.conj(np.fft.rfft(r, size)), size)[:n - length + 1]
+
+    # 各位置の窓 x[k:k+length] の標準偏差 (累積和で O(n))
+    cs = np.concatenate([[0.0], np.cumsum(x)])
+    cs2 = np.concatenate([[0.0], np.cumsum(x * x)])
+    window_sum = cs[length:] - cs[:-length]
+    window_var = (cs2[length:] - cs2[:-length]) - window_sum * window_sum / length
+    scores = corr / (np.sqrt(np.maximum(window_var, 1e-12)) * r_norm)
+
+    best = int(np.argmax(scores))
+    return best * frame_ms, float(scores[best])
+
+_warmup_reference_cache = {}
+
+def _warmup_reference_samples():
+    """ウォームアップ音声 (static/audio/<WARMUP_AUDIO_FILENAME>) の PCM。ファイルの更新時刻ごとにキャッシュする"""
+    path = os.path.join(current_app.static_folder, 'audio', current_app.config.get('WARMUP_AUDIO_FILENAME', 'warm-up.mp3'))
+    if not os.path.exists(path):
+        return None
+    key = (path, os.path.getmtime(path))
+    if key not in _warmup_reference_cache:
+        samples, _ = _decode_pcm(['-i', path, '-ac', '1', '-ar', str(_UPLOAD_SAMPLE_RATE)])
+        _warmup_reference_cache.clear()
+        _warmup_reference_cache[key] = samples
+    return _warmup_reference_cache[key]
+
+def detect_warmup_end(samples):
+    """
+    録音の先頭付近にあるウォームアップ (カウントダウン) を音響的に探し、その終わりのサンプル位置を返します。
+    見つからない (一致度が WARMUP_MATCH_MIN_SCORE 未満) 場合は None。
+    """
+    config = current_app.config
+    try:
+        reference = _warmup_reference_samples()
+    except AudioProcessingError as e:
+        current_app.logger.warning(f"ウォームアップ音声を読み込めませんでした: {e}")
+        return None
+    if reference is None or len(reference) == 0:
+        return None
+
+    # ウォームアップは録音開始直後に再生されるので、先頭の一定範囲だけを探す
+    search = samples[:len(reference) + config.get('WARMUP_SEARCH_MS', 10000) * _UPLOAD_SAMPLE_RATE // 1000]
+    offset_ms, score = locate_reference(search, reference)
+    if offset_ms is None or score < config.get('WARMUP_MATCH_MIN_SCORE', 0.5):
+        current_app.logger.info(f"ウォームアップを音声から検出できませんでした (score={score:.2f})")
+        return None
+    end = offset_ms * _UPLOAD_SAMPLE_RATE // 1000 + len(reference)
+    current_app.logger.info(
+        f"ウォームアップを検出: {offset_ms / 1000:.2f}秒 - {end / _UPLOAD_SAMPLE_RATE:.2f}秒 (score={score:.2f})"
+    )
+    return end
+
+def prepare_upload(input_source, cut_head_ms=0, target_format="ogg", input_path=None, strip_warmup=False):
+    """
+    文字起こしに送るファイルを用意します: (送信するパス, 一時ファイルか, 統計情報 dict)。
+
+    - Config.VAD_ENABLED または strip_warmup なら 16kHz モノラル PCM にデコードし、
+      strip_warmup ならウォームアップ (detect_warmup_end) を、VAD_ENABLED なら無音 (compact_silence) を削ってからエンコードする。
+      PCM は ffmpeg の標準出力・標準入力で受け渡す (一時ファイルは送信用の出力のみ)。
+    - どちらも無効なら PCM を経由せず、ffmpeg 1 回で送信用の形式に変換する (encode_for_upload)。
+    - 前処理が不要 (カットなし・詰める無音が VAD_MIN_SAVING_MS 未満) で入力がすでに圧縮形式なら、そのまま送る。
+
+    input_source はパスまたはストリーム。ストリームの場合、input_path は None (元のファイルをそのまま送る選択肢はない)。
+    統計情報: input_bytes, duration_ms (デコードした場合), warmup_removed_ms, removed_ms, label
+    """
+    config = current_app.config
+    upload_folder = config.get('UPLOAD_FOLDER', '/tmp')
+    stats = {
+        "input_bytes": os.path.getsize(input_path) if input_path else 0,
+        "duration_ms": None,
+        "warmup_removed_ms": 0,
+        "removed_ms": 0,
+        "label": target_format,
+    }
+    can_send_as_is = cut_head_ms <= 0 and input_path is not None and _is_compact_upload(input_path)
+
+    vad_enabled = config.get('VAD_ENABLED', True)
+    if not (vad_enabled or strip_warmup):
+        if can_send_as_is:
+            stats["label"] = "再エンコードなし"
+            return input_path, False, stats
+        output_path = _new_temp_path(upload_folder, "processed_", f".{target_format}")
+        try:
+            bytes_in = encode_for_upload(input_source, output_path, cut_head_ms, target_format)
+        except Exception:
+            _remove_temp_file(output_path)
+            raise
+        stats["input_bytes"] = stats["input_bytes"] or bytes_in
+        return output_path, True, stats
+
+    # PCM は一時ファイルを介さず、ffmpeg の標準出力から受け取り、エンコード時は標準入力に流し込む
+    # 1. PCM にデコード (先頭のカットもここで行う)
+    input_args, stdin_stream = _input_args(input_source, cut_head_ms)
+    samples, bytes_in = _decode_pcm(input_args, stdin_stream)
+    stats["input_bytes"] = stats["input_bytes"] or bytes_in
+    stats["duration_ms"] = len(samples) * 1000 // _UPLOAD_SAMPLE_RATE
+
+    # 2. ウォームアップ (カウントダウン) を削る
+    warmup_end = detect_warmup_end(samples) if strip_warmup else None
+    if warmup_end:
+        samples = samples[warmup_end:]
+        stats["warmup_removed_ms"] = warmup_end * 1000 // _UPLOAD_SAMPLE_RATE
+
+    # 3. 無音を詰める
+    compacted, removed_ms = _compact_silence_with_config(samples) if vad_enabled else (samples, 0)
+    if can_send_as_is and not warmup_end and removed_ms < config.get('VAD_MIN_SAVING_MS', 1000):
+        stats["label"] = "再エンコードなし"
+        return input_path, False, stats
+    stats["removed_ms"] = removed_ms
+    if vad_enabled:
+        current_app.logger.info(
+            f"無音の削除: {len(samples) / _UPLOAD_SAMPLE_RATE:.1f}秒 -> {len(compacted) / _UPLOAD_SAMPLE_RATE:.1f}秒 "
+            f"({removed_ms / 1000:.1f}秒削除)"
+        )
+
+    # 4. 送信用の形式にエンコード
+    output_path = _new_temp_path(upload_folder, "processed_", f".{target_format}")
+    try:
+        _run_ffmpeg([
+            '-f', 's16le', '-ar', str(_UPLOAD_SAMPLE_RATE), '-ac', '1', '-i', 'pipe:0',
+            *_UPLOAD_CODEC_ARGS[target_format], output_path
+        ], stdin_stream=io.BytesIO(compacted.tobytes()))
+    except Exception:
+        _remove_temp_file(output_path)
+        raise
+    return output_path, True, stats
+
+def _transcribe_and_report(upload_path, stats, quota_user_id=None):
+    """文字起こしを実行し、送信サイズ・削減量・削除したウォームアップと無音・所要時間をログに出す"""
+    input_bytes = stats["input_bytes"]
+    upload_bytes = os.path.getsize(upload_path)
+    start_time = time.time()
+    transcription_text = transcribe_audio(upload_path, quota_user_id=quota_user_id)
+    current_app.logger.info(
+        f"文字起こし送信: {upload_bytes / 1024:.0f}KB ({stats['label']}, "
+        f"入力 {input_bytes / 1024:.0f}KB から {(input_bytes - upload_bytes) / 1024:.0f}KB 削減, "
+        f"ウォームアップ {stats['warmup_removed_ms'] / 1000:.1f}秒・無音 {stats['removed_ms'] / 1000:.1f}秒削除), "
+        f"アップロード+文字起こし {time.time() - start_time:.2f}秒"
+    )
+    current_app.logger.info(f"文字起こし成功 (先頭50文字): {transcription_text[:50]}...")
+    return transcription_text
+
+def process_and_transcribe_file(
+    input_path,
+    cut_head_ms=0,
+    target_format=None, # None なら Config.TRANSCRIBE_UPLOAD_FORMAT (既定は 16kHz モノラルの Opus/OGG)
+    strip_warmup=False, # True なら先頭のウォームアップ (カウントダウン) を音声から検出して削る
+    quota_user_id=None # 指定するとこのユーザーの API コール枠を消費する (transcribe_audio を参照)
+):
+    """
+    保存済みの音声ファイルに前処理（任意）を行い、文字起こしを実行します。
+    入力ファイルは削除しません (処理済みの一時ファイルのみ削除します)。
+
+    前処理 (先頭のカット、無音の削除) は prepare_upload を参照。変換が必要な場合は
+    16kHz モノラルの target_format で送ります (WAV で送るより 10 倍程度小さい)。
+    送信サイズ・削除した無音の長さ・文字起こし時間はリクエストごとにログに出します。
+
+    Args:
+        input_path (str): 音声ファイルのパス。
+        cut_head_ms (int): 音声の先頭からカットするミリ秒数。デフォルトは0。
+        target_format (str): 変換する場合の形式 ("ogg", "mp3", "wav")。
+        strip_warmup (bool): 先頭のウォームアップを音声から検出して削るか (evaluate_custom_shadowing 用)。
+        quota_user_id (str): API コール枠を消費するユーザー (None なら消費しない)。
+
+    Returns:
+        str: 文字起こしされたテキスト。
+
+    Raises:
+        AudioProcessingError: 音声ファイルの読み込みや変換中にエラーが発生した場合。
+        Exception: 文字起こしAPI呼び出し中やその他の予期せぬエラーが発生した場合 (transcribe_audioからスローされる)。
+    """
+    target_format = _resolve_upload_format(target_format)
+    upload_path, is_temp, stats = prepare_upload(
+        input_path, cut_head_ms, target_format, input_path=input_path, strip_warmup=strip_warmup
+    )
+    try:
+        return _transcribe_and_report(upload_path, stats, quota_user_id)
+    finally:
+        if is_temp:
+            _remove_temp_file(upload_path)
+
 def process_and_transcribe_audio(
     audio_file_storage, # Flask の request.files から取得した FileStorage オブジェクト
     cut_head_ms=0,
-    target_format="wav" # Whisper が最も安定して処理できる形式の一つ
+    target_format=None, # None なら Config.TRANSCRIBE_UPLOAD_FORMAT
+    strip_warmup=False, # True なら先頭のウォームアップ (カウントダウン) を音声から検出して削る
+    quota_user_id=None # 指定するとこのユーザーの API コール枠を消費する (transcribe_audio を参照)
 ):
     """
-    アップロードされた音声ファイルを一時保存し、前処理（任意）を行い、文字起こしを実行します。
+    アップロードされた音声ファイルに前処理（任意）を行い、文字起こしを実行します。
+
+    先頭のカットが必要で、入力がパイプで読める形式 (webm/ogg/mp3/wav) の場合は、
+    アップロードのストリームを直接 ffmpeg に流し込み、入力の一時ファイルを作りません。
+    それ以外は一時保存してから process_and_transcribe_file で処理します。
 
     Args:
         audio_file_storage: Flask の FileStorage オブジェクト。
         cut_head_ms (int): 音声の先頭からカットするミリ秒数。デフォルトは0。
-        target_format (str): 文字起こし前に変換する音声フォーマット。デフォルトは "wav"。
+        target_format (str): 変換する場合の形式 ("ogg", "mp3", "wav")。
+        strip_warmup (bool): 先頭のウォームアップを音声から検出して削るか (evaluate_custom_shadowing 用)。
+        quota_user_id (str): API コール枠を消費するユーザー (None なら消費しない)。
 
     Returns:
         str: 文字起こしされたテキスト。
@@ -32,80 +589,33 @@ def process_and_transcribe_audio(
     """
     if not audio_file_storage or not audio_file_storage.filename:
         raise ValueError("音声ファイルが無効です。")
+    target_format = _resolve_upload_format(target_format)
+    suffix = os.path.splitext(audio_file_storage.filename)[1].lower()
 
-    # Content-Type で簡単な形式チェック (より厳密にするなら python-magic など)
-    # allowed_mime_types = ['audio/mpeg', 'audio/wav', 'audio/webm', 'audio/mp4', 'audio/x-m4a'] # 例
-    # if audio_file_storage.mimetype not in allowed_mime_types:
-    #     raise ValueError(f"サポートされていないファイル形式です: {audio_file_storage.mimetype}")
-
-    upload_folder = current_app.config.get('UPLOAD_FOLDER', '/tmp') # UPLOAD_FOLDER設定を参照、なければ /tmp
+    if cut_head_ms > 0 and suffix in _PIPEABLE_SUFFIXES:
+        # 高速パス: アップロードのストリーム -> ffmpeg (カット + 変換) -> 送信用ファイル
+        upload_path, _, stats = prepare_upload(
+            audio_file_storage.stream, cut_head_ms, target_format, strip_warmup=strip_warmup
+        )
+        stats["label"] += ", ストリーム変換"
+        try:
+            return _transcribe_and_report(upload_path, stats, quota_user_id)
+        finally:
+            _remove_temp_file(upload_path)
 
     # --- 一時ファイルの管理 ---
     temp_input_path = None
-    temp_processed_path = None
 
     try:
         # 1. 入力ファイルを一時保存
-        #    - suffix で元の拡張子を保持しつつ、安全なファイル名を確保
-        #    - delete=False で作成し、finally で確実に削除
-        suffix = os.path.splitext(audio_file_storage.filename)[1]
-        with tempfile.NamedTemporaryFile(
-            delete=False,
-            suffix=suffix,
-            dir=upload_folder,
-            prefix="input_"
-        ) as tmp_in:
-            audio_file_storage.save(tmp_in.name)
-            temp_input_path = tmp_in.name
-            current_app.logger.info(f"一時入力ファイル保存: {temp_input_path}")
-
-        # 2. 音声ファイルの前処理 (pydub)
-        try:
-            audio = AudioSegment.from_file(temp_input_path)
-        except pydub_exceptions.CouldntDecodeError as decode_error:
-            raise AudioProcessingError(f"音声ファイルのデコードに失敗しました: {decode_error}")
-
-        if cut_head_ms > 0:
-            audio = audio[cut_head_ms:]
-            current_app.logger.info(f"音声の先頭 {cut_head_ms}ms をカットしました。")
-
-        # 3. 処理済み音声を一時ファイルとしてエクスポート (文字起こしAPI用)
-        with tempfile.NamedTemporaryFile(
-            delete=False,
-            suffix=f".{target_format}",
-            dir=upload_folder,
-            prefix="processed_"
-        ) as tmp_proc:
-            temp_processed_path = tmp_proc.name
-            try:
-                audio.export(temp_processed_path, format=target_format)
-                current_app.logger.info(f"処理済み一時ファイル保存 ({target_format}形式): {temp_processed_path}")
-            except Exception as export_error: # pydub の export でエラーが起きる可能性
-                raise AudioProcessingError(f"音声のエクスポートに失敗しました ({target_format}形式): {export_error}")
-
-        # 4. 文字起こし実行 (transcribe_utils を利用)
-        #    - transcribe_audio 内で OpenAI API のエラーは処理される想定
-        #    - FileNotFoundError なども transcribe_audio が処理
-        transcription_text = transcribe_audio(temp_processed_path)
-        current_app.logger.info(f"文字起こし成功 (先頭50文字): {transcription_text[:50]}...")
-
-        return transcription_text
-
-    # except (ValueError, AudioProcessingError) as pae:
-        # これらのエラーは予期された処理エラーなので、そのまま上位にraise
-        # current_app.logger.warning(f"音声処理または検証エラー: {pae}")
-        # raise pae
-    # except Exception as e:
-        # transcribe_audio から来る可能性のあるエラーや、その他の予期せぬエラー
-        # current_app.logger.error(f"process_and_transcribe_audio で予期せぬエラー: {e}")
-        # raise # 上位の handle_transcription_error でキャッチさせる
+        temp_input_path = save_upload_to_temp(audio_file_storage)
+
+        # 2. 前処理と文字起こし
+        return process_and_transcribe_file(
+            temp_input_path, cut_head_ms=cut_head_ms, target_format=target_format, strip_warmup=strip_warmup,
+            quota_user_id=quota_user_id
+        )
 
     finally:
         # --- 一時ファイルのクリーンアップ ---
-        for path in [temp_input_path, temp_processed_path]:
-            if path and os.path.exists(path):
-                try:
-                    os.remove(path)
-                    current_app.logger.info(f"一時ファイル削除: {path}")
-                except OSError as e_os:
-                    current_app.logger.error(f"一時ファイル削除エラー ({path}): {e_os}")
\ No newline at end of file
+        _remove_temp_file(temp_input_path)
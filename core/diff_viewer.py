@@ -1,18 +1,14 @@
 
 from difflib import SequenceMatcher
 import difflib
-from core.text_utils import remove_fillers, normalize_text
+from core.text_utils import normalize_tokens
 
 
 
 def color_diff(correct_script, user_transcript):
-    # First normalize, then remove fillers
-    correct_words = normalize_text(correct_script.lower().strip())
-    transcript_words = normalize_text(user_transcript.lower().strip())
-
-    # Remove fillers after normalization
-    correct_words = normalize_text(remove_fillers(' '.join(correct_words)))
-    transcript_words = normalize_text(remove_fillers(' '.join(transcript_words)))
+    # Normalize and remove fillers in one pass
+    correct_words = normalize_tokens(correct_script)
+    transcript_words = normalize_tokens(user_transcript)
 
     diff = list(difflib.ndiff(correct_words, transcript_words))
 
@@ -26,38 +22,42 @@ def color_diff(correct_script, user_transcript):
             print(token[2:], end=" ")
     print("\n")
 
-def diff_html(correct: str, transcript: str) -> str:
-    """Creates HTML diff with insert/delete spans for evaluation results"""
-    correct_words = normalize_text(correct.lower().strip())
-    transcript_words = normalize_text(transcript.lower().strip())
-
-    # Remove fillers after normalization
-    correct_words = normalize_text(remove_fillers(' '.join(correct_words)))
-    transcript_words = normalize_text(remove_fillers(' '.join(transcript_words)))
-
-    matcher = difflib.SequenceMatcher(None, correct_words, transcript_words)
+def render_diff_html(base_words, compare_words, opcodes) -> str:
+    """
+    Render difflib-style opcodes (base -> compare) as HTML with
+    insert/delete spans.
+    """
     result_html = []
 
-    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+    for tag, i1, i2, j1, j2 in opcodes:
         if tag == 'equal':
-            result_html.append(' '.join(correct_words[i1:i2]))
+            result_html.append(' '.join(base_words[i1:i2]))
         elif tag == 'replace':
             result_html.append(
-                f'<span class="delete">{" ".join(correct_words[i1:i2])}</span> '
-                f'<span class="insert">{" ".join(transcript_words[j1:j2])}</span>'
+                f'<span class="delete">{" ".join(base_words[i1:i2])}</span> '
+                f'<span class="insert">{" ".join(compare_words[j1:j2])}</span>'
             )
         elif tag == 'insert':
-            result_html.append(f'<span class="insert">{" ".join(transcript_words[j1:j2])}</span>')
+            result_html.append(f'<span class="insert">{" ".join(compare_words[j1:j2])}</span>')
         elif tag == 'delete':
-            result_html.append(f'<span class="delete">{" ".join(correct_words[i1:i2])}</span>')
+            result_html.append(f'<span class="delete">{" ".join(base_words[i1:i2])}</span>')
 
     return ' '.join(result_html)
 
+def diff_html(correct: str, transcript: str) -> str:
+    """Creates HTML diff with insert/delete spans for evaluation results"""
+    # Normalize and remove fillers in one pass
+    correct_words = normalize_tokens(correct)
+    transcript_words = normalize_tokens(transcript)
+
+    matcher = difflib.SequenceMatcher(None, correct_words, transcript_words)
+    return render_diff_html(correct_words, transcript_words, matcher.get_opcodes())
+
 def get_diff_html(reference: str, hypothesis: str, mode='user') -> str:
     """Creates HTML diff with insert/delete spans for shadowing view"""
     # Clean up and normalize before diff
-    ref_words = normalize_text(remove_fillers(reference.lower().strip()))
-    hyp_words = normalize_text(remove_fillers(hypothesis.lower().strip()))
+    ref_words = normalize_tokens(reference)
+    hyp_words = normalize_tokens(hypothesis)
 
     if mode == 'original':
         base_words = ref_words
@@ -67,19 +67,4 @@ def get_diff_html(reference: str, hypothesis: str, mode='user') -> str:
         compare_words = ref_words
 
     sm = SequenceMatcher(None, base_words, compare_words)
-    result_html = []
-
-    for opcode, i1, i2, j1, j2 in sm.get_opcodes():
-        if opcode == 'equal':
-            result_html.append(' '.join(base_words[i1:i2]))
-        elif opcode == 'insert':
-            result_html.append(f'<span class="insert">{" ".join(compare_words[j1:j2])}</span>')
-        elif opcode == 'delete':
-            result_html.append(f'<span class="delete">{" ".join(base_words[i1:i2])}</span>')
-        elif opcode == 'replace':
-            result_html.append(
-                f'<span class="delete">{" ".join(base_words[i1:i2])}</span> '
-                f'<span class="insert">{" ".join(compare_words[j1:j2])}</span>'
-            )
-
-    return ' '.join(result_html)
\ No newline at end of file
+    return render_diff_html(base_words, compare_words, sm.get_opcodes())
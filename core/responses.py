@@ -1,6 +1,6 @@
 # core/responses.py (確認・修正ポイント)
 import logging
-from flask import jsonify, current_app
+from flask import jsonify, current_app, request
 
 def api_error_response(message, status_code=400, log_error=True, exception_info=None, log_prefix="API Error"):
     user_message = message
@@ -34,4 +34,15 @@ def api_error_response(message, status_code=400, log_error=True, exception_info=
 
 # api_success_response はそのままで良いでしょう
 def api_success_response(data, status_code=200):
-    return jsonify(data), status_code
\ No newline at end of file
+    return jsonify(data), status_code
+
+
+def cached_json_response(data, etag):
+    """
+    ETag 付きの JSON レスポンス。If-None-Match が一致すれば本文なしの 304 を返す。
+    (Cache-Control: no-cache なので、ブラウザは毎回 ETag で確認してから手元のコピーを使う)
+    """
+    response = jsonify(data)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
@@ -0,0 +1,216 @@
+# core/services/api_quota.py
+"""
+ユーザーごとの API コール枠 (トライアル / ワンタイム / 月額サブスクリプション) の予約と返却。
+
+枠の確認と使用数の加算はプランごとに 1 文の条件付き UPDATE で行う:
+
+    UPDATE users SET <tier>_used = <tier>_used + 1
+    WHERE replit_user_id = :id AND <プランが有効> AND <tier>_used < <tier>_limit
+    RETURNING <tier>_limit - <tier>_used
+
+行を読んでから書き戻さないので、複数の gunicorn ワーカーから同時に呼ばれても上限を超えて予約されることはない。
+トライアル → ワンタイム → サブスクリプションの順に試し、最初に成功したプランで予約する (旧 check_and_log_api_call と同じ順)。
+月額の使用数のリセット (api_calls_reset_date を過ぎていたら 0 から数え直す) も同じ UPDATE の中で行う。
+
+どのプランを試すかは core.services.entitlements のプラン状態のキャッシュで決める (上限の確認は常に UPDATE で行う)。
+
+文字起こしが失敗したときは refund_api_call で予約した 1 回分を返す。
+api_call_quota() はこの 2 つをまとめたコンテキストマネージャ。
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import and_, case, or_, select, update
+
+from core.services import entitlements
+from core.services.entitlements import ONETIME, SPECIAL_FREE, SUBSCRIPTION, TRIAL
+from models import db, User
+
+
+class QuotaExceededError(Exception):
+    """有効なプランの API コール枠が残っていない"""
+
+
+@dataclass(frozen=True)
+class QuotaReservation:
+    replit_user_id: str
+    tier: str
+    remaining: float # 予約後の残り回数 (特別無料アカウントは inf)
+
+
+def _tier_update(tier, replit_user_id, now):
+    """tier の枠を 1 回分予約する UPDATE 文 (予約できなければ 0 行)"""
+    own = and_(User.replit_user_id == replit_user_id, User.is_special_free_account.is_(False))
+
+    if tier == TRIAL:
+        return (update(User)
+                .where(own,
+                       User.is_trial_period_active.is_(True),
+                       or_(User.trial_expires_at.is_(None), User.trial_expires_at > now),
+                       User.trial_api_call_used < User.trial_api_call_limit)
+                .values(trial_api_call_used=User.trial_api_call_used + 1)
+                .returning(User.trial_api_call_limit - User.trial_api_call_used))
+
+    if tier == ONETIME:
+        return (update(User)
+                .where(own,
+                       User.onetime_access_expires_at > now,
+                       User.api_calls_onetime_used < User.api_calls_onetime_limit)
+                .values(api_calls_onetime_used=User.api_calls_onetime_used + 1)
+                .returning(User.api_calls_onetime_limit - User.api_calls_onetime_used))
+
+    # サブスクリプション: リセット日を過ぎていれば使用数を 0 とみなし、この予約で 1 にする
+    reset_due = and_(User.api_calls_reset_date.isnot(None), User.api_calls_reset_date <= now)
+    return (update(User)
+            .where(own,
+                   User.current_subscription_id.isnot(None),
+                   User.subscription_status == 'active',
+                   User.subscription_current_period_end > now,
+                   User.api_calls_monthly_limit > 0,
+                   or_(reset_due, User.api_calls_monthly_used < User.api_calls_monthly_limit))
+            .values(api_calls_monthly_used=case((reset_due, 1), else_=User.api_calls_monthly_used + 1),
+                    api_calls_reset_date=case((reset_due, User.subscription_current_period_end),
+                                              else_=User.api_calls_reset_date))
+            .returning(User.api_calls_monthly_limit - User.api_calls_monthly_used))
+
+
+_USED_COLUMNS = {
+    TRIAL: User.trial_api_call_used,
+    ONETIME: User.api_calls_onetime_used,
+    SUBSCRIPTION: User.api_calls_monthly_used,
+}
+
+
+def _expire_plans(replit_user_id, now):
+    """予約できなかったときだけ、期限切れ・上限到達のプランの状態を更新する (旧実装と同じ副作用)"""
+    db.session.execute(
+        update(User)
+        .where(User.replit_user_id == replit_user_id,
+               User.is_trial_period_active.is_(True),
+               or_(User.trial_expires_at <= now, User.trial_api_call_used >= User.trial_api_call_limit))
+        .values(is_trial_period_active=False)
+    )
+    db.session.execute(
+        update(User)
+        .where(User.replit_user_id == replit_user_id,
+               User.current_subscription_id.isnot(None),
+               User.subscription_status == 'active',
+               User.subscription_current_period_end <= now)
+        .values(subscription_status='expired')
+    )
+
+
+def reserve_api_call(replit_user_id, now=None):
+    """
+    API コールを 1 回分予約して QuotaReservation を返す。枠がなければ None。
+    予約はすぐに commit する (文字起こしの間、行ロックを持ち続けないため)。
+
+    どのプランを試すかはプラン状態のキャッシュ (core.services.entitlements) で決めるので、
+    よくある場合は UPDATE 1 文だけ (特別無料アカウントは DB を使わない) で済む。
+    キャッシュに有効なプランがない場合は、別のワーカーでの購入や Webhook の反映漏れがありうるので、
+    拒否する前にキャッシュを使わずに確認する。
+    """
+    now = now or datetime.now(timezone.utc)
+    snapshot = entitlements.get_plan_snapshot(replit_user_id)
+    if snapshot is None:
+        db.session.rollback()
+        current_app.logger.warning(f"APIコールチェック: ユーザーが見つかりません - {replit_user_id}")
+        return None
+    if snapshot.special_free:
+        current_app.logger.info(f"APIコール許可 (特別無料アカウント): {replit_user_id}")
+        return QuotaReservation(replit_user_id, SPECIAL_FREE, float('inf'))
+
+    tiers = snapshot.active_tiers(now)
+    if tiers:
+        reservation = _reserve_tiers(replit_user_id, tiers, now)
+        if reservation is not None:
+            return reservation
+
+    # キャッシュに有効なプランがない、またはキャッシュが古い (他のワーカーで枠を使い切った・
+    # Webhook でプランが変わったなど)。作り直して全プランを確認する
+    entitlements.invalidate(replit_user_id)
+    return _reserve_uncached(replit_user_id, now)
+
+
+def _reserve_tiers(replit_user_id, tiers, now):
+    try:
+        for tier in tiers:
+            remaining = db.session.execute(_tier_update(tier, replit_user_id, now)).scalar()
+            if remaining is not None:
+                db.session.commit()
+                current_app.logger.info(f"APIコール許可 ({tier}): {replit_user_id}, 残り {remaining}")
+                return QuotaReservation(replit_user_id, tier, remaining)
+        db.session.rollback()
+    except Exception:
+        db.session.rollback()
+        raise
+    return None
+
+
+def _reserve_uncached(replit_user_id, now):
+    """キャッシュを使わずに全プランを順に試す (予約できなければプランの状態を更新する)"""
+    reservation = _reserve_tiers(replit_user_id, (TRIAL, ONETIME, SUBSCRIPTION), now)
+    if reservation is not None:
+        return reservation
+    try:
+        is_special = db.session.execute(
+            select(User.is_special_free_account).where(User.replit_user_id == replit_user_id)
+        ).scalar()
+        if is_special:
+            db.session.rollback()
+            current_app.logger.info(f"APIコール許可 (特別無料アカウント): {replit_user_id}")
+            return QuotaReservation(replit_user_id, SPECIAL_FREE, float('inf'))
+        if is_special is None:
+            db.session.rollback()
+            current_app.logger.warning(f"APIコールチェック: ユーザーが見つかりません - {replit_user_id}")
+            return None
+
+        _expire_plans(replit_user_id, now)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    entitlements.invalidate(replit_user_id)
+    current_app.logger.info(f"APIコール拒否 (有効なプランの枠なし): {replit_user_id}")
+    return None
+
+
+def refund_api_call(reservation):
+    """予約した 1 回分を返す (文字起こしが失敗したとき)"""
+    column = _USED_COLUMNS.get(reservation.tier)
+    if column is None:
+        return # 特別無料アカウントは数えていない
+    try:
+        db.session.execute(
+            update(User)
+            .where(User.replit_user_id == reservation.replit_user_id, column > 0)
+            .values({column.key: column - 1})
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    # 使い切ったプランに枠が戻ることがあるので、キャッシュを作り直させる
+    entitlements.invalidate(reservation.replit_user_id)
+    current_app.logger.info(f"APIコール返却 ({reservation.tier}): {reservation.replit_user_id}")
+
+
+@contextmanager
+def api_call_quota(replit_user_id):
+    """
+    with api_call_quota(user_id): ... の中で API を呼ぶ。
+    枠がなければ QuotaExceededError、ブロック内で例外が起きたら予約を返却してから送出し直す。
+    """
+    reservation = reserve_api_call(replit_user_id)
+    if reservation is None:
+        raise QuotaExceededError("APIコールの上限に達しているか、有効なプランがありません。")
+    try:
+        yield reservation
+    except BaseException:
+        try:
+            refund_api_call(reservation)
+        except Exception:
+            current_app.logger.error(f"APIコールの返却に失敗しました: {replit_user_id}", exc_info=True)
+        raise
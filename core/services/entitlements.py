@@ -0,0 +1,165 @@
+# core/services/entitlements.py
+"""
+ユーザーのプラン状態 (どのプランが有効か) のプロセス内キャッシュ。
+
+API コール枠の予約 (core.services.api_quota) のたびに users を引いてトライアル / ワンタイム / サブスクリプションの
+期限を確かめ直さないよう、ユーザーごとに変更しないスナップショット (PlanSnapshot) を
+ENTITLEMENT_CACHE_TTL_SECONDS だけ保持する。
+
+- スナップショットに入れるのは「どのプランがいつまで有効か」だけで、使用数は入れない。
+  上限の確認は引き続き api_quota の条件付き UPDATE が行うので、キャッシュが古くても上限を超えることはない。
+- 枠を使い切ったプランはスナップショットに含めない。有効なプランがなければ、api_quota はキャッシュを使わずに確認してから拒否する。
+- Stripe の Webhook・ユーザーの作成・予約の失敗と返却でそのユーザーのエントリを消す。
+  別の gunicorn ワーカーのキャッシュは消えないので、そちらには最大 TTL だけ古い状態が残る。
+- 参照回数 (hit / miss) は stats() で取れる。ENTITLEMENT_CACHE_STATS_LOG_INTERVAL 回ごとにログにも出す。
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import timezone
+
+from flask import current_app, has_app_context
+from sqlalchemy import select
+
+from models import db, User
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_TTL_SECONDS = 30.0
+_DEFAULT_MAX_ENTRIES = 10000
+_DEFAULT_STATS_LOG_INTERVAL = 1000
+
+TRIAL = 'trial'
+ONETIME = 'one_time'
+SUBSCRIPTION = 'subscription'
+SPECIAL_FREE = 'special_free'
+
+
+def _aware(value):
+    # SQLite はタイムゾーンを保存しないので、naive な値は UTC とみなす
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+@dataclass(frozen=True)
+class PlanSnapshot:
+    """ある時点のユーザーのプラン状態 (作成後は変更しない)"""
+    replit_user_id: str
+    special_free: bool
+    tiers: tuple # ((tier, expires_at), ...) 枠の残っているプラン。予約を試す順
+    monthly_reset_at: object # 月額の使用数がリセットされる日時 (これを過ぎれば使い切っていても予約できる)
+    loaded_at: float # time.monotonic()
+
+    def active_tiers(self, now):
+        """now の時点で期限内のプラン名 (予約を試す順)"""
+        return tuple(
+            tier for tier, expires_at in self.tiers
+            if (expires_at is None or expires_at > now)
+            and not (tier == SUBSCRIPTION and self.monthly_reset_at is not None and now < self.monthly_reset_at)
+        )
+
+    def plan(self, now):
+        """'special_free' / 'trial' / 'one_time' / 'subscription' / 'none'"""
+        if self.special_free:
+            return SPECIAL_FREE
+        active = self.active_tiers(now)
+        return active[0] if active else 'none'
+
+
+_COLUMNS = (
+    User.is_special_free_account,
+    User.is_trial_period_active, User.trial_expires_at, User.trial_api_call_used, User.trial_api_call_limit,
+    User.onetime_access_expires_at, User.api_calls_onetime_used, User.api_calls_onetime_limit,
+    User.current_subscription_id, User.subscription_status, User.subscription_current_period_end,
+    User.api_calls_monthly_used, User.api_calls_monthly_limit, User.api_calls_reset_date,
+)
+
+
+def _load_snapshot(replit_user_id):
+    row = db.session.execute(select(*_COLUMNS).where(User.replit_user_id == replit_user_id)).one_or_none()
+    if row is None:
+        return None
+    (special, trial_active, trial_expires, trial_used, trial_limit,
+     onetime_expires, onetime_used, onetime_limit,
+     subscription_id, subscription_status, period_end, monthly_used, monthly_limit, reset_at) = row
+
+    tiers = []
+    if trial_active and (trial_used or 0) < (trial_limit or 0):
+        tiers.append((TRIAL, _aware(trial_expires)))
+    if onetime_expires is not None and (onetime_used or 0) < (onetime_limit or 0):
+        tiers.append((ONETIME, _aware(onetime_expires)))
+    reset_at = _aware(reset_at)
+    if (subscription_id and subscription_status == 'active' and period_end is not None
+            and (monthly_limit or 0) > 0 and ((monthly_used or 0) < monthly_limit or reset_at is not None)):
+        tiers.append((SUBSCRIPTION, _aware(period_end)))
+    return PlanSnapshot(
+        replit_user_id=replit_user_id,
+        special_free=bool(special),
+        tiers=tuple(tiers),
+        # 使い切っている月額プランはリセット日まで予約できない
+        monthly_reset_at=reset_at if (monthly_used or 0) >= (monthly_limit or 0) else None,
+        loaded_at=time.monotonic(),
+    )
+
+
+_snapshots = OrderedDict() # replit_user_id -> PlanSnapshot (古い順)
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def _config(key, default):
+    if has_app_context():
+        return current_app.config.get(key, default)
+    return default
+
+
+def get_plan_snapshot(replit_user_id):
+    """ユーザーの PlanSnapshot (TTL 内ならキャッシュから)。ユーザーがいなければ None (キャッシュしない)"""
+    ttl = _config('ENTITLEMENT_CACHE_TTL_SECONDS', _DEFAULT_TTL_SECONDS)
+    now = time.monotonic()
+    with _lock:
+        snapshot = _snapshots.get(replit_user_id)
+        hit = snapshot is not None and now - snapshot.loaded_at < ttl
+        _stats["hits" if hit else "misses"] += 1
+        lookups = _stats["hits"] + _stats["misses"]
+    if lookups % _config('ENTITLEMENT_CACHE_STATS_LOG_INTERVAL', _DEFAULT_STATS_LOG_INTERVAL) == 0:
+        logger.info("エンタイトルメントキャッシュ: %s", stats())
+    if hit:
+        return snapshot
+
+    snapshot = _load_snapshot(replit_user_id)
+    if snapshot is None:
+        return None
+    max_entries = _config('ENTITLEMENT_CACHE_MAX_ENTRIES', _DEFAULT_MAX_ENTRIES)
+    with _lock:
+        _snapshots.pop(replit_user_id, None)
+        _snapshots[replit_user_id] = snapshot
+        while len(_snapshots) > max_entries:
+            _snapshots.popitem(last=False)
+    return snapshot
+
+
+def invalidate(replit_user_id):
+    """ユーザーのエントリを消す (プラン・枠を変更したら commit の後に呼ぶ)"""
+    if not replit_user_id:
+        return
+    with _lock:
+        if _snapshots.pop(replit_user_id, None) is not None:
+            _stats["invalidations"] += 1
+
+
+def clear():
+    with _lock:
+        _snapshots.clear()
+
+
+def stats():
+    """{"hits", "misses", "invalidations", "size", "hit_rate"} (このプロセスの起動からの累計)"""
+    with _lock:
+        result = dict(_stats, size=len(_snapshots))
+    lookups = result["hits"] + result["misses"]
+    result["hit_rate"] = round(result["hits"] / lookups, 4) if lookups else None
+    return result
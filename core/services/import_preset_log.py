@@ -0,0 +1,90 @@
+# core/services/import_preset_log.py
+"""
+既存の練習ログファイル (旧 preset_log.json の JSON 配列、または JSONL) を practice_logs テーブルに取り込む
+(一度だけ実行する移行用)。
+
+    flask db upgrade
+    python -m core.services.import_preset_log                  # Config.LOG_FILE を取り込む
+    python -m core.services.import_preset_log --file preset_log.json --dry-run
+
+取り込み済みのエントリ (ユーザー・genre・level・日時が同じもの) はスキップするので、再実行しても重複しない。
+"""
+import argparse
+from datetime import datetime, timezone
+
+from core.services.practice_log_file import iter_records
+from core.services.practice_log_store import (
+    PRESET_PRACTICE_TYPE, add_practice_log, normalize_name, normalize_user
+)
+
+
+def _entry_key(user_key, genre, level, practiced_at):
+    return (user_key, genre, level, practiced_at)
+
+
+def import_entries(entries):
+    """
+    練習ログファイル形式のエントリを取り込んでセッションに追加する (commit は呼び出し側)。
+    (追加件数, スキップ件数) を返す。
+    """
+    from models import db, PracticeLog
+
+    existing = {
+        _entry_key(*row) for row in db.session.query(
+            PracticeLog.user_key, PracticeLog.genre, PracticeLog.level, PracticeLog.practiced_at
+        ).filter(PracticeLog.practice_type == PRESET_PRACTICE_TYPE)
+    }
+
+    imported = skipped = 0
+    for entry in entries:
+        try:
+            practiced_at = datetime.fromisoformat(entry["timestamp"])
+            if practiced_at.tzinfo is not None:
+                # DB の practiced_at はタイムゾーンなし (UTC) で保存されている
+                practiced_at = practiced_at.astimezone(timezone.utc).replace(tzinfo=None)
+            key = _entry_key(normalize_user(entry["user"]), normalize_name(entry["genre"]),
+                             normalize_name(entry["level"]), practiced_at)
+            wer = float(entry["wer"])
+        except (KeyError, TypeError, ValueError):
+            skipped += 1
+            continue
+        if key in existing or not key[1] or not key[2]:
+            skipped += 1
+            continue
+
+        add_practice_log(
+            entry["user"], entry["genre"], entry["level"], wer,
+            original_text=entry.get("original_transcribed"),
+            user_text=entry.get("user_transcribed"),
+            script_excerpt=entry.get("script_excerpt"),
+            practiced_at=practiced_at,
+        )
+        existing.add(key)
+        imported += 1
+    return imported, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--file', default=None, help='取り込むログファイル (既定: Config.LOG_FILE)')
+    parser.add_argument('--dry-run', action='store_true', help='件数だけ表示して commit しない')
+    args = parser.parse_args()
+
+    from app import app
+    from models import db
+
+    log_file = args.file or app.config['LOG_FILE']
+
+    with app.app_context():
+        imported, skipped = import_entries(iter_records(log_file))
+        if args.dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+
+    print(f"{log_file}: {imported} 件を取り込み、{skipped} 件をスキップしました"
+          + (" (dry-run)" if args.dry_run else ""))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+# core/services/job_queue.py
+"""
+文字起こし + 評価 (WER/diff) を非同期に実行するジョブキュー。
+
+- ルートは enqueue_job() でジョブを DB (transcription_jobs) に登録し、すぐに job_id を返す。
+- ワーカープロセス (core/services/job_worker.py) が queued のジョブを 1 件ずつ取得して実行する。
+- 進捗と結果は DB に書き込まれるので、どの gunicorn ワーカーからでも /api/jobs/<id> で参照できる。
+- 実行中のワーカーは heartbeat_at を JOB_HEARTBEAT_INTERVAL_SECONDS ごとに更新する。
+  ワーカーが落ちて (OOM・再起動など) heartbeat が JOB_LEASE_TIMEOUT_SECONDS 途絶えたジョブは、
+  次に claim するワーカーが queued に戻す (JOB_MAX_ATTEMPTS 回実行していれば failed にする)。
+
+ジョブの処理内容は @job_handler('<job_type>') で登録する (routes/api_routes.py, app.py を参照)。
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app, request
+from sqlalchemy import and_, func, select, update
+
+from core.services.api_quota import QuotaExceededError
+from models import db, TranscriptionJob
+
+# ジョブの状態
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_SUCCEEDED = 'succeeded'
+STATUS_FAILED = 'failed'
+
+# job_type -> handler(job, payload) -> result(dict)
+_HANDLERS = {}
+
+
+class JobError(Exception):
+    """ジョブ内で発生した、そのままユーザーに見せてよいエラー"""
+    pass
+
+
+def job_handler(job_type):
+    """ジョブの処理関数を登録するデコレータ"""
+    def decorator(func):
+        _HANDLERS[job_type] = func
+        return func
+    return decorator
+
+
+def is_async_request():
+    """リクエストが非同期実行 (async=1) を求めているか"""
+    return request.values.get('async', '').lower() in ('1', 'true', 'on')
+
+
+def enqueue_job(job_type, payload, user_id=None):
+    """
+    ジョブを登録して TranscriptionJob を返す。
+    payload['cleanup_paths'] に入れたファイルは、ジョブ終了時 (成功・失敗とも) に削除される。
+    """
+    if job_type not in _HANDLERS:
+        raise ValueError(f"未登録のジョブ種別です: {job_type}")
+
+    job = TranscriptionJob(
+        user_id=user_id,
+        job_type=job_type,
+        status=STATUS_QUEUED,
+        progress=0,
+        payload=json.dumps(payload, ensure_ascii=False)
+    )
+    db.session.add(job)
+    db.session.commit()
+    current_app.logger.info(f"Job enqueued: {job.id} ({job_type})")
+    return job
+
+
+def update_progress(job, progress, stage=None):
+    """ジョブの進捗を更新する (ハンドラから呼ぶ)"""
+    job.progress = progress
+    if stage:
+        job.stage = stage
+    job.heartbeat_at = datetime.now(timezone.utc)
+    db.session.commit()
+
+
+def job_to_dict(job):
+    """/api/jobs/<id> のレスポンス用"""
+    data = {
+        "job_id": job.id,
+        "job_type": job.job_type,
+        "status": job.status,
+        "progress": job.progress,
+        "stage": job.stage,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if job.status == STATUS_SUCCEEDED and job.result:
+        data["result"] = json.loads(job.result)
+    if job.status == STATUS_FAILED:
+        data["error"] = job.error
+    return data
+
+
+def _cleanup_files(payload, logger):
+    for path in payload.get('cleanup_paths', []):
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e_os:
+                logger.error(f"ジョブの一時ファイル削除エラー ({path}): {e_os}")
+
+
+def recover_stale_jobs(now=None):
+    """
+    heartbeat が JOB_LEASE_TIMEOUT_SECONDS 以上途絶えた running のジョブ (ワーカーが落ちたもの) を
+    queued に戻す。JOB_MAX_ATTEMPTS 回実行済みのジョブは failed にする。戻した・失敗にした件数を返す。
+    """
+    now = now or datetime.now(timezone.utc)
+    timeout = current_app.config.get('JOB_LEASE_TIMEOUT_SECONDS', 120)
+    max_attempts = current_app.config.get('JOB_MAX_ATTEMPTS', 2)
+    stale = and_(
+        TranscriptionJob.status == STATUS_RUNNING,
+        func.coalesce(TranscriptionJob.heartbeat_at, TranscriptionJob.started_at) < now - timedelta(seconds=timeout),
+    )
+
+    failed = db.session.execute(
+        update(TranscriptionJob)
+        .where(stale, TranscriptionJob.attempts >= max_attempts)
+        .values(status=STATUS_FAILED, stage='abandoned', finished_at=now,
+                error="ジョブを処理していたワーカーが停止しました。しばらくしてから再度お試しください。")
+        .returning(TranscriptionJob.id, TranscriptionJob.payload)
+    ).all()
+    requeued = db.session.execute(
+        update(TranscriptionJob)
+        .where(stale)
+        .values(status=STATUS_QUEUED, stage='requeued', progress=0)
+        .returning(TranscriptionJob.id)
+    ).scalars().all()
+    db.session.commit()
+
+    logger = current_app.logger
+    for job_id in requeued:
+        logger.warning(f"Job {job_id}: heartbeat が途絶えたため queued に戻しました")
+    for job_id, payload in failed:
+        logger.error(f"Job {job_id}: heartbeat が途絶え、実行回数の上限に達したため failed にしました")
+        _cleanup_files(json.loads(payload or '{}'), logger)
+    return len(requeued) + len(failed)
+
+
+def claim_next_job():
+    """
+    最も古い queued のジョブを running にして返す (なければ None)。
+    条件付き UPDATE で取り合うので、複数のワーカープロセスが同時に動いても
+    同じジョブを二重に実行しない。先に recover_stale_jobs() で止まったジョブを戻しておく。
+    """
+    recover_stale_jobs()
+    while True:
+        job_id = db.session.execute(
+            select(TranscriptionJob.id)
+            .where(TranscriptionJob.status == STATUS_QUEUED)
+            .order_by(TranscriptionJob.created_at)
+            .limit(1)
+        ).scalar()
+        if job_id is None:
+            db.session.commit()
+            return None
+
+        now = datetime.now(timezone.utc)
+        claimed = db.session.execute(
+            update(TranscriptionJob)
+            .where(TranscriptionJob.id == job_id, TranscriptionJob.status == STATUS_QUEUED)
+            .values(status=STATUS_RUNNING, stage='started', started_at=now, heartbeat_at=now,
+                    attempts=TranscriptionJob.attempts + 1)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return db.session.get(TranscriptionJob, job_id)
+        # 他のワーカーに先を越された場合は次のジョブを探す
+
+
+def _heartbeat_loop(engine, job_id, interval, stop_event):
+    """ジョブの実行中、interval 秒ごとに heartbeat_at を更新する (ハンドラが長い API 呼び出しで止まっていても続ける)"""
+    logger = logging.getLogger(__name__)
+    while not stop_event.wait(interval):
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                    update(TranscriptionJob)
+                    .where(TranscriptionJob.id == job_id, TranscriptionJob.status == STATUS_RUNNING)
+                    .values(heartbeat_at=datetime.now(timezone.utc))
+                )
+        except Exception:
+            logger.exception(f"Job {job_id}: heartbeat の更新に失敗しました")
+
+
+def _user_message(error):
+    """例外からユーザー向けのメッセージを作る (詳細はログにだけ残す)"""
+    if isinstance(error, (JobError, ValueError, QuotaExceededError)):
+        return str(error)
+    if isinstance(error, TimeoutError):
+        return "文字起こし処理がタイムアウトしました。時間をおいて再試行してください。"
+    if isinstance(error, ConnectionError):
+        return "外部サービスへの接続に失敗しました。しばらくしてから再試行してください。"
+    return "サーバー内部でエラーが発生しました。しばらくしてから再度お試しください。"
+
+
+def run_job(job):
+    """claim 済みのジョブを 1 件実行し、結果または失敗を DB に記録する"""
+    logger = current_app.logger
+    payload = json.loads(job.payload or '{}')
+    handler = _HANDLERS.get(job.job_type)
+    start_time = time.time()
+    stop_heartbeat = threading.Event()
+    heartbeat = threading.Thread(
+        target=_heartbeat_loop,
+        args=(db.engine, job.id, current_app.config.get('JOB_HEARTBEAT_INTERVAL_SECONDS', 15), stop_heartbeat),
+        name=f"job-heartbeat-{job.id}", daemon=True
+    )
+    heartbeat.start()
+
+    try:
+        if handler is None:
+            raise JobError(f"未登録のジョブ種別です: {job.job_type}")
+        result = handler(job, payload)
+        job.result = json.dumps(result, ensure_ascii=False)
+        job.status = STATUS_SUCCEEDED
+        job.progress = 100
+        job.stage = 'done'
+        logger.info(f"Job {job.id} ({job.job_type}) succeeded in {time.time() - start_time:.2f}s")
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Job {job.id} ({job.job_type}) failed: {type(e).__name__}: {e}", exc_info=True)
+        job.status = STATUS_FAILED
+        job.error = _user_message(e)
+    finally:
+        stop_heartbeat.set()
+        heartbeat.join()
+        job.finished_at = datetime.now(timezone.utc)
+        try:
+            db.session.commit()
+        except Exception:
+            # 結果を記録できなくてもワーカーは止めない。ジョブは heartbeat の途絶で取り直されるので、
+            # 入力ファイルは消さずに残す
+            db.session.rollback()
+            logger.exception(f"Job {job.id} ({job.job_type}): 結果の記録に失敗しました")
+        else:
+            _cleanup_files(payload, logger)
+
+
+def worker_loop(app, poll_interval=None, stop_event=None):
+    """ジョブを取り出して実行し続ける (ワーカープロセスのメインループ)"""
+    poll_interval = poll_interval or app.config.get('JOB_POLL_INTERVAL_SECONDS', 1.0)
+    logger = logging.getLogger(__name__)
+    logger.info(f"Job worker started (pid={os.getpid()})")
+
+    with app.app_context():
+        while stop_event is None or not stop_event.is_set():
+            try:
+                job = claim_next_job()
+            except Exception:
+                db.session.rollback()
+                logger.exception("ジョブの取得に失敗しました")
+                job = None
+
+            if job is None:
+                time.sleep(poll_interval)
+                continue
+            try:
+                run_job(job)
+            except Exception:
+                db.session.rollback()
+                logger.exception(f"Job {job.id} の実行中にワーカーでエラーが発生しました")
+            finally:
+                db.session.remove()
@@ -0,0 +1,61 @@
+# core/services/job_worker.py
+"""
+非同期ジョブのワーカープロセスを起動する。
+
+    python -m core.services.job_worker               # Config.JOB_WORKERS 個のプロセス
+    python -m core.services.job_worker --workers 4
+    TRANSCRIBER=fake python -m core.services.job_worker   # Whisper を使わずにオフラインで動作確認
+
+各プロセスは app を読み込み、transcription_jobs テーブルから queued のジョブを取り出して実行する。
+"""
+import argparse
+import multiprocessing
+import signal
+
+# 親プロセスの状態 (DB 接続など) を引き継がないよう spawn で起動する
+_MP_CONTEXT = multiprocessing.get_context('spawn')
+
+
+def _worker_main(poll_interval):
+    # app の読み込みはプロセスごとに行う (DB 接続をプロセス間で共有しないため)
+    from app import app
+    from core.services.job_queue import worker_loop
+
+    signal.signal(signal.SIGTERM, lambda *_: exit(0))
+    worker_loop(app, poll_interval=poll_interval)
+
+
+def start_worker_pool(num_workers, poll_interval=None):
+    """ワーカープロセスを num_workers 個起動してリストで返す"""
+    processes = []
+    for i in range(num_workers):
+        process = _MP_CONTEXT.Process(
+            target=_worker_main, args=(poll_interval,), name=f"job-worker-{i}", daemon=True
+        )
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=None, help='ワーカープロセス数 (既定: Config.JOB_WORKERS)')
+    parser.add_argument('--poll-interval', type=float, default=None, help='キューが空のときの待ち時間 (秒)')
+    args = parser.parse_args()
+
+    num_workers = args.workers
+    if num_workers is None:
+        from app import app
+        num_workers = app.config.get('JOB_WORKERS', 2)
+
+    processes = start_worker_pool(num_workers, args.poll_interval)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == '__main__':
+    main()
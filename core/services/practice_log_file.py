@@ -0,0 +1,233 @@
+# core/services/practice_log_file.py
+"""
+プリセット練習ログのファイル (Config.LOG_FILE) への追記・読み出し・コンパクション。
+
+ファイルは 1 行 1 レコードの JSONL で、追記のみを行う。
+- 追記: ファイルロック (flock) を取ってから 1 行書くだけなので、件数によらず一定コストで、
+  複数の gunicorn ワーカーから同時に書いても行が混ざらない。
+- fsync: 毎回ではなく LOG_FSYNC_BATCH_SIZE 件ごと、または前回から LOG_FSYNC_INTERVAL_SECONDS 秒
+  経過したときにまとめて行う (プロセス終了時にも行う)。
+- 読み出し: iter_records() が 1 行ずつ遅延して返す。旧形式 (JSON 配列) のファイルも読める。
+- コンパクション: 壊れた行・重複を除いて JSONL に書き直す (旧形式からの変換も兼ねる)。
+
+    python -m core.services.practice_log_file compact            # Config.LOG_FILE を書き直す
+    python -m core.services.practice_log_file compact --file preset_log.json --output preset_log.jsonl
+
+検索はファイルではなく practice_logs テーブル (core/services/practice_log_store.py) で行う。
+このファイルは追記専用の控え (バックアップ・外部への書き出し用) として使う。
+"""
+import argparse
+import atexit
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from flask import current_app, has_app_context
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_LOG_FILE = 'preset_log.jsonl'
+_DEFAULT_FSYNC_BATCH_SIZE = 20
+_DEFAULT_FSYNC_INTERVAL_SECONDS = 1.0
+
+
+def _config(key, default):
+    if has_app_context():
+        return current_app.config.get(key, default)
+    return default
+
+
+def default_log_path():
+    return _config('LOG_FILE', _DEFAULT_LOG_FILE)
+
+
+class PracticeLogWriter:
+    """
+    1 つのログファイルへの追記を担当する (プロセス内で共有する)。
+    ファイルはプロセスごとに開いたままにし、コンパクションで置き換えられたら開き直す。
+    """
+
+    def __init__(self, path, fsync_batch_size=_DEFAULT_FSYNC_BATCH_SIZE,
+                 fsync_interval=_DEFAULT_FSYNC_INTERVAL_SECONDS):
+        self.path = os.path.abspath(path)
+        self.fsync_batch_size = max(1, int(fsync_batch_size))
+        self.fsync_interval = float(fsync_interval)
+        self._lock = threading.Lock() # 同じプロセス内のスレッド間の排他 (flock はプロセス間)
+        self._file = None
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def _open(self):
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _ensure_current_file(self):
+        """ロック取得後に呼ぶ。開いているファイルがコンパクションで置き換えられていたら開き直す"""
+        try:
+            same = os.path.samestat(os.fstat(self._file.fileno()), os.stat(self.path))
+        except FileNotFoundError:
+            same = False
+        if not same:
+            self._sync()
+            self._file.close()
+            self._open()
+            return False
+        return True
+
+    def append(self, record):
+        """レコード (dict) を 1 行追記する"""
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._file is None:
+                self._open()
+            while True:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+                if self._ensure_current_file():
+                    break
+                # 開き直したファイルのロックを取り直す (古いファイルのロックは close で外れている)
+            try:
+                self._file.write(line)
+                self._file.flush()
+                self._pending += 1
+                if (self._pending >= self.fsync_batch_size
+                        or time.monotonic() - self._last_sync >= self.fsync_interval):
+                    self._sync()
+            finally:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def _sync(self):
+        if self._file is not None and self._pending:
+            os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(path=None):
+    path = os.path.abspath(path or default_log_path())
+    with _writers_lock:
+        writer = _writers.get(path)
+        if writer is None:
+            writer = PracticeLogWriter(
+                path,
+                fsync_batch_size=_config('LOG_FSYNC_BATCH_SIZE', _DEFAULT_FSYNC_BATCH_SIZE),
+                fsync_interval=_config('LOG_FSYNC_INTERVAL_SECONDS', _DEFAULT_FSYNC_INTERVAL_SECONDS),
+            )
+            _writers[path] = writer
+        return writer
+
+
+def append_record(record, path=None):
+    """練習ログを 1 件ファイルに追記する"""
+    get_writer(path).append(record)
+
+
+@atexit.register
+def _close_writers():
+    # まだ fsync していない行をプロセス終了時に書き出す
+    with _writers_lock:
+        for writer in _writers.values():
+            writer.close()
+
+
+def iter_records(path=None):
+    """
+    ログファイルのレコードを 1 件ずつ返す (ファイル全体をメモリに読み込まない)。
+    壊れた行 (書き込み途中で落ちた場合など) は警告を出して読み飛ばす。
+    旧形式 (JSON 配列) のファイルの場合は全体を読み込んで返す。
+    """
+    path = path or default_log_path()
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        head = f.read(1)
+        while head and head.isspace():
+            head = f.read(1)
+        f.seek(0)
+        if head == '[':
+            yield from json.load(f)
+            return
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning("%s:%d: 壊れた行を読み飛ばしました", path, line_number)
+
+
+def _record_key(record):
+    return json.dumps(record, ensure_ascii=False, sort_keys=True)
+
+
+def compact(path=None, output_path=None):
+    """
+    ログを JSONL に書き直す (壊れた行と完全に同じ内容の重複を除く)。
+    output_path を省略すると、追記をロックで止めた状態で元のファイルを置き換える。
+    (残した件数, 除いた重複の件数) を返す (壊れた行は iter_records が警告を出して読み飛ばす)。
+    """
+    path = os.path.abspath(path or default_log_path())
+    output_path = os.path.abspath(output_path or path)
+    in_place = output_path == path
+
+    with open(path, 'a+', encoding='utf-8') as lock_file:
+        if in_place:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+
+        seen = set()
+        kept = total = 0
+        fd, tmp_path = tempfile.mkstemp(prefix='.compact_', dir=os.path.dirname(output_path))
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as out:
+                for record in iter_records(path):
+                    total += 1
+                    key = _record_key(record)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    out.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+                    kept += 1
+                out.flush()
+                os.fsync(out.fileno())
+            os.chmod(tmp_path, 0o644)
+            # 追記中のプロセスはロック取得後にファイルの置き換えを検出して開き直す
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    return kept, total - kept
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    compact_parser = subparsers.add_parser('compact', help='壊れた行・重複を除いて JSONL に書き直す')
+    compact_parser.add_argument('--file', default=None, help='対象のログファイル (既定: Config.LOG_FILE)')
+    compact_parser.add_argument('--output', default=None, help='書き出し先 (既定: 元のファイルを置き換える)')
+    args = parser.parse_args()
+
+    path = args.file
+    if path is None:
+        from config import Config
+        path = Config.LOG_FILE
+
+    kept, dropped = compact(path, args.output)
+    print(f"{args.output or path}: {kept} 件を残し、重複 {dropped} 件を除きました")
+
+
+if __name__ == '__main__':
+    main()
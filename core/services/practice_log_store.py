@@ -0,0 +1,231 @@
+# core/services/practice_log_store.py
+"""
+プリセット練習のログ (旧 preset_log.json) の保存と参照。
+
+ログは practice_logs テーブル (practice_type='preset') に保存し、
+(user_key, genre, level) と practiced_at のインデックスで引く。
+ダッシュボード・詳細・ランキング・解放レベルの参照はすべてここを経由するので、
+1 ユーザーの参照コストはそのユーザーのログ件数にだけ比例する。
+
+(ユーザー, genre, level) ごとの集計 (最小 WER・回数・最終日時・合格) は user_progress に、
+練習した日は user_active_days に、ログの追加と同じトランザクションで反映する。
+ダッシュボードの表・連続日数・解放レベル・ランキングはこの集計だけを読む。
+
+既存の preset_log.json は core/services/import_preset_log.py で一度だけ取り込む。
+"""
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import and_, case, or_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, PracticeLog, UserActiveDay, UserProgress
+
+PRESET_PRACTICE_TYPE = 'preset'
+# この WER (%) 未満ならそのレベルをクリアしたとみなす
+PASSING_WER = 30.0
+
+
+def normalize_user(username):
+    """ユーザー名の比較キー (旧実装の .lower() による比較と同じ)"""
+    return (username or "").strip().lower()
+
+
+def normalize_name(name):
+    """genre / level 名の正規化 (例: ' Level1 ' -> 'level1')"""
+    return (name or "").strip().lower()
+
+
+def level_number(level_name):
+    """'level3' -> 3。形式が違う場合は -1"""
+    match = re.match(r"level(\d+)", normalize_name(level_name))
+    return int(match.group(1)) if match else -1
+
+
+def _preset_logs():
+    return PracticeLog.query.filter(PracticeLog.practice_type == PRESET_PRACTICE_TYPE)
+
+
+def add_practice_log(username, genre, level, wer, original_text=None, user_text=None,
+                     script_excerpt=None, practiced_at=None):
+    """
+    プリセット練習の結果を 1 件セッションに追加する (commit は呼び出し側で行う)。
+    追加した PracticeLog を返す。
+    """
+    log_entry = PracticeLog(
+        user_id=username,
+        user_key=normalize_user(username),
+        practice_type=PRESET_PRACTICE_TYPE,
+        genre=normalize_name(genre),
+        level=normalize_name(level),
+        wer=float(wer),
+        original_text=original_text,
+        user_text=user_text,
+        script_excerpt=script_excerpt,
+        practiced_at=practiced_at or datetime.now(timezone.utc),
+    )
+    db.session.add(log_entry)
+    _update_aggregates(log_entry)
+    return log_entry
+
+
+def _insert_for_dialect():
+    # 同じユーザーの同時書き込みでも行が競合しないよう、INSERT ... ON CONFLICT で 1 文で更新する
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return postgresql.insert
+    return sqlite.insert
+
+
+def _update_aggregates(log_entry):
+    insert = _insert_for_dialect()
+    passed = log_entry.wer < PASSING_WER
+
+    stmt = insert(UserProgress).values(
+        user_key=log_entry.user_key,
+        genre=log_entry.genre,
+        level=log_entry.level,
+        min_wer=log_entry.wer,
+        attempt_count=1,
+        last_attempt_at=log_entry.practiced_at,
+        passed=passed,
+        best_at=log_entry.practiced_at,
+        user_name=log_entry.user_id,
+    )
+    excluded = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_key', 'genre', 'level'],
+        set_={
+            'min_wer': case((excluded.min_wer < UserProgress.min_wer, excluded.min_wer),
+                            else_=UserProgress.min_wer),
+            'attempt_count': UserProgress.attempt_count + 1,
+            'last_attempt_at': case(
+                (or_(UserProgress.last_attempt_at.is_(None),
+                     excluded.last_attempt_at > UserProgress.last_attempt_at), excluded.last_attempt_at),
+                else_=UserProgress.last_attempt_at
+            ),
+            'passed': or_(UserProgress.passed, excluded.passed),
+            'best_at': case((excluded.min_wer < UserProgress.min_wer, excluded.best_at),
+                            else_=UserProgress.best_at),
+            'user_name': excluded.user_name,
+        }
+    )
+    db.session.execute(stmt)
+
+    db.session.execute(
+        insert(UserActiveDay)
+        .values(user_key=log_entry.user_key, day=log_entry.practiced_at.date())
+        .on_conflict_do_nothing(index_elements=['user_key', 'day'])
+    )
+
+
+def get_user_level_logs(username, genre, level):
+    """ユーザーの特定の genre / level のログ (古い順)"""
+    return (_preset_logs()
+            .filter(PracticeLog.user_key == normalize_user(username),
+                    PracticeLog.genre == normalize_name(genre),
+                    PracticeLog.level == normalize_name(level))
+            .order_by(PracticeLog.practiced_at)
+            .all())
+
+
+def get_min_wer_by_level(username):
+    """{(level_number, genre): 最小 WER} (ダッシュボードの表用)"""
+    rows = (db.session.query(UserProgress.genre, UserProgress.level, UserProgress.min_wer)
+            .filter(UserProgress.user_key == normalize_user(username))
+            .all())
+    result = {}
+    for genre, level, min_wer in rows:
+        level_num = level_number(level)
+        if genre and level_num >= 0:
+            result[(level_num, genre)] = min_wer
+    return result
+
+
+def get_streak(username, today=None):
+    """today (UTC の日付) から遡って連続で練習した日数"""
+    today = today or datetime.now(timezone.utc).date()
+    days = (db.session.query(UserActiveDay.day)
+            .filter(UserActiveDay.user_key == normalize_user(username), UserActiveDay.day <= today)
+            .order_by(UserActiveDay.day.desc())
+            .yield_per(100))
+
+    streak = 0
+    expected = today
+    for (day,) in days:
+        if day != expected:
+            break
+        streak += 1
+        expected -= timedelta(days=1)
+    return streak
+
+
+def _passed_levels(username):
+    return (db.session.query(UserProgress.genre, UserProgress.level)
+            .filter(UserProgress.user_key == normalize_user(username), UserProgress.passed.is_(True))
+            .all())
+
+
+def get_unlocked_levels(username):
+    """{genre: [クリア済み level, ...]}"""
+    result = defaultdict(set)
+    for genre, level in _passed_levels(username):
+        result[genre].add(level)
+    return {genre: sorted(levels) for genre, levels in result.items()}
+
+
+def get_highest_levels(username):
+    """{genre: 'levelN'} (クリア済みの最大レベル)"""
+    genre_max_level = defaultdict(int)
+    for genre, level in _passed_levels(username):
+        level_num = level_number(level)
+        if level_num > genre_max_level[genre]:
+            genre_max_level[genre] = level_num
+    return {genre: f"level{num}" for genre, num in genre_max_level.items() if num > 0}
+
+
+def _leaderboard(genre, level):
+    return UserProgress.query.filter(UserProgress.genre == normalize_name(genre),
+                                     UserProgress.level == normalize_name(level))
+
+
+def _leaderboard_entry(progress, rank):
+    return {
+        "rank": rank,
+        "user": progress.user_name or progress.user_key,
+        "wer": progress.min_wer,
+        "timestamp": progress.best_at.isoformat() if progress.best_at else "",
+        "attempts": progress.attempt_count,
+    }
+
+
+def get_leaderboard(genre, level, limit=50, offset=0):
+    """
+    genre / level のランキング (ユーザーごとのベスト WER の小さい順) の offset 番目から limit 件。
+    (entries, has_next) を返す。ix_user_progress_leaderboard の先頭から読むだけなので、
+    コストは履歴の件数ではなく offset + limit に比例する。
+    """
+    rows = (_leaderboard(genre, level)
+            .order_by(UserProgress.min_wer, UserProgress.best_at, UserProgress.user_key)
+            .offset(offset)
+            .limit(limit + 1)
+            .all())
+    entries = [_leaderboard_entry(row, offset + i + 1) for i, row in enumerate(rows[:limit])]
+    return entries, len(rows) > limit
+
+
+def count_leaderboard(genre, level):
+    """genre / level のランキングに載っているユーザー数"""
+    return _leaderboard(genre, level).count()
+
+
+def get_user_rank(username, genre, level):
+    """ユーザーの順位とベストスコア。まだ練習していなければ None"""
+    mine = UserProgress.query.get((normalize_user(username), normalize_name(genre), normalize_name(level)))
+    if mine is None:
+        return None
+    ahead = UserProgress.min_wer < mine.min_wer
+    if mine.best_at is not None:
+        ahead = or_(ahead, and_(UserProgress.min_wer == mine.min_wer, UserProgress.best_at < mine.best_at))
+    rank = _leaderboard(genre, level).filter(ahead).count() + 1
+    return _leaderboard_entry(mine, rank)
@@ -0,0 +1,268 @@
+# core/services/preset_catalog.py
+"""
+プリセット教材 (Config.PRESET_FOLDER) のカタログ。
+
+presets/ を一度だけ走査して、ジャンル・レベルの一覧、スクリプトの本文、音声のパスとサイズを
+メモリ上のマニフェストにまとめる。シャドウイングのスクリプトは読み込み時に正規化・フィラー除去して
+単語 ID 列 (core.wer_utils.EncodedReference) にしておき、/api/evaluate_shadowing はそれとアラインメントする。/api/presets, /api/sentence_structure, /api/sentences/<genre>/<level>
+はこのマニフェストから返し、リクエストごとの os.listdir やファイルの読み込みは行わない。
+
+- 変更の検出: 全ディレクトリとシャドウイングの script.txt の mtime を記録しておき、前回の確認から
+  PRESET_CATALOG_CHECK_INTERVAL_SECONDS 以上経っていれば stat だけで比較する。
+  教材の追加・削除・リネームやスクリプトの書き換えで mtime が変わると作り直す。
+- 明示的な再読み込み: 文の教材や音声をその場で書き換えた場合 (ディレクトリの mtime が変わらない) は
+      python -m core.services.preset_catalog reload
+  を実行する (ルートの mtime を更新するので、すべての gunicorn ワーカーが次の確認で作り直す)。
+- 音声の長さは /api/sentences で初めて要求されたレベルの分だけ ffprobe で測る (並列に実行)。
+  走査時には測らないので、/api/evaluate_shadowing など他のリクエストは ffprobe を待たない。
+  結果 (測れなかった場合も) はファイルのパス・mtime・サイズをキーにプロセス内に残し、
+  ファイルが変わるまで測り直さない。
+
+マニフェストの version はディレクトリとスクリプトの mtime から作るので、ETag に使える
+(/api/sentences の ETag には音声の長さも含める)。
+"""
+import argparse
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, has_app_context
+
+from core.wer_utils import encode_reference, tokenize
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_PRESET_FOLDER = 'presets'
+_DEFAULT_CHECK_INTERVAL_SECONDS = 2.0
+_PROBE_WORKERS = 8
+
+SHADOWING = 'shadowing'
+SENTENCES = 'sentences'
+
+
+def _subdirs(path):
+    try:
+        return sorted(entry.name for entry in os.scandir(path) if entry.is_dir())
+    except FileNotFoundError:
+        return []
+
+
+def _file_info(path, url):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return {"path": path, "url": url, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "duration_ms": None}
+
+
+_durations = {} # 音声のパス -> (mtime_ns, size, duration_ms or None)。カタログを作り直しても測り直さない
+_durations_lock = threading.Lock()
+
+
+def _probe_or_error(path, ffprobe):
+    from core.audio_utils import probe_duration_ms
+    try:
+        return probe_duration_ms(path, ffprobe=ffprobe), None
+    except Exception as e:
+        return None, e
+
+
+def _fill_durations(audios):
+    """audios (_file_info の dict) の duration_ms を埋める。前回から変わっていない音声は (測れなかったものも) 測り直さない"""
+    to_probe = []
+    with _durations_lock:
+        for audio in audios:
+            cached = _durations.get(audio["path"])
+            if cached is not None and cached[:2] == (audio["mtime_ns"], audio["size"]):
+                audio["duration_ms"] = cached[2]
+            else:
+                to_probe.append(audio)
+    if not to_probe:
+        return
+
+    ffprobe = _config('FFPROBE_BINARY', 'ffprobe')
+    with ThreadPoolExecutor(max_workers=_PROBE_WORKERS, thread_name_prefix='preset-probe') as executor:
+        results = list(executor.map(lambda audio: _probe_or_error(audio["path"], ffprobe), to_probe))
+    errors = []
+    with _durations_lock:
+        for audio, (duration_ms, error) in zip(to_probe, results):
+            audio["duration_ms"] = duration_ms
+            # 測れなかった音声も None として残す (リクエストのたびに ffprobe を実行しない)
+            _durations[audio["path"]] = (audio["mtime_ns"], audio["size"], duration_ms)
+            if error is not None:
+                errors.append((audio["path"], error))
+    if errors:
+        logger.warning("音声の長さを取得できませんでした: %d / %d 件 (例: %s: %s)",
+                       len(errors), len(to_probe), *errors[0])
+
+
+def _read_text(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+class PresetCatalog:
+    """ある時点の presets/ の内容 (作成後は変更しない。音声の duration_ms だけは sentence_list で後から埋める)"""
+
+    def __init__(self, root):
+        self.root = root
+        self.mtimes = {} # ディレクトリ / スクリプトのパス -> mtime_ns (変更検出用)
+        self.shadowing = {} # genre -> level -> {"script", "reference", "audio"}
+        self.sentences = {} # genre -> level -> [{"index", "text", "audio"}]
+        self._scan()
+        signature = "\n".join(f"{path}:{mtime}" for path, mtime in sorted(self.mtimes.items()))
+        self.version = hashlib.sha1(signature.encode('utf-8')).hexdigest()[:16]
+
+    def _track(self, path):
+        try:
+            self.mtimes[path] = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            self.mtimes[path] = None
+
+    def _scan(self):
+        self._track(self.root)
+        for kind in (SHADOWING, SENTENCES):
+            self._track(os.path.join(self.root, kind))
+
+        base = os.path.join(self.root, SHADOWING)
+        for genre in _subdirs(base):
+            self._track(os.path.join(base, genre))
+            levels = self.shadowing[genre] = {}
+            for level in _subdirs(os.path.join(base, genre)):
+                level_path = os.path.join(base, genre, level)
+                self._track(level_path)
+                script_path = os.path.join(level_path, 'script.txt')
+                self._track(script_path)
+                script = _read_text(script_path)
+                levels[level] = {
+                    "script": script,
+                    "reference": encode_reference(tokenize(script, reference=True)) if script is not None else None,
+                    "audio": _file_info(os.path.join(level_path, 'audio.mp3'),
+                                        f"/presets/{SHADOWING}/{genre}/{level}/audio.mp3"),
+                }
+
+        base = os.path.join(self.root, SENTENCES)
+        for genre in _subdirs(base):
+            self._track(os.path.join(base, genre))
+            levels = self.sentences[genre] = {}
+            for level in _subdirs(os.path.join(base, genre)):
+                level_path = os.path.join(base, genre, level)
+                self._track(level_path)
+                items = levels[level] = []
+                for script_file in sorted(f for f in os.listdir(level_path) if f.startswith('script_')):
+                    index = script_file.split('_')[1].split('.')[0]
+                    audio_file = f'output_{index}.mp3'
+                    audio = _file_info(os.path.join(level_path, audio_file),
+                                       f"/presets/{SENTENCES}/{genre}/{level}/{audio_file}")
+                    if audio is None:
+                        continue
+                    items.append({
+                        "index": index,
+                        "text": _read_text(os.path.join(level_path, script_file)) or "",
+                        "audio": audio,
+                    })
+
+    def is_stale(self):
+        for path, mtime in self.mtimes.items():
+            try:
+                current = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                current = None
+            if current != mtime:
+                return True
+        return False
+
+    def etag(self, *parts):
+        """このバージョンのカタログから作ったレスポンスの ETag (parts でエンドポイント・引数を区別する)"""
+        key = "\0".join(str(part) for part in parts)
+        return f"{self.version}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}"
+
+    # --- 参照 ---
+
+    def structure(self, kind=SHADOWING):
+        """{genre: [level, ...]} (ジャンル・レベルとも名前順)"""
+        tree = self.shadowing if kind == SHADOWING else self.sentences
+        return {genre: sorted(levels) for genre, levels in tree.items()}
+
+    def shadowing_preset(self, genre, level):
+        """シャドウイング教材 {"script", "reference", "audio"}。存在しなければ None"""
+        return self.shadowing.get(genre, {}).get(level)
+
+    def sentence_list(self, genre, level):
+        """/api/sentences の形式のリスト (教材がなければ空)。音声の長さはここで初めて測る"""
+        items = self.sentences.get(genre, {}).get(level, [])
+        _fill_durations([item["audio"] for item in items])
+        return [
+            {"text": item["text"], "audio_file": item["audio"]["url"], "index": item["index"],
+             "duration_ms": item["audio"]["duration_ms"]}
+            for item in items
+        ]
+
+
+_catalogs = {} # root -> PresetCatalog
+_last_checked = {} # root -> time.monotonic()
+_lock = threading.Lock()
+
+
+def _config(key, default):
+    if has_app_context():
+        return current_app.config.get(key, default)
+    return default
+
+
+def get_catalog(root=None, force_reload=False):
+    """現在のカタログを返す。確認間隔を過ぎていれば変更を確認し、変わっていれば作り直す"""
+    root = root or _config('PRESET_FOLDER', _DEFAULT_PRESET_FOLDER)
+    interval = _config('PRESET_CATALOG_CHECK_INTERVAL_SECONDS', _DEFAULT_CHECK_INTERVAL_SECONDS)
+    now = time.monotonic()
+
+    catalog = _catalogs.get(root)
+    if (catalog is not None and not force_reload
+            and now - _last_checked.get(root, 0) < interval):
+        return catalog
+
+    with _lock:
+        catalog = _catalogs.get(root)
+        if force_reload or catalog is None or catalog.is_stale():
+            started = time.perf_counter()
+            catalog = PresetCatalog(root)
+            _catalogs[root] = catalog
+            logger.info("プリセットカタログを読み込みました (%s, version=%s, %.0f ms)",
+                        root, catalog.version, (time.perf_counter() - started) * 1000)
+        _last_checked[root] = now
+    return catalog
+
+
+def touch_for_reload(root):
+    """ルートの mtime を更新して、実行中の全プロセスに次の確認で作り直させる"""
+    os.utime(root, None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['reload', 'show'],
+                        help='reload: 実行中のアプリに再読み込みさせる / show: マニフェストの概要を表示')
+    parser.add_argument('--root', default=None, help='プリセットのフォルダ (既定: Config.PRESET_FOLDER)')
+    args = parser.parse_args()
+
+    root = args.root
+    if root is None:
+        from config import Config
+        root = Config.PRESET_FOLDER
+
+    if args.command == 'reload':
+        touch_for_reload(root)
+    catalog = PresetCatalog(root)
+    for kind, tree in ((SHADOWING, catalog.shadowing), (SENTENCES, catalog.sentences)):
+        print(f"{kind}: {len(tree)} genres, {sum(len(levels) for levels in tree.values())} levels")
+    print(f"version: {catalog.version}")
+
+
+if __name__ == '__main__':
+    main()
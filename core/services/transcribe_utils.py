@@ -1,9 +1,15 @@
+import hashlib
 import openai
 import os
 import time
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from flask import request, current_app
-from models import db, User # Userモデルをインポート
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, User, TranscriptionCache # Userモデルをインポート
 from datetime import datetime, timezone # timezone をインポート
+from core.services.api_quota import QuotaExceededError, api_call_quota, reserve_api_call
 
 # --- OpenAI Client の取得 ---
 _client = None # モジュールレベルのクライアント変数 (シングルトン的に使う)
@@ -38,6 +44,58 @@ def get_openai_client():
 # --- 定数 ---
 MAX_WHISPER_SIZE_MB = 25
 MAX_WHISPER_SIZE_BYTES = MAX_WHISPER_SIZE_MB * 1024 * 1024
+WHISPER_MODEL = "whisper-1"
+
+
+def compute_file_hash(filepath):
+    """音声ファイルの sha256 (hex)。ファイル全体をメモリに載せず、ブロック単位で読みながら計算する"""
+    with open(filepath, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+
+def _get_cached_transcript(audio_hash, model):
+    """キャッシュにあれば文字起こし結果を返す (LRU 用に last_used_at を更新する)"""
+    entry = db.session.get(TranscriptionCache, (audio_hash, model))
+    if entry is None:
+        return None
+    entry.hit_count = (entry.hit_count or 0) + 1
+    entry.last_used_at = datetime.now(timezone.utc)
+    db.session.commit()
+    return entry.transcript
+
+
+def _store_cached_transcript(audio_hash, model, transcript, size_bytes, max_entries):
+    """文字起こし結果をキャッシュに保存し、上限を超えた分を古い順 (last_used_at) に削除する"""
+    db.session.add(TranscriptionCache(
+        audio_hash=audio_hash, model=model, transcript=transcript, size_bytes=size_bytes
+    ))
+    db.session.commit()
+
+    excess = db.session.query(TranscriptionCache).count() - max_entries
+    if excess > 0:
+        oldest = db.session.execute(
+            select(TranscriptionCache).order_by(TranscriptionCache.last_used_at).limit(excess)
+        ).scalars().all()
+        for entry in oldest:
+            db.session.delete(entry)
+        db.session.commit()
+
+
+def fake_transcribe(filepath):
+    """
+    オフライン用の文字起こし (Config.TRANSCRIBER = 'fake')。
+    音声ファイルと同名の .txt (例: audio.webm.txt) があればその内容を、
+    なければ Config.FAKE_TRANSCRIPT を返す。FAKE_TRANSCRIBE_DELAY 秒だけ待って API の遅延を模す。
+    """
+    delay = current_app.config.get('FAKE_TRANSCRIBE_DELAY', 0)
+    if delay:
+        time.sleep(delay)
+
+    sidecar_path = filepath + '.txt'
+    if os.path.exists(sidecar_path):
+        with open(sidecar_path, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    return current_app.config.get('FAKE_TRANSCRIPT', '')
 
 
 
@@ -45,90 +103,36 @@ MAX_WHISPER_SIZE_BYTES = MAX_WHISPER_SIZE_MB * 1024 * 1024
 def check_and_log_api_call(replit_user_id: str) -> bool:
     """
     指定されたユーザーがAPIコールを実行できるか確認し、可能であればコール数を記録する。
+    (core.services.api_quota.reserve_api_call の互換ラッパー。失敗時に返却するなら api_call_quota を使う)
     Returns:
         bool: APIコールが許可される場合はTrue、そうでない場合はFalse。
-    Raises:
-        ValueError: ユーザーが見つからない場合 (get_or_create_userで対応済みなら不要)
     """
-    user = User.query.filter_by(replit_user_id=replit_user_id).first()
-    if not user:
-        # 通常、APIエンドポイントの@auth_requiredやget_or_create_userで処理されるはず
-        current_app.logger.warning(f"APIコールチェック: ユーザーが見つかりません - {replit_user_id}")
-        return False # またはエラーを発生させる
-
-    now = datetime.now(timezone.utc)
-
-    if user.is_special_free_account:
-        current_app.logger.info(f"APIコール許可 (特別無料アカウント): {replit_user_id}")
-        return True # 特別アカウントは常に許可
-
-    # 1. トライアル期間のチェック
-    if user.is_trial_period_active:
-        if user.trial_expires_at and user.trial_expires_at > now:
-            if user.trial_api_call_used < user.trial_api_call_limit:
-                user.trial_api_call_used += 1
-                db.session.commit()
-                current_app.logger.info(f"APIコール許可 (トライアル): {replit_user_id}, 残り {user.trial_api_call_limit - user.trial_api_call_used}")
-                return True
-            else:
-                user.is_trial_period_active = False # 上限に達したらトライアル終了
-                db.session.commit()
-                current_app.logger.info(f"APIコール拒否 (トライアル上限超過): {replit_user_id}")
-        else: # トライアル期限切れ
-            user.is_trial_period_active = False
-            db.session.commit()
-            current_app.logger.info(f"APIコール拒否 (トライアル期限切れ): {replit_user_id}")
-
-    # 2. ワンタイムオプションのチェック
-    if user.onetime_access_expires_at and user.onetime_access_expires_at > now:
-        if user.api_calls_onetime_used < user.api_calls_onetime_limit:
-            user.api_calls_onetime_used += 1
-            db.session.commit()
-            current_app.logger.info(f"APIコール許可 (ワンタイム): {replit_user_id}, 残り {user.api_calls_onetime_limit - user.api_calls_onetime_used}")
-            return True
-        else:
-            current_app.logger.info(f"APIコール拒否 (ワンタイム上限超過): {replit_user_id}")
-            # ワンタイム上限超過の場合、ここでreturn false せず、サブスクリプションのチェックに進んでも良い
-
-    # 3. 月額サブスクリプションのチェック
-    if user.current_subscription_id and user.subscription_status == 'active':
-        if user.subscription_current_period_end and user.subscription_current_period_end > now:
-            # リセット日の確認と処理 (Userモデルのget_active_api_limit_and_usedに集約しても良い)
-            if user.api_calls_reset_date and user.api_calls_reset_date <= now:
-                user.api_calls_monthly_used = 0
-                user.api_calls_reset_date = user.subscription_current_period_end # 次の期間終了日にリセット
-                current_app.logger.info(f"APIコール数リセット (サブスクリプション): {replit_user_id}")
-
-            if user.api_calls_monthly_used < user.api_calls_monthly_limit:
-                user.api_calls_monthly_used += 1
-                db.session.commit()
-                current_app.logger.info(f"APIコール許可 (サブスクリプション): {replit_user_id}, 残り {user.api_calls_monthly_limit - user.api_calls_monthly_used}")
-                return True
-            else:
-                current_app.logger.info(f"APIコール拒否 (サブスクリプション上限超過): {replit_user_id}")
-        else: # サブスクリプション期限切れ
-            user.subscription_status = 'expired' # またはStripe Webhookに任せる
-            db.session.commit()
-            current_app.logger.info(f"APIコール拒否 (サブスクリプション期限切れ): {replit_user_id}")
-
-    current_app.logger.info(f"APIコール拒否 (有効なプランなし): {replit_user_id}")
-    return False
-
-
-
-
-def transcribe_audio(filepath):
+    return reserve_api_call(replit_user_id) is not None
+
+
+def quota_user_id_from_request():
+    """
+    API コール枠を消費するユーザー (API_QUOTA_ENFORCED が有効で、リクエストにユーザーがある場合のみ)。
+    ルートで呼び、結果を transcribe_audio などの quota_user_id (非同期ならジョブの payload) に渡す。
+    """
+    if not current_app.config.get('API_QUOTA_ENFORCED'):
+        return None
+    return request.headers.get('X-Replit-User-Id')
+
+
+def transcribe_audio(filepath, audio_hash=None, quota_user_id=None):
     """
     指定された音声ファイルをOpenAI Whisperで文字起こしする。
-    (関数のdocstringは変更なし)
+    同じ内容 (sha256) の音声はキャッシュ (transcription_cache) から返し、API を呼ばない。
+    audio_hash: 呼び出し側で compute_file_hash() 済みなら渡す (二重に計算しないため)。
+    quota_user_id: 指定すると、API を呼ぶ前にこのユーザーの API コール枠を 1 回分予約する
+        (枠がなければ QuotaExceededError)。quota_user_id_from_request() の値を渡す。
     """
     # --- ★ 関数内で Flask の logger を使う ---
     from flask import current_app # 関数内でインポートするか、関数の引数で logger を渡す
     logger = current_app.logger # アプリケーションコンテキスト内で取得
     # --------------------------------------
 
-    client = get_openai_client() # クライアントを取得/初期化
-
     # 1. ファイル存在チェック
     if not os.path.exists(filepath):
         logger.error(f"Audio file not found: {filepath}") # ログ追加
@@ -149,14 +153,33 @@ def transcribe_audio(filepath):
         logger.error(f"File size exceeds limit ({MAX_WHISPER_SIZE_MB}MB): {filepath} ({file_size / (1024*1024):.1f}MB)") # ログ追加
         raise ValueError(f"ファイルサイズが上限 ({MAX_WHISPER_SIZE_MB}MB) を超えています: {filepath} ({file_size / (1024*1024):.1f}MB)")
 
-    # 3. OpenAI API 呼び出し
+    if current_app.config.get('TRANSCRIBER') == 'fake':
+        return fake_transcribe(filepath)
+
+    # キャッシュの参照 (失敗しても文字起こし自体は続ける)
+    max_cache_entries = current_app.config.get('TRANSCRIPTION_CACHE_MAX_ENTRIES', 0)
+    if max_cache_entries > 0:
+        try:
+            audio_hash = audio_hash or compute_file_hash(filepath)
+            cached = _get_cached_transcript(audio_hash, WHISPER_MODEL)
+            if cached is not None:
+                logger.info(f"Transcription cache hit for: {filepath} ({audio_hash[:12]})")
+                return cached
+        except (SQLAlchemyError, OSError) as e:
+            db.session.rollback()
+            logger.warning(f"Transcription cache lookup failed for {filepath}: {e}")
+
+    client = get_openai_client() # クライアントを取得/初期化
+
+    # 3. OpenAI API 呼び出し (枠を 1 回分予約し、失敗したら返却する。キャッシュヒットは消費しない)
     try:
-        with open(filepath, "rb") as audio_file:
+        with api_call_quota(quota_user_id) if quota_user_id else nullcontext(), \
+                open(filepath, "rb") as audio_file:
             start_time = time.time()
             logger.info(f"Starting OpenAI transcription for: {filepath}") # ログ追加
 
             transcript_response = client.audio.transcriptions.create(
-                model="whisper-1",
+                model=WHISPER_MODEL,
                 file=audio_file
             )
 
@@ -164,6 +187,9 @@ def transcribe_audio(filepath):
             logger.info(f"OpenAI transcription completed in {duration:.2f} seconds for: {filepath}") # ログ追加
 
     # 4. エラーハンドリング (ログは logger を使うように修正)
+    except QuotaExceededError:
+        logger.info(f"Transcription rejected (API call quota exhausted) for: {filepath}")
+        raise
     except FileNotFoundError as e:
         logger.error(f"File not found during transcription process: {filepath}", exc_info=e)
         raise e
@@ -197,4 +223,65 @@ def transcribe_audio(filepath):
         logger.warning(f"Transcription result for {filepath} was empty.")
         return ""
 
-    return transcribed_text
\ No newline at end of file
+    if max_cache_entries > 0 and audio_hash:
+        try:
+            _store_cached_transcript(audio_hash, WHISPER_MODEL, transcribed_text, file_size, max_cache_entries)
+        except SQLAlchemyError as e:
+            # 同じ音声を別のワーカーが同時に保存した場合など。結果はそのまま返す
+            db.session.rollback()
+            logger.warning(f"Failed to store transcription cache for {filepath}: {e}")
+
+    return transcribed_text
+
+
+def transcribe_files_parallel(filepaths, max_workers=None, on_file_done=None, quota_user_id=None):
+    """
+    複数の音声ファイル (長い音声のチャンクなど) を並列に文字起こしし、入力と同じ順序で結果のリストを返す。
+
+    - filepaths はジェネレータでもよい。チャンクを書き出しながら順に投入でき、
+      未完了のファイルが max_workers * 2 個に達したら書き出し側を待たせる (一時ファイルが溜まりすぎないように)。
+    - どれか 1 つでも失敗したら、まだ始まっていない分はキャンセルして最初の例外を送出する。
+      実行中の分の終了を待ってから戻るので、呼び出し側は戻った後に一時ファイルを削除してよい。
+    - on_file_done(done, total) で完了数を通知する (呼び出し元のスレッドから呼ぶ)。
+      total はジェネレータを最後まで読むまで分からないので、それまでは None を渡す。
+    - quota_user_id を指定すると、ファイルごとにそのユーザーの API コール枠を消費する (transcribe_audio と同じ)。
+    """
+    app = current_app._get_current_object()
+    max_workers = max_workers or app.config.get('TRANSCRIBE_MAX_WORKERS', 4)
+
+    def run(path):
+        # transcribe_audio は current_app と db.session を使うので、スレッドごとにアプリコンテキストを作る
+        with app.app_context():
+            return transcribe_audio(path, quota_user_id=quota_user_id)
+
+    def raise_first_failure(done_futures):
+        for future in done_futures:
+            if future.exception() is not None:
+                raise future.exception()
+
+    def report(total):
+        if on_file_done:
+            on_file_done(len(futures) - len(pending), total)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='transcribe')
+    futures = []
+    pending = set()
+    try:
+        for path in filepaths:
+            if len(pending) >= max_workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                raise_first_failure(done)
+                report(None)
+            future = executor.submit(run, path)
+            futures.append(future)
+            pending.add(future)
+
+        total = len(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            raise_first_failure(done)
+            report(total)
+
+        return [future.result() for future in futures]
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
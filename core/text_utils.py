@@ -1,7 +1,7 @@
-
 # core/text_utils.py
 import re
 import unicodedata
+from functools import lru_cache
 
 NUMBER_MAP = {
     'zero': '0', 'one': '1', 'two': '2', 'three': '3', 'four': '4',
@@ -14,40 +14,120 @@ FILLER_WORDS = {
     "kind of", "sort of", "you know what i mean"
 }
 
-def remove_fillers(text: str) -> str:
-    tokens = text.lower().split()
-    return ' '.join([t for t in tokens if t not in FILLER_WORDS])
+# 正規化で使う正規表現はモジュール読み込み時に一度だけコンパイルする
+_NON_WORD_RE = re.compile(r'[^\w\s\']')
+_EDGE_PUNCT = '.,;:!?(){}[]"\''
 
-def normalize_text(text: str) -> list:
-    if not isinstance(text, str):
-        return []
-    text = unicodedata.normalize('NFKC', text)
-    text = text.lower()
+_END = None
+
+def _build_filler_trie(phrases):
+    """フィラー (複数語を含む) をトークン単位のトライにする。終端は _END キーで表す"""
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for token in phrase.split():
+            node = node.setdefault(token, {})
+        node[_END] = True
+    return trie
+
+_FILLER_TRIE = _build_filler_trie(FILLER_WORDS)
+
+# キャッシュしておく参照テキスト (プリセットのスクリプトなど) の件数
+REFERENCE_CACHE_SIZE = 256
 
-    words = text.split()
-    normalized_words = []
+def remove_filler_tokens(tokens) -> list:
+    """
+    Drop filler words and phrases ("you know", "kind of", ...) from an
+    already-normalized token list in one pass. At each position the
+    longest filler starting there is removed; the trie depth is bounded
+    by the longest phrase, so the pass is linear in len(tokens).
+    """
+    result = []
+    append = result.append
+    n = len(tokens)
 
     i = 0
-    while i < len(words):
+    while i < n:
+        node = _FILLER_TRIE.get(tokens[i])
+        if node is None:
+            append(tokens[i])
+            i += 1
+            continue
+
+        match_end = i + 1 if _END in node else 0
+        j = i + 1
+        while j < n:
+            node = node.get(tokens[j])
+            if node is None:
+                break
+            j += 1
+            if _END in node:
+                match_end = j
+
+        if match_end:
+            i = match_end
+        else:
+            append(tokens[i])
+            i += 1
+
+    return result
+
+def remove_fillers(text: str) -> str:
+    return ' '.join(remove_filler_tokens(text.lower().split()))
+
+def _normalize(text: str) -> list:
+    """Single pass over the words of text."""
+    words = unicodedata.normalize('NFKC', text).lower().split()
+    tokens = []
+    append = tokens.append
+    n = len(words)
+
+    i = 0
+    while i < n:
         word = words[i]
         word = NUMBER_MAP.get(word, word)
 
-        if word == "gen" and i + 1 < len(words) and words[i + 1].isdigit():
-            normalized_words.append("genre")
-            normalized_words.append(words[i + 1])
+        if word == "gen" and i + 1 < n and words[i + 1].isdigit():
+            append("genre")
+            append(words[i + 1])
             i += 1
         elif word.startswith("genre") and len(word) > 5 and word[5:].isdigit():
-            normalized_words.append("genre")
-            normalized_words.append(word[5:])
+            append("genre")
+            append(word[5:])
         elif word == "im":
-            normalized_words.append("i'm")
+            append("i'm")
         else:
-            cleaned_word = re.sub(r'[^\w\s\']', '', word)
-            cleaned_word = cleaned_word.strip('.,;:!?(){}[]"\'')
-            if cleaned_word:
-                normalized_words.append(cleaned_word)
+            # str.isalnum() の文字集合は \w から '_' を除いたものなので、
+            # 英数字だけの単語 (大半) は正規表現を通さなくてよい
+            if not word.isalnum():
+                word = _NON_WORD_RE.sub('', word).strip(_EDGE_PUNCT)
+            if word:
+                append(word)
         i += 1
 
-    final_text = ' '.join(normalized_words)
-    final_text = re.sub(r'\s+', ' ', final_text).strip()
-    return final_text.split() if final_text else []
+    return tokens
+
+def normalize_text(text: str) -> list:
+    if not isinstance(text, str):
+        return []
+    return _normalize(text)
+
+def normalize_tokens(text: str) -> list:
+    """normalize_text の結果からフィラー (複数語のものも含む) を取り除いたトークン列"""
+    if not isinstance(text, str):
+        return []
+    return remove_filler_tokens(_normalize(text))
+
+@lru_cache(maxsize=REFERENCE_CACHE_SIZE)
+def _cached_reference_tokens(text: str) -> tuple:
+    return tuple(remove_filler_tokens(_normalize(text)))
+
+def normalize_reference_tokens(text: str) -> tuple:
+    """
+    normalize_tokens の LRU キャッシュ付き版 (プリセットのスクリプト用)。
+    カタログを作り直しても、変わっていないスクリプトは正規化し直さない。結果は共有されるので tuple で返す。
+    ユーザーが入力した一度きりのテキストには使わない (キャッシュを埋めて他のエントリを追い出すだけなので)。
+    """
+    if not isinstance(text, str):
+        return ()
+    return _cached_reference_tokens(text)
@@ -1,79 +1,280 @@
 import numpy as np
 import re
-from core.text_utils import remove_fillers, normalize_text
+from core.text_utils import normalize_tokens, normalize_reference_tokens
 import difflib
+from dataclasses import dataclass
+from functools import lru_cache
 
 
 
 def strip_punct(word):
     return ''.join(c for c in word if c not in '.!?,;:-')
 
-def wer(reference, hypothesis, lenient=False):
+def tokenize(text, reference=False):
     """
-    Calculate WER and related metrics
+    normalize_text + フィラー除去を適用した単語列を返す。
+    reference=True の場合は LRU キャッシュ付きの正規化を使う (結果は tuple)。
+    キャッシュするのは何度も使うプリセットのスクリプト (preset_catalog) だけにする。
+    ユーザーが貼り付けた一度きりの参照テキストはキャッシュを埋めるだけなので reference=False で正規化する。
+    """
+    if reference:
+        return normalize_reference_tokens(text)
+    return normalize_tokens(text)
+
+@dataclass(frozen=True, eq=False)
+class EncodedReference:
+    """
+    正規化・フィラー除去済みの参照テキストと、その単語 ID 列 (プリセットのスクリプト用)。
+    一度作っておけば、評価のたびに参照側を正規化・エンコードし直さずにアラインメントできる。
+    """
+    tokens: tuple
+    ids: np.ndarray
+    vocab: dict # 正規化キー -> ID
+    words: tuple # ID -> 正規化キー
+
+def _ids_for(tokens, vocab, words):
+    ids = np.empty(len(tokens), dtype=np.int32)
+    for k, token in enumerate(tokens):
+        key = strip_punct(token).lower()
+        idx = vocab.get(key)
+        if idx is None:
+            idx = vocab[key] = len(words)
+            words.append(key)
+        ids[k] = idx
+    return ids
+
+def encode_reference(tokens):
+    """トークン列から EncodedReference を作る (ID 配列は読み取り専用)"""
+    vocab = {}
+    words = []
+    ids = _ids_for(tokens, vocab, words)
+    ids.flags.writeable = False
+    return EncodedReference(tokens=tuple(tokens), ids=ids, vocab=vocab, words=tuple(words))
+
+def _encode(r, h):
+    """
+    Map reference/hypothesis tokens to integer IDs.
+    Each distinct word is normalized (strip_punct + lower) exactly once.
+    r が EncodedReference の場合は参照側の ID をそのまま使い、hypothesis だけをエンコードする。
+    """
+    if isinstance(r, EncodedReference):
+        vocab, words = dict(r.vocab), list(r.words)
+        return r.ids, _ids_for(h, vocab, words), words
+    vocab = {}
+    words = []
+    r_ids = _ids_for(r, vocab, words)
+    return r_ids, _ids_for(h, vocab, words), words
+
+# lenient モードで「一致」とみなす類似度のしきい値
+LENIENT_RATIO_THRESHOLD = 0.85
+# 単語ペアの類似度判定をリクエストをまたいでキャッシュする件数
+WER_LENIENT_CACHE_SIZE = 65536
+# 共通文字数の上限チェックで一度に確保する要素数 (メモリ使用量の上限)
+_LENIENT_BOUND_CHUNK_CELLS = 4 * 1024 * 1024
+
+@lru_cache(maxsize=WER_LENIENT_CACHE_SIZE)
+def _lenient_match(r_word, h_word):
+    return difflib.SequenceMatcher(None, r_word, h_word).ratio() >= LENIENT_RATIO_THRESHOLD
+
+def _lenient_table(r_ids, h_ids, words):
+    """
+    Build the lenient match table over the unique word pairs.
+
+    Returns (r_keys, h_keys, table) where table[r_keys[i], h_keys[j]] is
+    True when reference word i and hypothesis word j count as a match.
+    SequenceMatcher only runs for pairs that survive the vectorized
+    upper bounds (length, then shared character counts), and its results
+    are memoized in a bounded LRU shared across requests.
+    """
+    r_unique, r_keys = np.unique(r_ids, return_inverse=True)
+    h_unique, h_keys = np.unique(h_ids, return_inverse=True)
+    table = r_unique[:, None] == h_unique[None, :]
+    if table.size == 0:
+        return r_keys, h_keys, table
+
+    r_words = [words[k] for k in r_unique]
+    h_words = [words[k] for k in h_unique]
+
+    # ratio = 2M / (len_r + len_h) で、M は min(len_r, len_h) と
+    # 共通文字数の和の両方を超えない。上限がしきい値に届かないペアは除外する
+    alphabet = {c: k for k, c in enumerate(sorted(set(''.join(r_words + h_words))))}
+
+    def char_counts(ws):
+        counts = np.zeros((len(ws), max(len(alphabet), 1)), dtype=np.uint16)
+        for row, w in enumerate(ws):
+            for c in w:
+                counts[row, alphabet[c]] += 1
+        return counts
+
+    r_len = np.array([len(w) for w in r_words])
+    h_len = np.array([len(w) for w in h_words])
+    r_counts, h_counts = char_counts(r_words), char_counts(h_words)
+    total = r_len[:, None] + h_len[None, :]
+    threshold = LENIENT_RATIO_THRESHOLD * total - 1e-9
+
+    candidates = 2 * np.minimum(r_len[:, None], h_len[None, :]) >= threshold
+    chunk_rows = max(1, _LENIENT_BOUND_CHUNK_CELLS // h_counts.size)
+    for start in range(0, len(r_words), chunk_rows):
+        rows = slice(start, start + chunk_rows)
+        shared = np.minimum(r_counts[rows, None, :], h_counts[None, :, :]).sum(axis=2, dtype=np.int32)
+        candidates[rows] &= 2 * shared >= threshold[rows]
+    candidates &= ~table
+
+    for i, j in zip(*np.nonzero(candidates)):
+        table[i, j] = _lenient_match(r_words[i], h_words[j])
+    return r_keys, h_keys, table
+
+def _cost_row(r_id, h_ids, table):
+    """1 行分の置換コスト (0 = 一致, 1 = 不一致) を返す"""
+    if table is None:
+        return (h_ids != r_id).astype(np.int32)
+    return (~table[r_id][h_ids]).astype(np.int32)
+
+def _is_match(r_id, h_id, table):
+    if table is None:
+        return r_id == h_id
+    return table[r_id, h_id]
+
+# 行列全体を確保するのはこのセル数まで。超えたら線形メモリのモードに切り替える
+# (uint16 なら 4M セル = 8MB)
+WER_FULL_MATRIX_MAX_CELLS = 4 * 1024 * 1024
+
+def _next_row(prev, i, r_id, h_ids, table, offsets):
     """
-    # ここはそのまま使えるはず
-    r_normalized_list = normalize_text(reference)
-    h_normalized_list = normalize_text(hypothesis)
-
-    # remove_fillers は文字列を引数に取るので、一度結合してから再度分割
-    r = remove_fillers(' '.join(r_normalized_list)).split() if r_normalized_list else []
-    h = remove_fillers(' '.join(h_normalized_list)).split() if h_normalized_list else []
-
-    rows = len(r) + 1
-    cols = len(h) + 1
-    d = np.zeros((rows, cols), dtype=np.uint16)
-
-    for i in range(rows):
-        d[i][0] = i
-    for j in range(cols):
-        d[0][j] = j
-
-    for i in range(1, rows):
-        for j in range(1, cols):
-            r_word = strip_punct(r[i-1]).lower()
-            h_word = strip_punct(h[j-1]).lower()
-
-            if lenient:
-                ratio = difflib.SequenceMatcher(None, r_word, h_word).ratio()
-                cost = 0 if ratio >= 0.85 else 1
-            else:
-                cost = 0 if r_word == h_word else 1
-
-            d[i][j] = min(
-                d[i-1][j] + 1,      # deletion
-                d[i][j-1] + 1,      # insertion
-                d[i-1][j-1] + cost  # substitution
-            )
-
-    i, j = len(r), len(h)
-    S = D = I = 0
-
-    while i > 0 and j > 0:
-        if r[i-1] == h[j-1] or (lenient and difflib.SequenceMatcher(None, r[i-1], h[j-1]).ratio() >= 0.85):
+    Compute DP row i from row i-1 with NumPy.
+
+    Deletion/substitution come straight from the previous row; the
+    left-to-right insertion chain is resolved with a running minimum:
+    d[i][j] = min_k<=j (t[k] + j - k) = j + cummin(t[k] - k).
+    """
+    cost = _cost_row(r_id, h_ids, table)
+    t = np.empty(len(prev), dtype=np.int32)
+    t[0] = i
+    np.minimum(prev[1:] + 1, prev[:-1] + cost, out=t[1:])  # deletion / substitution
+    return np.minimum.accumulate(t - offsets) + offsets       # insertion
+
+def _dp_block(first_row, i_lo, i_hi, r_ids, h_ids, table):
+    """行 i_lo (= first_row) から i_hi までの DP 行列ブロックを埋める"""
+    cols = len(first_row)
+    # uint16 だと 65,535 を超えると溢れるので、必要な幅の型を選ぶ
+    d = np.empty((i_hi - i_lo + 1, cols), dtype=np.min_scalar_type(max(i_hi + 1, cols)))
+    offsets = np.arange(cols, dtype=np.int32)
+
+    prev = first_row
+    d[0] = prev
+    for i in range(i_lo + 1, i_hi + 1):
+        prev = _next_row(prev, i, r_ids[i-1], h_ids, table, offsets)
+        d[i - i_lo] = prev
+    return d
+
+def _dp_row_at(first_row, i_lo, i_target, r_ids, h_ids, table):
+    """行 i_target だけを線形メモリで求める"""
+    offsets = np.arange(len(first_row), dtype=np.int32)
+    prev = first_row
+    for i in range(i_lo + 1, i_target + 1):
+        prev = _next_row(prev, i, r_ids[i-1], h_ids, table, offsets)
+    return prev
+
+# 編集操作の記号 (_align_ops の戻り値)
+OP_EQUAL, OP_SUB, OP_DEL, OP_INS = '=', 'S', 'D', 'I'
+
+def _backtrace(d, i_lo, i, j, r_ids, h_ids, table, ops):
+    """
+    Walk back from (i, j) until row i_lo (or column 0) is reached.
+    d holds rows i_lo..i. Edit operations are appended to ops in reverse
+    order; returns the column the path enters row i_lo at.
+    """
+    while i > i_lo and j > 0:
+        r_id, h_id = r_ids[i-1], h_ids[j-1]
+        k = i - i_lo
+        if _is_match(r_id, h_id, table):
+            ops.append(OP_EQUAL)
             i -= 1
             j -= 1
-        elif d[i][j] == d[i-1][j-1] + 1:
-            S += 1
+        elif d[k][j] == d[k-1][j-1] + 1:
+            ops.append(OP_SUB)
             i -= 1
             j -= 1
-        elif d[i][j] == d[i-1][j] + 1:
-            D += 1
+        elif d[k][j] == d[k-1][j] + 1:
+            ops.append(OP_DEL)
             i -= 1
-        elif d[i][j] == d[i][j-1] + 1:
-            I += 1
+        else:
+            ops.append(OP_INS)
             j -= 1
 
-    D += i
-    I += j
+    ops.extend(OP_DEL * (i - i_lo))
+    return j
+
+def _trace_linear(first_row, i_lo, i_hi, j_end, r_ids, h_ids, table, ops):
+    """
+    Hirschberg-style divide and conquer over rows.
+
+    The lower half is traced first (from the middle row, recomputed in
+    linear memory) to find the column the path crosses the middle row at;
+    the upper half then only needs columns up to that point. Blocks small
+    enough to fit WER_FULL_MATRIX_MAX_CELLS are traced directly, so the
+    result is identical to the full-matrix backtrace.
+    """
+    cols = j_end + 1
+    first_row = first_row[:cols]
+    h_ids = h_ids[:j_end]
+
+    if (i_hi - i_lo + 1) * cols <= WER_FULL_MATRIX_MAX_CELLS or i_hi - i_lo <= 1:
+        d = _dp_block(first_row, i_lo, i_hi, r_ids, h_ids, table)
+        return _backtrace(d, i_lo, i_hi, j_end, r_ids, h_ids, table, ops)
+
+    mid = (i_lo + i_hi) // 2
+    mid_row = _dp_row_at(first_row, i_lo, mid, r_ids, h_ids, table)
+    j_mid = _trace_linear(mid_row, mid, i_hi, j_end, r_ids, h_ids, table, ops)
+    del mid_row
+    return _trace_linear(first_row, i_lo, mid, j_mid, r_ids, h_ids, table, ops)
+
+def _align_ops(r_ids, h_ids, table):
+    """
+    Return the edit operations (OP_*) of the alignment, in order.
+    大きな入力では自動的に線形メモリのモードを使う。
+    """
+    n, m = len(r_ids), len(h_ids)
+    first_row = np.arange(m + 1, dtype=np.int32)
+    ops = []
+
+    if (n + 1) * (m + 1) <= WER_FULL_MATRIX_MAX_CELLS:
+        d = _dp_block(first_row, 0, n, r_ids, h_ids, table)
+        j = _backtrace(d, 0, n, m, r_ids, h_ids, table, ops)
+    else:
+        j = _trace_linear(first_row, 0, n, m, r_ids, h_ids, table, ops)
+
+    # 行 0 に到達した後の残りは挿入
+    ops.extend(OP_INS * j)
+    ops.reverse()
+    return ops
 
-    N = len(r)
-    wer_percent = ((S + D + I) / N) * 100 if N > 0 else 0
-    return wer_percent, S, D, I, N
+def align_tokens(r, h, lenient=False):
+    """トークン列 (または EncodedReference) r と h のアラインメント (編集操作のリスト) を返す"""
+    r_ids, h_ids, words = _encode(r, h)
+    table = None
+    if lenient:
+        # lenient モードでは ID を類似度テーブルの行/列番号に置き換える
+        r_ids, h_ids, table = _lenient_table(r_ids, h_ids, words)
+    return _align_ops(r_ids, h_ids, table)
+
+def wer_from_ops(ops, n):
+    """編集操作のリストから (wer_percent, S, D, I, N) を求める"""
+    S, D, I = ops.count(OP_SUB), ops.count(OP_DEL), ops.count(OP_INS)
+    wer_percent = ((S + D + I) / n) * 100 if n > 0 else 0
+    return wer_percent, S, D, I, n
+
+def wer(reference, hypothesis, lenient=False):
+    """
+    Calculate WER and related metrics
+    """
+    r = tokenize(reference)
+    h = tokenize(hypothesis)
+    return wer_from_ops(align_tokens(r, h, lenient), len(r))
 
 def calculate_wer(reference, hypothesis, lenient=False):
     """
     Return WER score as decimal (0.0 - 1.0)
     """
     wer_percent, _, _, _, _ = wer(reference, hypothesis, lenient)
-    return wer_percent / 100.0
\ No newline at end of file
+    return wer_percent / 100.0
@@ -0,0 +1,39 @@
+"""add user timeline indexes
+
+Revision ID: df669013648f
+Revises: 9c2f777b183b
+Create Date: 2026-10-17 00:33:18.310574
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'df669013648f'
+down_revision = '9c2f777b183b'
+branch_labels = None
+depends_on = None
+
+
+# (テーブル, インデックス名, 列)
+INDEXES = [
+    ('audio_recordings', 'ix_audio_recordings_user_created_at', ['user_id', 'created_at']),
+    ('materials', 'ix_materials_user_uploaded_at', ['user_id', 'upload_timestamp']),
+    ('practice_logs', 'ix_practice_logs_user_practiced_at', ['user_id', 'practiced_at']),
+    ('practice_logs', 'ix_practice_logs_user_type_practiced_at', ['user_id', 'practice_type', 'practiced_at']),
+]
+
+
+def upgrade():
+    # Postgres では書き込みを止めないよう CREATE INDEX CONCURRENTLY で作る。
+    # CONCURRENTLY はトランザクションの中では実行できないので autocommit_block を使う (SQLite では通常の CREATE INDEX)
+    with op.get_context().autocommit_block():
+        for table, name, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for table, name, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
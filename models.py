@@ -1,5 +1,6 @@
 # models.py
 # models.py の修正案
+import uuid
 from datetime import datetime, timezone
 from flask_sqlalchemy import SQLAlchemy
 # models.py
@@ -15,9 +16,14 @@ class AudioRecording(db.Model):
     user_id       = db.Column(db.String, nullable=False) 
     filename      = db.Column(db.String, nullable=False)
     transcript    = db.Column(db.Text, nullable=False)
-    file_hash     = db.Column(db.String, unique=True, nullable=False) # Object Storage を使う場合、これは storage_key になる可能性があります
+    file_hash     = db.Column(db.String, nullable=False, index=True) # 音声の sha256 (同じ音声を複数回アップロードできるよう unique にはしない)
     created_at    = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
+    # インデックス: ユーザーの録音一覧 (/api/recordings) 用
+    __table_args__ = (
+        db.Index('ix_audio_recordings_user_created_at', 'user_id', 'created_at'),
+    )
+
 class Material(db.Model):
     # ... (既存の Material モデル) ...
     __tablename__ = 'materials'
@@ -29,6 +35,11 @@ class Material(db.Model):
     upload_timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     # 必要であれば、ファイルタイプや長さなどのメタデータを追加
 
+    # インデックス: ユーザーの教材を新しい順に一覧する用
+    __table_args__ = (
+        db.Index('ix_materials_user_uploaded_at', 'user_id', 'upload_timestamp'),
+    )
+
 class PracticeLog(db.Model):
     __tablename__ = 'practice_logs'
     id             = db.Column(db.Integer, primary_key=True)
@@ -40,6 +51,12 @@ class PracticeLog(db.Model):
     material_id    = db.Column(db.Integer, db.ForeignKey('materials.id'), nullable=True) # MaterialへのFKを追加、NULL許容に
     # --------------
 
+    # プリセット練習用 (旧 preset_log.json の user / genre / level / script_excerpt)
+    user_key       = db.Column(db.String, nullable=True) # 大文字小文字を無視して検索するための小文字化したユーザー名
+    genre          = db.Column(db.String, nullable=True)
+    level          = db.Column(db.String, nullable=True)
+    script_excerpt = db.Column(db.Text, nullable=True)
+
     wer            = db.Column(db.Float, nullable=False)
     practiced_at   = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     original_text  = db.Column(db.Text, nullable=True) # 元のテキストも保存
@@ -51,12 +68,98 @@ class PracticeLog(db.Model):
     material       = db.relationship('Material', backref=db.backref('custom_practice_logs', lazy=True))
     # --------------------------
 
-    # 制約: recording_id か material_id のどちらか一方は必須
+    # 制約: recording_id か material_id のどちらか一方は必須 (プリセット練習は genre / level で教材を特定する)
+    # インデックス: ユーザーごとの参照 (ダッシュボード・詳細・解放レベル)、日付・ランキングの参照、
+    #             ユーザーの最後の練習 (/api/recordings/last) と最後のカスタム練習 (/custom-shadowing) 用
+    __table_args__ = (
+        db.CheckConstraint(
+            "(recording_id IS NOT NULL AND material_id IS NULL) OR (recording_id IS NULL AND material_id IS NOT NULL)"
+            " OR (practice_type = 'preset' AND genre IS NOT NULL AND level IS NOT NULL)",
+            name='chk_practice_source'
+        ),
+        db.Index('ix_practice_logs_user_genre_level', 'user_key', 'genre', 'level'),
+        db.Index('ix_practice_logs_genre_level_wer', 'genre', 'level', 'wer'),
+        db.Index('ix_practice_logs_practiced_at', 'practiced_at'),
+        db.Index('ix_practice_logs_user_practiced_at', 'user_id', 'practiced_at'),
+        db.Index('ix_practice_logs_user_type_practiced_at', 'user_id', 'practice_type', 'practiced_at'),
+    )
+
+    def to_log_dict(self):
+        """旧 preset_log.json のエントリと同じ形の dict (テンプレート用)"""
+        return {
+            "timestamp": self.practiced_at.isoformat() if self.practiced_at else "",
+            "user": self.user_id,
+            "genre": self.genre,
+            "level": self.level,
+            "wer": self.wer,
+            "original_transcribed": self.original_text,
+            "user_transcribed": self.user_text,
+            "script_excerpt": self.script_excerpt,
+        }
+
+
+class UserProgress(db.Model):
+    """(ユーザー, genre, level) ごとのプリセット練習の集計 (練習ログの保存と同じトランザクションで更新する)"""
+    __tablename__ = 'user_progress'
+    user_key        = db.Column(db.String, primary_key=True) # PracticeLog.user_key と同じ (小文字化したユーザー名)
+    genre           = db.Column(db.String, primary_key=True)
+    level           = db.Column(db.String, primary_key=True)
+    min_wer         = db.Column(db.Float, nullable=False)
+    attempt_count   = db.Column(db.Integer, nullable=False, default=0)
+    last_attempt_at = db.Column(db.DateTime, nullable=True)
+    passed          = db.Column(db.Boolean, nullable=False, default=False) # 一度でも合格ライン (WER < 30) を下回ったか
+    best_at         = db.Column(db.DateTime, nullable=True) # min_wer を出した日時 (ランキングで同じ WER の順位を決める)
+    user_name       = db.Column(db.String, nullable=True) # ランキング表示用のユーザー名 (最後に練習したときの表記)
+
+    # ランキング (genre / level ごとに min_wer の小さい順) 用のインデックス
+    __table_args__ = (
+        db.Index('ix_user_progress_leaderboard', 'genre', 'level', 'min_wer', 'best_at', 'user_key'),
+    )
+
+
+class UserActiveDay(db.Model):
+    """ユーザーがプリセット練習をした日 (ダッシュボードの連続日数用)"""
+    __tablename__ = 'user_active_days'
+    user_key = db.Column(db.String, primary_key=True)
+    day      = db.Column(db.Date, primary_key=True) # UTC の日付
+
+
+class TranscriptionJob(db.Model):
+    """非同期の文字起こし・評価ジョブ (core/services/job_queue.py が処理する)"""
+    __tablename__ = 'transcription_jobs'
+    id          = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex) # 推測されにくいID
+    user_id     = db.Column(db.String, nullable=True, index=True) # 認証なしのエンドポイントでは NULL
+    job_type    = db.Column(db.String, nullable=False) # 例: 'evaluate_shadowing', 'upload_custom_audio'
+    status      = db.Column(db.String, nullable=False, default='queued') # 'queued', 'running', 'succeeded', 'failed'
+    progress    = db.Column(db.Integer, nullable=False, default=0) # 0 - 100
+    stage       = db.Column(db.String, nullable=True) # 例: 'transcribing', 'evaluating'
+    payload     = db.Column(db.Text, nullable=True) # ジョブの入力 (JSON)
+    result      = db.Column(db.Text, nullable=True) # 成功時の結果 (JSON)
+    error       = db.Column(db.Text, nullable=True) # 失敗時のユーザー向けメッセージ
+    created_at  = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    started_at  = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True) # 実行中のワーカーが定期的に更新する (途絶えたらワーカーが停止したとみなす)
+    attempts    = db.Column(db.Integer, nullable=False, default=0, server_default='0') # 実行を始めた回数
+
+    # ワーカーが「最も古い queued のジョブ」を探すためのインデックス
     __table_args__ = (
-        db.CheckConstraint('(recording_id IS NOT NULL AND material_id IS NULL) OR (recording_id IS NULL AND material_id IS NOT NULL)', name='chk_practice_source'),
+        db.Index('ix_transcription_jobs_status_created_at', 'status', 'created_at'),
     )
 
 
+class TranscriptionCache(db.Model):
+    """音声の内容 (sha256) をキーにした文字起こし結果のキャッシュ"""
+    __tablename__ = 'transcription_cache'
+    audio_hash   = db.Column(db.String(64), primary_key=True) # 音声ファイルの sha256 (hex)
+    model        = db.Column(db.String, primary_key=True) # 例: 'whisper-1'
+    transcript   = db.Column(db.Text, nullable=False)
+    size_bytes   = db.Column(db.Integer, nullable=True)
+    hit_count    = db.Column(db.Integer, nullable=False, default=0)
+    created_at   = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    last_used_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True) # LRU 削除用
+
+
 class User(db.Model): # ユーザー情報を格納するモデル (新規または既存を拡張)
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
@@ -92,7 +195,10 @@ class User(db.Model): # ユーザー情報を格納するモデル (新規また
     # practice_logs = db.relationship('PracticeLog', backref='user', lazy=True) # PracticeLogにuser_idのFKが必要
 
     def get_active_api_limit_and_used(self):
-        """現在有効なAPIコールの上限と使用数を返す"""
+        """
+        現在有効なAPIコールの上限と使用数を返す (DB は更新しない)。
+        月額のリセット日を過ぎていれば使用数は 0 として返す (実際のリセットは core.services.api_quota の予約時に行う)。
+        """
         now = datetime.now(timezone.utc)
         if self.is_special_free_account:
             return float('inf'), 0 # 特別無料アカウントは無制限
@@ -102,11 +208,8 @@ class User(db.Model): # ユーザー情報を格納するモデル (新規また
 
         if self.current_subscription_id and self.subscription_status == 'active' and \
            self.subscription_current_period_end and self.subscription_current_period_end > now:
-            # APIコール数がリセットされるべきか確認
             if self.api_calls_reset_date and self.api_calls_reset_date <= now:
-                self.api_calls_monthly_used = 0
-                self.api_calls_reset_date = self.subscription_current_period_end # 次の期間終了日にリセット
-                db.session.commit()
+                return self.api_calls_monthly_limit, 0
             return self.api_calls_monthly_limit, self.api_calls_monthly_used
 
         if self.onetime_access_expires_at and self.onetime_access_expires_at > now:
@@ -8,12 +8,12 @@ import uuid
 import math
 import json
 import tempfile
+import time
 from datetime import datetime, timedelta
 from collections import defaultdict
 from functools import wraps
 
 # Third-party imports
-import pandas as pd
 import openai
 from pydub import AudioSegment
 from flask import (
@@ -28,15 +28,22 @@ from flask_migrate import Migrate
 from werkzeug.utils import secure_filename
 
 # Local imports
-from models import db, Material, AudioRecording, PracticeLog
-from core.services.transcribe_utils import transcribe_audio
+from models import db, Material, AudioRecording, PracticeLog, TranscriptionJob
+from core.services.transcribe_utils import transcribe_audio, compute_file_hash, quota_user_id_from_request
+from core.services.api_quota import QuotaExceededError
 from core.wer_utils import wer, calculate_wer
 from core.diff_viewer import diff_html, get_diff_html
+from core.alignment import align
 from core.services.youtube_utils import youtube_bp, check_captions
 from config import config_by_name # config.pyから設定辞書をインポート
-from core.responses import api_error_response, api_success_response
-from core.audio_utils import process_and_transcribe_audio, AudioProcessingError # インポート
+from core.responses import api_error_response, api_success_response, cached_json_response
+from core.audio_utils import (
+    process_and_transcribe_audio, process_and_transcribe_file, save_upload_to_temp, AudioProcessingError
+) # インポート
 from core.auth import auth_required
+from core.services.job_queue import enqueue_job, job_handler, is_async_request, job_to_dict, update_progress
+from core.services import practice_log_file, practice_log_store
+from core.services.preset_catalog import SENTENCES, SHADOWING, get_catalog
 
 
 
@@ -54,26 +61,7 @@ api_bp = Blueprint('api', __name__, url_prefix='/api')
 
 @api_bp.route("/unlocked_levels/<username>")
 def get_unlocked_levels(username):
-    import json
-    from collections import defaultdict
-
-    with open("preset_log.json", "r") as f:
-        logs = json.load(f)
-
-    result = defaultdict(set)
-
-    for entry in logs:
-        if entry["user"].lower() != username.lower():
-            continue
-        if float(entry["wer"]) >= 30:
-            continue
-
-        genre = entry["genre"].strip().lower()
-        level = entry["level"].strip().lower()
-        result[genre].add(level)
-
-    result = {genre: sorted(list(levels)) for genre, levels in result.items()}
-    return jsonify(result)
+    return jsonify(practice_log_store.get_unlocked_levels(username))
 
 
 #POST /api/recordings/upload	Upload & transcribe new recording
@@ -117,13 +105,11 @@ def upload_recording():
 
     # transcribe_audio は FileNotFoundError, ValueError, openai系エラー, TimeoutError などをスローする可能性
     # これらはグローバルハンドラで捕捉される。
-    transcript = transcribe_audio(filepath)
+    file_hash_val = compute_file_hash(filepath) # 音声の sha256。文字起こしキャッシュのキーにも使う
+    transcript = transcribe_audio(filepath, audio_hash=file_hash_val, quota_user_id=quota_user_id_from_request())
     if transcript is None: # transcribe_audio が None を返すことは基本的にないはずだが念のため
          raise ValueError("文字起こしに失敗しました(結果がNone)。")
 
-
-    file_hash_val = str(uuid.uuid4()) # ハッシュは現状UUIDなので、特にエラーは起きない想定
-
     recording = AudioRecording(
         user_id=user_id,
         filename=filename,
@@ -149,42 +135,23 @@ def upload_recording():
 
 @api_bp.route("/presets")
 def api_presets():
-    structure = get_presets_structure()
-    return jsonify(structure)
+    catalog = get_catalog()
+    return cached_json_response(catalog.structure(SHADOWING), catalog.etag('presets'))
 
 @api_bp.route("/highest_levels/<username>")
 def get_highest_levels(username):
-    import json
-    import re
-    from collections import defaultdict
-
-    def level_number(level_name):
-        match = re.match(r"level(\d+)", level_name.lower())
-        return int(match.group(1)) if match else -1
-
-    log_file = "preset_log.json"
-    if not os.path.exists(log_file):
-        return jsonify({})
+    return jsonify(practice_log_store.get_highest_levels(username))
 
-    with open(log_file, "r", encoding="utf-8") as f:
-        logs = json.load(f)
+@api_bp.route("/leaderboards/<genre>/<level>")
+def get_leaderboard(genre, level):
+    """ユーザーごとのベスト WER のランキング (?limit=&offset= でページング、?user= で自分の順位も返す)"""
+    limit = min(max(request.args.get("limit", 20, type=int), 1), 100)
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    entries, has_next = practice_log_store.get_leaderboard(genre, level, limit=limit, offset=offset)
 
-    genre_max_level = defaultdict(int)
-
-    for entry in logs:
-        if entry["user"].lower() != username.lower():
-            continue
-
-        genre = entry.get("genre", "").strip().lower()
-        level = entry.get("level", "").strip().lower()
-        wer = float(entry.get("wer", 100))
-
-        level_num = level_number(level)
-        if wer < 30.0 and level_num > genre_max_level[genre]:
-            genre_max_level[genre] = level_num
-
-    result = {genre: f"level{num}" for genre, num in genre_max_level.items()}
-    return jsonify(result)
+    username = request.args.get("user")
+    me = practice_log_store.get_user_rank(username, genre, level) if username else None
+    return jsonify({"entries": entries, "has_next": has_next, "me": me})
 
 @api_bp.route('/recordings', methods=['GET'])
 @auth_required
@@ -222,46 +189,16 @@ def get_last_practice():
 
 @api_bp.route('/sentences/<genre>/<level>')
 def get_sentences(genre, level):
-    sentences = []
-    base_path = os.path.join('presets/sentences', genre, level)
-
-    if os.path.exists(base_path):
-        script_files = sorted([f for f in os.listdir(base_path) if f.startswith('script_')])
-
-        for script_file in script_files:
-            index = script_file.split('_')[1].split('.')[0]
-            audio_file = f'output_{index}.mp3'
-            audio_path = os.path.join(base_path, audio_file)
-
-            if os.path.exists(audio_path):
-                with open(os.path.join(base_path, script_file), 'r', encoding='utf-8') as f:
-                    text = f.read().strip()
-
-                sentences.append({
-                    'text': text,
-                    'audio_file': f'/presets/sentences/{genre}/{level}/{audio_file}',
-                    'index': index
-                })
-
-    return jsonify(sentences)
+    catalog = get_catalog()
+    sentences = catalog.sentence_list(genre, level)
+    durations = [sentence["duration_ms"] for sentence in sentences]
+    return cached_json_response(sentences, catalog.etag('sentences', genre, level, *durations))
 
 
 @api_bp.route('/sentence_structure')
 def get_sentence_structure():
-    structure = {}
-    base_path = 'presets/sentences'
-
-    if os.path.exists(base_path):
-        for genre in os.listdir(base_path):
-            genre_path = os.path.join(base_path, genre)
-            if os.path.isdir(genre_path):
-                structure[genre] = []
-                for level in os.listdir(genre_path):
-                    level_path = os.path.join(genre_path, level)
-                    if os.path.isdir(level_path):
-                        structure[genre].append(level)
-
-    return jsonify(structure)
+    catalog = get_catalog()
+    return cached_json_response(catalog.structure(SENTENCES), catalog.etag('sentence_structure'))
 
 @api_bp.route('/my_materials', methods=['GET'])
 @auth_required
@@ -295,6 +232,42 @@ def list_materials():
         return api_error_response(str(e), 500)
 
 
+def _job_accepted_response(job):
+    """非同期モードのレスポンス (202 Accepted)。結果は /api/jobs/<job_id> で取得する"""
+    return api_success_response({
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": url_for('api.get_job', job_id=job.id)
+    }, 202)
+
+
+@api_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """非同期ジョブの進捗と結果を返す"""
+    job = db.session.get(TranscriptionJob, job_id)
+    # 他のユーザーのジョブは存在しないものとして扱う
+    if not job or (job.user_id and job.user_id != request.headers.get('X-Replit-User-Id')):
+        return api_error_response("ジョブが見つかりません。", 404, log_error=False)
+    return api_success_response(job_to_dict(job))
+
+
+def _youtube_result(original_transcript_text, user_transcribed_text):
+    alignment = align(original_transcript_text, user_transcribed_text)
+    return {
+        "transcribed": user_transcribed_text,
+        "wer": round(alignment.wer * 100, 2),
+        "diff_html": alignment.diff_html()
+    }
+
+
+@job_handler('evaluate_youtube')
+def _run_youtube_job(job, payload):
+    update_progress(job, 10, 'transcribing')
+    user_transcribed_text = transcribe_audio(payload['audio_path'], quota_user_id=payload.get('quota_user_id'))
+    update_progress(job, 80, 'evaluating')
+    return _youtube_result(payload['reference_text'], user_transcribed_text)
+
+
 # evaluate_youtube (グローバルエラーハンドラ導入後)
 @api_bp.route('/evaluate_youtube', methods=['POST'])
 def evaluate_youtube():
@@ -316,21 +289,25 @@ def evaluate_youtube():
             tmp_path = tmp.name
         current_app.logger.info(f"Temporary audio file for YouTube evaluation saved to: {tmp_path}")
 
+        # 非同期モード: ジョブを登録してすぐに返す (一時ファイルはワーカーが削除する)
+        if is_async_request():
+            job = enqueue_job('evaluate_youtube', {
+                "audio_path": tmp_path,
+                "cleanup_paths": [tmp_path],
+                "reference_text": original_transcript_text,
+                "quota_user_id": quota_user_id_from_request()
+            }, user_id=request.headers.get('X-Replit-User-Id'))
+            tmp_path = None
+            return _job_accepted_response(job)
+
         # 3. 文字起こし (ValueError, openai系エラー, TimeoutError などはグローバルハンドラへ)
-        user_transcribed_text = transcribe_audio(tmp_path)
+        user_transcribed_text = transcribe_audio(tmp_path, quota_user_id=quota_user_id_from_request())
         if user_transcribed_text is None:
              raise ValueError("文字起こしに失敗しました(結果がNone)。")
 
         # 4. WER計算とDiff生成 (ValueError などはグローバルハンドラへ)
-        wer_score_val = calculate_wer(original_transcript_text, user_transcribed_text)
-        diff_result_html = diff_html(original_transcript_text, user_transcribed_text)
-
         # 5. 成功レスポンス
-        return api_success_response({
-            "transcribed": user_transcribed_text,
-            "wer": round(wer_score_val * 100, 2),
-            "diff_html": diff_result_html
-        })
+        return api_success_response(_youtube_result(original_transcript_text, user_transcribed_text))
 
     # ルート固有の例外処理や、グローバルハンドラに渡したくない例外があればここでキャッチ。
     # 基本的にはグローバルハンドラに任せる。
@@ -351,7 +328,6 @@ def evaluate_youtube():
 @auth_required
 def log_practice():
         data = request.json
-        user_id = data.get("user") # 'user' が存在しない場合の考慮が必要
 
         # ★ 認証: @auth_required を使うか、ここで user_id をヘッダーから取得/検証する
         # if not user_id:
@@ -364,33 +340,35 @@ def log_practice():
             return api_error_response("Invalid request data", 400)
 
         # ★ キー存在と型チェック: data['key'] は KeyError のリスク、float(data['wer']) は ValueError/TypeError のリスク
-        required_fields = ["user", "genre", "level", "wer", "original_transcribed", "user_transcribed"]
+        required_fields = ["genre", "level", "wer", "original_transcribed", "user_transcribed"]
         if not all(field in data for field in required_fields):
             return api_error_response("Missing required fields", 400)
+        # shadowing-main.js は 'username' で送ってくる (旧形式の 'user' も受け付ける)
+        username = data.get("user") or data.get("username")
+        if not username:
+            return api_error_response("Missing required fields", 400)
 
         try:
             # ★ データ変換時のエラー考慮
             wer_value = float(data["wer"])
 
-            # genre, level は PracticeLog モデルに存在しない？
-            # もし保存したい場合はモデルにカラム追加が必要。
-            # 現在の PracticeLog モデルには genre, level はないためコメントアウト
-            log_entry = PracticeLog(
-                user_id=data["user"],
-                # practice_type='preset', # preset固定か？データから取るべきか？
-                # recording_id=None, # presetの場合、対応するAudioRecording IDは？
-                # material_id=None,  # presetなので material_id は使わない想定
-                # genre=data["genre"], # モデルにカラム追加が必要
-                # level=data["level"], # モデルにカラム追加が必要
-                wer=wer_value,
+            log_entry = practice_log_store.add_practice_log(
+                username,
+                data["genre"],
+                data["level"],
+                wer_value,
                 original_text=data["original_transcribed"],
                 user_text=data["user_transcribed"],
-                practiced_at=datetime.utcnow()
+                script_excerpt=data.get("script_excerpt"),
             )
-
-            db.session.add(log_entry)
             db.session.commit() # ★ DBエラーはここで発生
 
+            # ファイルの控えは追記のみ。失敗しても DB には保存済みなのでレスポンスは成功にする
+            try:
+                practice_log_file.append_record(log_entry.to_log_dict())
+            except OSError as e_os:
+                current_app.logger.error("練習ログのファイルへの追記に失敗しました", exc_info=e_os)
+
             return api_success_response({"message": "Logged successfully", "id": log_entry.id}) # ★ api_success_response を使用
 
         except (ValueError, TypeError) as e:
@@ -416,8 +394,9 @@ def compare_passages():
     passage1 = data.get('passage1', '')
     passage2 = data.get('passage2', '')
 
-    wer_score = calculate_wer(passage1, passage2)
-    diff_result = diff_html(passage1, passage2)
+    alignment = align(passage1, passage2)
+    wer_score = alignment.wer
+    diff_result = alignment.diff_html()
 
     return jsonify({
         'wer': wer_score * 100,
@@ -455,7 +434,7 @@ def save_material():
         with open(temp_path, 'rb') as f:
             storage_client.upload_file(object_storage_key, f)
 
-        transcript = transcribe_audio(temp_path)
+        transcript = transcribe_audio(temp_path, quota_user_id=quota_user_id_from_request())
 
         os.remove(temp_path)
 
@@ -480,6 +459,71 @@ def save_material():
         return api_error_response(str(e), 500)
 
 
+def _strip_warmup(full_transcription):
+    """
+    文字起こしの先頭にあるウォームアップ (カウントダウン) 部分を取り除く。
+    通常は音声の段階で削られている (process_and_transcribe_* の strip_warmup) ので、
+    音響的に検出できなかった場合のフォールバック。
+    """
+    warmup_script = current_app.config.get('WARMUP_TRANSCRIPT', "10, 9, 8, 7, 6, 5, 4, 3, 2, 1, 0")
+    normalized_full_recorded = full_transcription.lower().strip()
+    numbers = warmup_script.split(", ")
+    possible_warmup_suffixes = [", ".join(numbers[i:]) for i in range(len(numbers))]
+    possible_warmup_suffixes.sort(key=len, reverse=True)
+    for suffix_candidate in possible_warmup_suffixes:
+        if normalized_full_recorded.startswith(suffix_candidate.lower()):
+            actual_removed_part_length = len(suffix_candidate)
+            current_app.logger.info(f"Warm-up part '{suffix_candidate}' removed.")
+            return full_transcription[actual_removed_part_length:].lstrip(" ,")
+    current_app.logger.info("Warm-up part not identified in transcription.")
+    return full_transcription
+
+
+def _custom_shadowing_result(user_id, material_id, original_transcription, full_transcription):
+    """ウォームアップ除去 → WER/Diff → PracticeLog 保存を行い、レスポンス用の dict を返す"""
+    user_transcription_for_eval = _strip_warmup(full_transcription)
+
+    # 4. WER計算とDiff生成 (正規化とアラインメントは 1 回だけ)
+    alignment = align(original_transcription, user_transcription_for_eval)
+    wer_score_val = alignment.wer
+    diff_result_html = alignment.diff_html()
+
+    new_log = PracticeLog( # PracticeLogはmodelsからimport
+        user_id=user_id,
+        practice_type='custom',
+        material_id=material_id,
+        recording_id=None, # カスタムなので recording_id は NULL
+        wer=round(wer_score_val * 100, 2),
+        original_text=original_transcription,
+        user_text=user_transcription_for_eval,
+        practiced_at=datetime.utcnow() # datetimeはimport
+    )
+    db.session.add(new_log)
+
+    # 6. コミット (全ての処理が成功した場合)
+    db.session.commit() # SQLAlchemyError はグローバルハンドラへ
+
+    current_app.logger.info(f"Custom shadowing log saved (ID: {new_log.id}) for user {user_id}, material {material_id}")
+
+    return {
+        "wer": round(wer_score_val * 100, 2),
+        "diff_html": diff_result_html,
+        "original_transcription": original_transcription,
+        "user_transcription": user_transcription_for_eval
+    }
+
+
+@job_handler('evaluate_custom_shadowing')
+def _run_custom_shadowing_job(job, payload):
+    update_progress(job, 10, 'transcribing')
+    full_transcription = process_and_transcribe_file(payload['audio_path'], strip_warmup=True,
+                                                     quota_user_id=payload.get('quota_user_id'))
+    update_progress(job, 80, 'evaluating')
+    return _custom_shadowing_result(
+        job.user_id, payload['material_id'], payload['original_transcription'], full_transcription
+    )
+
+
 # 修正後 - /api/evaluate_custom_shadowing)
 # このルートは、カスタムシャドウイングの評価を行うためのものです。
 # 以下の処理を行います:
@@ -526,53 +570,26 @@ def evaluate_custom_shadowing():
     # FileNotFoundError, ValueError, TimeoutError, ConnectionError, PermissionError, RuntimeError,
     # AudioProcessingError, SQLAlchemyError はグローバルハンドラで処理される想定。
 
-    # process_and_transcribe_audio は AudioProcessingError や transcribe_audio 内部の例外をスローする可能性
-    full_transcription = process_and_transcribe_audio(recorded_audio_file)
-
-    warmup_script = current_app.config.get('WARMUP_TRANSCRIPT', "10, 9, 8, 7, 6, 5, 4, 3, 2, 1, 0")
-    user_transcription_for_eval = full_transcription # デフォルト
-    # ... (ウォームアップ除去処理はそのまま) ...
-    normalized_full_recorded = full_transcription.lower().strip()
-    # (以下、変更前のコードからウォームアップ除去ロジックをペースト)
-    numbers = warmup_script.split(", ")
-    possible_warmup_suffixes = [", ".join(numbers[i:]) for i in range(len(numbers))]
-    possible_warmup_suffixes.sort(key=len, reverse=True)
-    for suffix_candidate in possible_warmup_suffixes:
-        if normalized_full_recorded.startswith(suffix_candidate.lower()):
-            actual_removed_part_length = len(suffix_candidate)
-            user_transcription_for_eval = full_transcription[actual_removed_part_length:].lstrip(" ,")
-            current_app.logger.info(f"Warm-up part '{suffix_candidate}' removed.")
-            break
-    else:
-         current_app.logger.info("Warm-up part not identified in transcription.")
+    # 非同期モード: 録音を保存してジョブを登録し、すぐに job_id を返す
+    if is_async_request():
+        audio_path = save_upload_to_temp(recorded_audio_file)
+        job = enqueue_job('evaluate_custom_shadowing', {
+            "audio_path": audio_path,
+            "cleanup_paths": [audio_path],
+            "material_id": material_id,
+            "original_transcription": original_transcription,
+            "quota_user_id": quota_user_id_from_request()
+        }, user_id=user_id)
+        return _job_accepted_response(job)
 
-    # 4. WER計算とDiff生成
-    wer_score_val = calculate_wer(original_transcription, user_transcription_for_eval)
-    diff_result_html = diff_html(original_transcription, user_transcription_for_eval)
+    # process_and_transcribe_audio は AudioProcessingError や transcribe_audio 内部の例外をスローする可能性
+    # ウォームアップ (カウントダウン) は音声から検出して、文字起こしの前に削る
+    full_transcription = process_and_transcribe_audio(recorded_audio_file, strip_warmup=True,
+                                                      quota_user_id=quota_user_id_from_request())
 
-    new_log = PracticeLog( # PracticeLogはmodelsからimport
-        user_id=user_id,
-        practice_type='custom',
-        material_id=material_id,
-        recording_id=None, # カスタムなので recording_id は NULL
-        wer=round(wer_score_val * 100, 2),
-        original_text=original_transcription,
-        user_text=user_transcription_for_eval,
-        practiced_at=datetime.utcnow() # datetimeはimport
+    return api_success_response(
+        _custom_shadowing_result(user_id, material_id, original_transcription, full_transcription)
     )
-    db.session.add(new_log)
-
-    # 6. コミット (全ての処理が成功した場合)
-    db.session.commit() # SQLAlchemyError はグローバルハンドラへ
-
-    current_app.logger.info(f"Custom shadowing log saved (ID: {new_log.id}) for user {user_id}, material {material_id}")
-
-    return api_success_response({
-        "wer": round(wer_score_val * 100, 2),
-        "diff_html": diff_result_html,
-        "original_transcription": original_transcription,
-        "user_transcription": user_transcription_for_eval
-    })
     # process_and_transcribe_audio 内で一時ファイルは削除されるので、ここでの finally は不要
 
 
@@ -583,11 +600,10 @@ def evaluate_shadowing():
     # 1. リクエストデータの検証 (ここはルート内で行うのが適切)
     #    検証NGの場合は、ValueError を raise するか、api_error_response を直接返す。
     #    ValueError を raise すれば、グローバルの ValueError ハンドラが対応する。
-    if 'original_audio' not in request.files or 'recorded_audio' not in request.files:
-        # グローバルハンドラで処理させる場合:
-        raise ValueError("教材音声または録音音声ファイルが不足しています。")
-        # 直接返す場合 (この方がメッセージを細かく制御できることもある):
-        # return api_error_response("教材音声または録音音声ファイルが不足しています。", 400, log_prefix="/api/evaluate_shadowing")
+    # 教材音声はサーバー側のプリセットを genre / level で特定するので受け取らない
+    # (古いクライアントが original_audio を送ってきても読まずに無視する)
+    if 'recorded_audio' not in request.files:
+        raise ValueError("録音音声ファイルが不足しています。")
 
     recorded_audio_file = request.files['recorded_audio']
     if not recorded_audio_file or not recorded_audio_file.filename:
@@ -598,44 +614,74 @@ def evaluate_shadowing():
     if not genre or not level:
         raise ValueError("ジャンルまたはレベルが指定されていません。") # グローバルハンドラが処理
 
-    # username = request.form.get("username", "anonymous") # 認証を使うなら不要になる想定
-
-    # 2. 正解テキストの取得 (プリセット教材から)
-    original_transcribed = ""
-    preset_base = current_app.config.get('PRESET_FOLDER', 'presets')
-    script_path = os.path.join(preset_base, 'shadowing', genre, level, 'script.txt')
+    # 綴りの近い単語 (類似度 0.85 以上) を一致とみなす採点 (任意)
+    lenient = request.form.get("lenient", "").lower() in ("1", "true", "on")
 
-    # [A] script_path の存在確認
-    if not os.path.exists(script_path):
-        # FileNotFoundError を raise すると、グローバルの FileNotFoundError ハンドラが対応
-        raise FileNotFoundError(f"指定された教材のスクリプトファイルが見つかりません: {script_path}")
-
-    try:
-        with open(script_path, 'r', encoding='utf-8') as f:
-            original_transcribed = f.read().strip()
-    except IOError as e: # ファイルI/O特有のエラーをここでログに記録したい場合
-        current_app.logger.error(f"スクリプトファイル '{script_path}' の読み込みに失敗しました。", exc_info=True)
-        raise # グローバルハンドラに処理を委譲
+    # username = request.form.get("username", "anonymous") # 認証を使うなら不要になる想定
 
+    # 2. 正解テキストの取得 (プリセットカタログから。ファイルパスを組み立てないので presets/ の外は参照できない)
+    preset = get_catalog().shadowing_preset(genre, level)
+    if preset is None or preset["script"] is None:
+        return api_error_response(f"指定された教材が見つかりません: {genre}/{level}", 404,
+                                  log_prefix="/api/evaluate_shadowing")
+    original_transcribed = preset["script"]
 
     if not original_transcribed:
-         current_app.logger.warning(f"スクリプトファイルが空です: {script_path}")
+         current_app.logger.warning(f"スクリプトファイルが空です: {genre}/{level}")
          # 【仕様確認】空のスクリプトをエラーとすべきか？
-         # もしエラーなら: raise ValueError(f"評価用のスクリプトが空です: {script_path}")
-
-    # [E] は↑の FileNotFoundError でカバーされる。
+         # もしエラーなら: raise ValueError(f"評価用のスクリプトが空です: {genre}/{level}")
+
+    # 非同期モード: 録音を保存してジョブを登録し、すぐに job_id を返す
+    if is_async_request():
+        audio_path = save_upload_to_temp(recorded_audio_file)
+        job = enqueue_job('evaluate_shadowing', {
+            "audio_path": audio_path,
+            "cleanup_paths": [audio_path],
+            "original_transcribed": original_transcribed,
+            "lenient": lenient,
+            "genre": genre,
+            "level": level,
+            "quota_user_id": quota_user_id_from_request()
+        }, user_id=request.headers.get('X-Replit-User-Id'))
+        return _job_accepted_response(job)
 
     # 3. 録音音声の処理と文字起こし
-    user_transcribed = process_and_transcribe_audio(recorded_audio_file, cut_head_ms=500)
+    user_transcribed = process_and_transcribe_audio(recorded_audio_file, cut_head_ms=500,
+                                                    quota_user_id=quota_user_id_from_request())
     if user_transcribed is None: # process_and_transcribe_audio がNoneを返すことはない設計のはずだが念のため
         raise ValueError("文字起こし結果が取得できませんでした。")
 
-
     # 4. WER計算とDiff生成
+    # 5. (任意) データベースへのログ保存
+    #    もしここでDB保存を行い、SQLAlchemyError が発生した場合は、
+    #    グローバルの SQLAlchemyError ハンドラがロールバックとエラーレスポンス生成を行う。
+    #    そのため、ここでの try-except は原則不要。
+
+    # 6. 成功レスポンス
+    return api_success_response(_shadowing_result(original_transcribed, user_transcribed, lenient, genre, level,
+                                                  reference=preset["reference"]))
+
+
+def _shadowing_result(original_transcribed, user_transcribed, lenient, genre, level, reference=None):
+    """
+    WER と diff を求める。reference (カタログで事前にエンコードしたスクリプト) があれば
+    参照側の正規化・エンコードを省いてそれとアラインメントする。
+    """
     try:
-        wer_score_val = calculate_wer(original_transcribed, user_transcribed)
-        diff_user = get_diff_html(original_transcribed, user_transcribed, mode='user')
-        diff_original = get_diff_html(original_transcribed, user_transcribed, mode='original')
+        # 正規化とアラインメントは 1 回だけ行い、WER と両方の diff で共有する
+        cpu_started = time.thread_time()
+        alignment = align(reference if reference is not None else original_transcribed,
+                          user_transcribed, lenient=lenient)
+        wer_score_val = alignment.wer
+        diff_user = alignment.diff_html(mode='user')
+        diff_original = alignment.diff_html(mode='original')
+        # 評価 1 回分の CPU 時間 (このスレッドのみ。文字起こしは含まない)。計測は benchmarks/bench_reference_eval.py で行い、
+        # ここでは調査用に DEBUG でだけ出す
+        current_app.logger.debug(
+            f"シャドウイング評価 {genre}/{level}: CPU {(time.thread_time() - cpu_started) * 1000:.2f} ms "
+            f"(参照 {alignment.n} 語, 発話 {len(alignment.hypothesis_words)} 語, "
+            f"事前エンコード {'あり' if reference is not None else 'なし'}, lenient={lenient})"
+        )
     except Exception as e: # WER計算/Diff生成に特化したエラーをログに残したい場合
         current_app.logger.error(f"WER/Diff計算中に予期せぬエラーが発生しました (Genre: {genre}, Level: {level})", exc_info=True)
         # ここで汎用的なExceptionハンドラに任せても良いし、
@@ -643,20 +689,30 @@ def evaluate_shadowing():
         # raise RuntimeError("評価結果の生成中に内部エラーが発生しました。") from e
         raise # グローバルハンドラに委譲
 
-
-    # 5. (任意) データベースへのログ保存
-    #    もしここでDB保存を行い、SQLAlchemyError が発生した場合は、
-    #    グローバルの SQLAlchemyError ハンドラがロールバックとエラーレスポンス生成を行う。
-    #    そのため、ここでの try-except は原則不要。
-
-    # 6. 成功レスポンス
-    return api_success_response({
+    return {
         "original_transcribed": original_transcribed,
         "user_transcribed": user_transcribed,
         "wer": round(wer_score_val * 100, 2),
         "diff_user": diff_user,
         "diff_original": diff_original
-    })
+    }
+
+
+@job_handler('evaluate_shadowing')
+def _run_shadowing_job(job, payload):
+    update_progress(job, 10, 'transcribing')
+    user_transcribed = process_and_transcribe_file(payload['audio_path'], cut_head_ms=500,
+                                                   quota_user_id=payload.get('quota_user_id'))
+    update_progress(job, 80, 'evaluating')
+    # ワーカーのカタログに同じスクリプトがあれば、事前にエンコードした参照を使う
+    preset = get_catalog().shadowing_preset(payload['genre'], payload['level'])
+    reference = None
+    if preset is not None and preset["script"] == payload['original_transcribed']:
+        reference = preset["reference"]
+    return _shadowing_result(
+        payload['original_transcribed'], user_transcribed, payload['lenient'], payload['genre'], payload['level'],
+        reference=reference
+    )
 
 @api_bp.route('/evaluate_read_aloud', methods=['POST'])
 def evaluate_read_aloud():
@@ -671,9 +727,20 @@ def evaluate_read_aloud():
     if not reference_text:
         return api_error_response("比較対象のテキストが提供されていません。", 400)
 
+    # 非同期モード: 録音を保存してジョブを登録し、すぐに job_id を返す
+    if is_async_request():
+        audio_path = save_upload_to_temp(audio_file)
+        job = enqueue_job('evaluate_read_aloud', {
+            "audio_path": audio_path,
+            "cleanup_paths": [audio_path],
+            "reference_text": reference_text,
+            "quota_user_id": quota_user_id_from_request()
+        }, user_id=request.headers.get('X-Replit-User-Id'))
+        return _job_accepted_response(job)
+
     # 2. 音声処理と文字起こし
     try:
-        user_transcribed = process_and_transcribe_audio(audio_file)
+        user_transcribed = process_and_transcribe_audio(audio_file, quota_user_id=quota_user_id_from_request())
 
     # --- ★ここから個別エラー捕捉を追加 ---
     except FileNotFoundError as e: # transcribe_audio内 or process_and_transcribe_audio内
@@ -701,6 +768,8 @@ def evaluate_read_aloud():
     except AudioProcessingError as ape: # core.audio_utils 固有のエラー
         log_prefix = "AudioProcessingError in /api/evaluate_read_aloud"
         return api_error_response(f"音声ファイルの処理中にエラーが発生しました: {str(ape)}", 500, exception_info=ape, log_prefix=log_prefix)
+    except QuotaExceededError: # API コール枠の不足はグローバルハンドラ (402) へ
+        raise
     # --- ★個別エラー捕捉ここまで ---
     except Exception as e: # その他の予期せぬエラー全般
         log_prefix = "Unexpected Error in /api/evaluate_read_aloud (Transcription Phase)"
@@ -708,8 +777,9 @@ def evaluate_read_aloud():
 
     # 3. WER計算とDiff生成
     try:
-        wer_score_val = calculate_wer(reference_text, user_transcribed)
-        diff_result_html = diff_html(reference_text, user_transcribed)
+        alignment = align(reference_text, user_transcribed)
+        wer_score_val = alignment.wer
+        diff_result_html = alignment.diff_html()
     except Exception as eval_err:
         log_prefix = "Unexpected Error in /api/evaluate_read_aloud (Evaluation Phase)"
         # 評価計算でのエラーはサーバー内部の問題
@@ -746,4 +816,17 @@ def evaluate_read_aloud():
         "diff_html": diff_result_html
         # 必要であれば reference_text もレスポンスに含める
         # "reference_text": reference_text
-    })
\ No newline at end of file
+    })
+
+
+@job_handler('evaluate_read_aloud')
+def _run_read_aloud_job(job, payload):
+    update_progress(job, 10, 'transcribing')
+    user_transcribed = process_and_transcribe_file(payload['audio_path'], quota_user_id=payload.get('quota_user_id'))
+    update_progress(job, 80, 'evaluating')
+    alignment = align(payload['reference_text'], user_transcribed)
+    return {
+        "transcribed": user_transcribed,
+        "wer": round(alignment.wer * 100, 2),
+        "diff_html": alignment.diff_html()
+    }
@@ -5,6 +5,7 @@ from datetime import datetime, timedelta, timezone # timezoneを追加
 from models import db, User, SubscriptionProduct # models.py からインポート
 from core.auth import auth_required
 from core.responses import api_success_response, api_error_response
+from core.services import entitlements
 
 stripe_bp = Blueprint('stripe', __name__, url_prefix='/api/stripe') # URLプレフィックスを/api/stripeに
 
@@ -28,6 +29,7 @@ def get_or_create_user(replit_user_id):
         user.trial_api_call_limit = current_app.config.get('TRIAL_API_CALL_LIMIT', 50)
         db.session.add(user)
         db.session.commit()
+        entitlements.invalidate(replit_user_id)
         current_app.logger.info(f"New user created with trial: {replit_user_id}")
     return user
 
@@ -231,6 +233,7 @@ def stripe_webhook():
 
             user.updated_at = datetime.now(timezone.utc)
             db.session.commit()
+            entitlements.invalidate(user.replit_user_id) # このワーカーのプラン状態のキャッシュを捨てる
 
         except stripe.error.StripeError as e:
             current_app.logger.error(f"Webhook (checkout.session.completed) Stripe APIエラー: {e}", exc_info=True)
@@ -264,6 +267,7 @@ def stripe_webhook():
 
                 user.updated_at = datetime.now(timezone.utc)
                 db.session.commit()
+                entitlements.invalidate(user.replit_user_id)
                 current_app.logger.info(f"サブスクリプション更新 (Event: {event.type}): User {user.replit_user_id}, Stripe Sub ID {stripe_sub.id}, New Status {stripe_sub.status}")
             except Exception as e:
                 current_app.logger.error(f"Webhook (customer.subscription.*) データベース更新エラー: {e}", exc_info=True)
@@ -296,6 +300,7 @@ def stripe_webhook():
                     user.api_calls_reset_date = new_period_end
                     user.updated_at = datetime.now(timezone.utc)
                     db.session.commit()
+                    entitlements.invalidate(user.replit_user_id)
                     current_app.logger.info(f"サブスクリプション支払い成功・APIコールリセット: User {user.replit_user_id}, Stripe Sub ID {stripe_subscription_id}, New Period End {new_period_end}")
                 except stripe.error.StripeError as e:
                     current_app.logger.error(f"Webhook (invoice.payment_succeeded) Stripe APIエラー: {e}", exc_info=True)
@@ -346,9 +351,7 @@ def get_user_billing_status(): # エンドポイント名を変更して明確
     user = get_or_create_user(replit_user_id) # これでユーザーがいなければトライアル状態で作成される
 
     now_utc = datetime.now(timezone.utc)
-    limit, used = user.get_active_api_limit_and_used() # このメソッドはDB更新の可能性があるので注意
-    # get_active_api_limit_and_used内でDBコミットが発生する場合、このエンドポイントはGETだが副作用を持つことになる。
-    # 理想的には、状態取得と状態更新は分離する。ここでは簡便のためそのまま。
+    limit, used = user.get_active_api_limit_and_used() # 参照のみ (月額のリセットは予約時に行う)
 
     is_subscription_active = user.current_subscription_id and \
                              user.subscription_status == 'active' and \
@@ -203,6 +203,27 @@ class CustomShadowing {
     this.dom.progressSpinner.style.display = 'none';
   }
 
+  // 非同期ジョブ (/api/jobs/<job_id>) が終わるまでポーリングし、結果を返す (失敗したら Error)
+  async waitForJob(statusUrl, intervalMs = 1500, timeoutMs = 30 * 60 * 1000) {
+    const startedAt = Date.now();
+    while (Date.now() - startedAt < timeoutMs) {
+      await new Promise(resolve => setTimeout(resolve, intervalMs));
+      const response = await fetch(statusUrl, { headers: this.requestHeaders });
+      const job = await response.json();
+      if (!response.ok) {
+        throw new Error(job.error || `処理状況を取得できませんでした (HTTP ${response.status})。`);
+      }
+      if (job.status === 'succeeded') {
+        return job.result;
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.error || '文字起こしに失敗しました。');
+      }
+      this.updateSpinnerMessage(`サーバーで文字起こし中... ${job.progress || 0}%`);
+    }
+    throw new Error('文字起こしに時間がかかっています。しばらくしてから再度お試しください。');
+  }
+
   showUserAlert(message, type = 'info') {
     this.dom.userMessageArea.textContent = message;
     this.dom.userMessageArea.style.display = 'block';
@@ -279,8 +300,9 @@ class CustomShadowing {
 
     try {
       // Promiseでラップして非同期処理を待つ
-      const data = await new Promise((resolve, reject) => {
-        xhr.open('POST', '/upload_custom_audio', true);
+      let data = await new Promise((resolve, reject) => {
+        // async=1: サーバーはジョブを登録してすぐに 202 を返す (文字起こしはワーカーが行うので、長い音声でもリクエストを塞がない)
+        xhr.open('POST', '/upload_custom_audio?async=1', true);
         // 認証ヘッダー (this.requestHeaders は initializePage でセットされている想定)
         if (this.requestHeaders.has('X-Replit-User-Id')) {
             xhr.setRequestHeader('X-Replit-User-Id', this.requestHeaders.get('X-Replit-User-Id'));
@@ -305,6 +327,10 @@ class CustomShadowing {
         xhr.send(formData);
       });
 
+      if (xhr.status === 202 && data.job_id) {
+        data = await this.waitForJob(data.status_url);
+      }
+
       this.hideSpinner();
 
       if (data.error) { // サーバーがエラーを返した場合のハンドリング
@@ -14,16 +14,16 @@ class PresetManager {
   async loadPreset(genre, level) {
     if (!genre || !level) return null;
 
+    // 音声は <audio> に URL を渡してブラウザに読み込ませる (評価時はサーバーが genre / level から教材を特定する)
     const audioUrl = `/presets/shadowing/${genre}/${level}/audio.mp3`;
     const scriptUrl = `/presets/shadowing/${genre}/${level}/script.txt`;
 
-    const audioBlob = await fetch(audioUrl).then(res => res.blob());
     const script = await fetch(scriptUrl).then(res => res.text());
 
     this.currentGenre = genre;
     this.currentLevel = level;
 
-    return { audioBlob, script };
+    return { audioUrl, script };
   }
 
   async fetchHighestLevels(username) {
@@ -1,7 +1,7 @@
 // Main shadowing functionality
 const recorder = new AudioRecorder();
 const presetManager = new PresetManager();
-let originalAudioBlob = null;
+let originalAudioUrl = null;
 let currentScript = "";
 let highestLevels = {};
 
@@ -104,10 +104,10 @@ async function loadPreset() {
     const result = await presetManager.loadPreset(genre, level);
     if (!result) return;
 
-    originalAudioBlob = result.audioBlob;
+    originalAudioUrl = result.audioUrl;
     currentScript = result.script;
 
-    document.getElementById("originalAudio").src = URL.createObjectURL(originalAudioBlob);
+    document.getElementById("originalAudio").src = originalAudioUrl;
     document.getElementById("displayScript").textContent = currentScript;
     document.getElementById("presetLoaded").style.display = "block";
   } catch (error) {
@@ -199,13 +199,12 @@ function stopRecording() {
 
 
 async function submitRecording() {
-  if (!originalAudioBlob || !recorder.getBlob() || !currentScript) {
+  if (!originalAudioUrl || !recorder.getBlob() || !currentScript) {
     alert("プリセットと録音が揃っていません。");
     return;
   }
 
   const formData = new FormData();
-  formData.append("original_audio", originalAudioBlob);
   formData.append("recorded_audio", recorder.getBlob());
 
   const username = localStorage.getItem("username") || "anonymous";